@@ -0,0 +1,52 @@
+"""Batch Commands"""
+
+from discord.ext.commands import Bot, Cog, Context, command, parameter
+
+from utils.batch import MAX_BATCH_COMMANDS, get_batch_pages, parse_batch, run_batch
+from utils.limits import limited
+
+
+class Batch(Cog):
+    """Cog defining commands which run other commands"""
+
+    def __init__(self: "Batch", bot: Bot) -> None:
+        """Init Cog
+
+        Args:
+            bot (`Bot`): Discord Bot object
+        """
+        self.bot = bot
+
+    @command(name="batch", help="Run several commands at once, one per line")
+    @limited("batch")
+    async def run_commands(
+        self: "Batch",
+        ctx: Context,
+        *,
+        commands: str = parameter(description="The commands to run, one per line (e.g. '!crit 40 fire' and '!roll 2 6' on separate lines)"),
+    ) -> None:
+        """Run several commands from a single message, replying once with all of their results
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+            commands (`str`): The commands to run, one per line
+        """
+        lines = parse_batch(commands, ctx.prefix)
+        if not lines:
+            await ctx.send("**Error:** Put the commands to run on separate lines after `!batch`")
+            return
+        if len(lines) > MAX_BATCH_COMMANDS:
+            await ctx.send(f"**Error:** I can run at most {MAX_BATCH_COMMANDS} commands at once")
+            return
+        results = await run_batch(self.bot, ctx, lines)
+        for page in get_batch_pages(results):
+            await ctx.send(embeds=page)
+
+
+async def setup(bot: Bot) -> None:
+    """Setup Cog
+
+    Args:
+        bot (`Bot`): Discord Bot object
+    """
+    await bot.add_cog(Batch(bot))
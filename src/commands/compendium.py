@@ -0,0 +1,83 @@
+"""Compendium Commands"""
+
+from discord.ext.commands import Bot, Cog, Context, command, parameter
+
+from utils.ddb import get_ddb_entry, is_ddb_entry_cached
+from utils.limits import limited
+
+MISSING_ENTRY_TEXT = "**Error:** Cannot find {kind} '{name}' on D&D Beyond"
+
+
+class Compendium(Cog):
+    """Cog defining commands related to looking up monsters, magic items and feats on D&D Beyond"""
+
+    def __init__(self: "Compendium", bot: Bot) -> None:
+        """Init Cog
+
+        Args:
+            bot (`Bot`): Discord Bot object
+        """
+        self.bot = bot
+
+    async def send_entry(self: "Compendium", ctx: Context, kind: str, name: str) -> None:
+        """Look up a page on D&D Beyond and send it
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+            kind (`str`): Kind of page, e.g. 'monster'
+            name (`str`): Name of the monster, item, etc.
+        """
+        name = name.strip().strip("\"'")
+        # Scraping D&D Beyond is expensive, only a few lookups may hit the web at once. Cached pages don't need a slot
+        if is_ddb_entry_cached(kind, name):
+            embed = await get_ddb_entry(kind, name, self.bot.executor)
+        else:
+            async with self.bot.gate.slot():
+                embed = await get_ddb_entry(kind, name, self.bot.executor)
+        if embed is None:
+            await ctx.send(MISSING_ENTRY_TEXT.format(kind=kind, name=name))
+            return
+        self.bot.usage.record(kind, name)
+        await ctx.send(embed=embed)
+
+    @command(name="monster", help="Look up a monster's stat block")
+    @limited("monster")
+    async def send_monster(self: "Compendium", ctx: Context, *, name: str = parameter(description="The name of the monster to search for")) -> None:
+        """Look up a monster on D&D Beyond
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+            name (`str`): The name of the monster to search for
+        """
+        await self.send_entry(ctx, "monster", name)
+
+    @command(name="item", help="Look up a magic item")
+    @limited("item")
+    async def send_item(self: "Compendium", ctx: Context, *, name: str = parameter(description="The name of the magic item to search for")) -> None:
+        """Look up a magic item on D&D Beyond
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+            name (`str`): The name of the magic item to search for
+        """
+        await self.send_entry(ctx, "item", name)
+
+    @command(name="feat", help="Look up a feat")
+    @limited("feat")
+    async def send_feat(self: "Compendium", ctx: Context, *, name: str = parameter(description="The name of the feat to search for")) -> None:
+        """Look up a feat on D&D Beyond
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+            name (`str`): The name of the feat to search for
+        """
+        await self.send_entry(ctx, "feat", name)
+
+
+async def setup(bot: Bot) -> None:
+    """Setup Cog
+
+    Args:
+        bot (`Bot`): Discord Bot object
+    """
+    await bot.add_cog(Compendium(bot))
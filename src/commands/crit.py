@@ -1,8 +1,10 @@
 """Critical Hit/Miss Commands"""
 
+from discord import Embed
 from discord.ext.commands import Bot, Cog, Context, command, parameter
 
-from utils.crit import get_crit_result, get_fumble_result
+from utils.crit import MAX_CRITS_PER_COMMAND, get_crit_result, get_crit_results, get_fumble_result, parse_crit_rolls
+from utils.limits import limited
 
 
 class Crit(Cog):
@@ -17,23 +19,41 @@ class Crit(Cog):
         self.bot = bot
 
     @command(name="crit", help="Search the critical hit table")
+    @limited("crit")
     async def send_crit_outcome(
         self: "Crit",
         ctx: Context,
-        crit_percentage: int = parameter(description="Percentage representing critical hit severity"),
+        crit_percentage: str = parameter(
+            description=f"Percentage representing critical hit severity, several separated by commas (e.g. '12,57,88'), or a number of crits to roll"
+            f" (e.g. '8x', at most {MAX_CRITS_PER_COMMAND})"
+        ),
         dmg_type: str = parameter(description="Type of damage being inflicted"),
     ) -> None:
-        """Search the provided csv of the crititcal hit table using the user's inputed percentage and damage type. Reply with the resulting effect
+        """Search the provided csv of the crititcal hit table using the user's inputed percentage and damage type. Reply with the resulting effect.
+        Several crits (e.g. from an area of effect spell) are resolved at once, and replied to with a single embed
 
         Args:
             ctx (`Context`): Message context object from Discord
-            crit_percentage (`int`): Percentage representing critical hit severity
+            crit_percentage (`str`): Percentage representing critical hit severity, comma separated percentages, or a number of crits to roll (e.g. '8x')
             dmg_type (`str`): Type of damage being inflicted
         """
-        response = await get_crit_result(crit_percentage, dmg_type)
-        await ctx.send(response)
+        if crit_percentage.isdigit():
+            await ctx.send(await get_crit_result(int(crit_percentage), dmg_type, ctx.guild_id))
+            return
+        if (rolls := parse_crit_rolls(crit_percentage)) is None:
+            await ctx.send(
+                "**Error:** Invalid Percentage Rolls\n"
+                f"Must be values from 1-100 separated by commas, or a number of crits to roll (e.g. '8x', at most {MAX_CRITS_PER_COMMAND})"
+            )
+            return
+        response = await get_crit_results(rolls, dmg_type, ctx.guild_id)
+        if isinstance(response, Embed):
+            await ctx.send(embed=response)
+        else:
+            await ctx.send(response)
 
     @command(name="fumble", help="Search the critical miss table")
+    @limited("fumble")
     async def send_fumble_outcome(
         self: "Crit",
         ctx: Context,
@@ -45,7 +65,7 @@ class Crit(Cog):
             ctx (`Context`): Message context object from Discord
             fumble_percentage (`int`): Percentage representing critical miss severity
         """
-        response = await get_fumble_result(fumble_percentage)
+        response = await get_fumble_result(fumble_percentage, ctx.guild_id)
         await ctx.send(response)
 
 
@@ -1,16 +1,28 @@
 """Developer Commands"""
 
+import asyncio
+import io
 import os
 
-from discord import Activity, ActivityType, Game
+from discord import Activity, ActivityType, File, Game
 from discord.ext.commands import Bot, Cog, Context, command, is_owner, parameter
 
 from utils.cog import get_cog_path, reload_modules
+from utils.dispatch import MAX_MESSAGE_LENGTH
 from utils.embed import create_error_embed
 from utils.logging import get_logger
+from utils.memory import get_rss, get_traced_memory_by_category, start_tracing
+from utils.metrics import format_code_blocks
+from utils.profiler import profile_event_loop
+from utils.tracing import format_traces
 
 LOGGER = get_logger(os.path.basename(__file__))
 
+# Longest profile that may be requested, in seconds
+MAX_PROFILE_SECONDS = 120
+# Most traces that may be shown at once
+MAX_SHOWN_TRACES = 20
+
 
 class Dev(Cog):
     """Cog defining developer commands.
@@ -24,6 +36,8 @@ class Dev(Cog):
             bot (`Bot`): Discord Bot object
         """
         self.bot = bot
+        # Only one profile may run at a time
+        self.profile_lock = asyncio.Lock()
 
     @command(name="load", hidden=True)
     @is_owner()
@@ -87,6 +101,105 @@ class Dev(Cog):
         else:
             await ctx.send("**`SUCCESS`**")
 
+    @command(name="metrics", hidden=True)
+    @is_owner()
+    async def send_metrics(self: "Dev", ctx: Context) -> None:
+        """Send the bot's internal metrics (e.g. outbound queue depth and wait times)
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+        """
+        for message in format_code_blocks(self.bot.metrics.format() or "No metrics recorded", MAX_MESSAGE_LENGTH):
+            await ctx.send(message)
+
+    @command(name="trace", hidden=True)
+    @is_owner()
+    async def send_traces(
+        self: "Dev",
+        ctx: Context,
+        count: int = parameter(default=5, description=f"Number of traces to show (max {MAX_SHOWN_TRACES})"),
+        command_name: str = parameter(default=None, description="Only show traces of this command (e.g. 'spell')"),
+    ) -> None:
+        """Show the slowest recent commands, broken down into the stages they went through (fetch, parse, render, send, ...)
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+            count (`int`, optional): Number of traces to show. Defaults to `5`.
+            command_name (`str`, optional): Only show traces of this command. Defaults to `None` (every command).
+        """
+        traces = self.bot.tracer.slowest(max(min(count, MAX_SHOWN_TRACES), 1), command_name)
+        if not traces:
+            await ctx.send("No traces recorded")
+            return
+        for message in format_traces(traces, MAX_MESSAGE_LENGTH):
+            await ctx.send(message)
+
+    @command(name="profile", hidden=True)
+    @is_owner()
+    async def profile(
+        self: "Dev",
+        ctx: Context,
+        seconds: float = parameter(default=10.0, description=f"Length of the profile in seconds (max {MAX_PROFILE_SECONDS})"),
+        mode: str = parameter(default="cpu", description="'cpu' for a CPU profile, 'mem' to also snapshot allocations"),
+    ) -> None:
+        """Profile the live bot, replying with the top functions and collapsed stacks (for flamegraphs) as files
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+            seconds (`float`, optional): Length of the profile in seconds. Defaults to `10.0`.
+            mode (`str`, optional): 'cpu' for a CPU profile, 'mem' to also snapshot allocations. Defaults to 'cpu'.
+        """
+        if not 0 < seconds <= MAX_PROFILE_SECONDS:
+            await ctx.send(f"**Error:** Profile length must be between 0 and {MAX_PROFILE_SECONDS} seconds")
+            return
+        if self.profile_lock.locked():
+            await ctx.send("A profile is already running, try again once it has finished.")
+            return
+
+        async with self.profile_lock:
+            await ctx.send(f"Profiling for {seconds:g}s...")
+            report, collapsed_stacks = await profile_event_loop(seconds, allocations=mode.lower() == "mem")
+
+        files = [
+            File(io.BytesIO(report.encode()), filename="profile.txt"),
+            File(io.BytesIO(collapsed_stacks.encode()), filename="profile.collapsed"),
+        ]
+        await ctx.send("**`PROFILE COMPLETE`**", files=files)
+
+    @command(name="mem", hidden=True)
+    @is_owner()
+    async def send_memory_report(self: "Dev", ctx: Context) -> None:
+        """Report resident memory, broken down by cache.
+
+        The breakdown comes from tracemalloc, which is started by the first call if it isn't already running.
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+        """
+        mib = 2**20
+        lines = [
+            f"Resident memory: {get_rss() / mib:.1f} MiB",
+            "",
+            "discord.py caches:",
+            f"  guilds: {len(self.bot.guilds)}",
+            f"  users: {len(self.bot.users)}",
+            f"  members: {sum(len(guild.members) for guild in self.bot.guilds)}",
+            f"  messages: {len(self.bot.cached_messages)}",
+            "",
+            "VoloBot caches (estimated):",
+        ]
+        lines.extend(f"  {name}: {size / mib:.2f} MiB" for name, size in self.bot.memory.cache_sizes().items())
+
+        lines.append("")
+        if (by_category := get_traced_memory_by_category()) is None:
+            start_tracing()
+            lines.append("Started tracing allocations, run `!mem` again for a breakdown by cache.")
+        else:
+            lines.append("Traced allocations by cache:")
+            lines.extend(f"  {category}: {size / mib:.2f} MiB" for category, size in sorted(by_category.items(), key=lambda item: -item[1]))
+
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
+
     @command(name="set_activity", help="Set the bot's activity", hidden=True)
     @is_owner()
     async def set_activity(
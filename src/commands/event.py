@@ -4,11 +4,12 @@ import os
 import random
 
 from discord import Game, Message
-from discord.ext.commands import Bot, Cog, Context
+from discord.ext.commands import Bot, BucketType, CheckFailure, Cog, CommandOnCooldown, Context
 
 from constants.quotes import QUOTES
 from utils.embed import create_error_embed
-from utils.logging import get_logger
+from utils.limits import ServerBusyError
+from utils.logging import command_log_fields, get_logger
 
 LOGGER = get_logger(os.path.basename(__file__))
 
@@ -47,7 +48,7 @@ class Event(Cog):
         # If any version of the string 'volo' appears in a message, choose a random quote and send it to the channel
         if "volo" in message.content.lower():
             response = random.choice(QUOTES)
-            await message.channel.send(response)
+            await self.bot.dispatcher.send(message.channel, response)
 
     @Cog.listener()
     async def on_command_error(self: "Event", ctx: Context, error: Exception) -> None:
@@ -57,10 +58,34 @@ class Event(Cog):
             ctx (`Context`): Message context object from Discord
             error (`Exception`): The error encountered in the program. This will likely be a UserInputError (i.e. BadArgument), or some other unhandled error
         """
-        LOGGER.exception(error, exc_info=error)
+        # Rate limited requests get a friendly reply rather than an error report
+        if isinstance(error, CommandOnCooldown):
+            LOGGER.info("Rejected command on cooldown: %s", error, extra=command_log_fields(ctx, "cooldown", sample=True))
+            who = "This server is" if error.type == BucketType.guild else "You're"
+            await ctx.send(f"{who} using `{ctx.invoked_with}` too quickly! Try again in {error.retry_after:.1f}s.")
+            return
+        if isinstance(error, CheckFailure):
+            LOGGER.info("Rejected command, check failed: %s", error, extra=command_log_fields(ctx, "forbidden"))
+            await ctx.send(f"You aren't allowed to use `{ctx.invoked_with}` here.")
+            return
+        if isinstance(error, ServerBusyError):
+            LOGGER.warning("Rejected command, server busy", extra=command_log_fields(ctx, "busy"))
+            await ctx.send("I'm juggling too many requests right now, try again in a moment!")
+            return
+
+        LOGGER.exception(error, exc_info=error, extra=command_log_fields(ctx, "error"))
         embed = create_error_embed(error)
         await ctx.send(embed=embed)
 
+    @Cog.listener()
+    async def on_command_completion(self: "Event", ctx: Context) -> None:
+        """Log successful commands. These are high-volume, so they are subject to sampling
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+        """
+        LOGGER.info("Completed command '%s'", ctx.command.qualified_name, extra=command_log_fields(ctx, "success", sample=True))
+
 
 async def setup(bot: Bot) -> None:
     """Setup Cog
@@ -0,0 +1,158 @@
+"""Initiative Commands"""
+
+from discord import AllowedMentions, NotFound
+from discord.ext.commands import Bot, Cog, Context, group, parameter
+
+from utils.initiative import MAX_COMBATANTS, Encounter, InitiativeTracker, InvalidCombatantError, format_tracker, parse_initiative
+from utils.limits import limited
+
+# Subcommands don't run their group's hooks, so the group and its subcommands share a single set of cooldowns
+init_limited = limited("init")
+
+
+class Initiative(Cog):
+    """Cog defining commands related to tracking initiative. Owns the encounters, which are snapshotted while the cog is loaded"""
+
+    def __init__(self: "Initiative", bot: Bot) -> None:
+        """Init Cog
+
+        Args:
+            bot (`Bot`): Discord Bot object
+        """
+        self.bot = bot
+        self.tracker = InitiativeTracker(self.publish)
+
+    async def cog_load(self: "Initiative") -> None:
+        """Load the encounters snapshotted before the cog was last unloaded, and start snapshotting"""
+        await self.tracker.load()
+        self.tracker.start()
+
+    async def cog_unload(self: "Initiative") -> None:
+        """Stop snapshotting, publish pending tracker edits and save the encounters, e.g. when reloading the cog or shutting down"""
+        self.tracker.stop()
+        await self.tracker.flush()
+        await self.tracker.save()
+
+    async def publish(self: "Initiative", channel_id: int, encounter: Encounter) -> None:
+        """Edit a channel's tracker message to show the encounter, sending a new one if there isn't one yet
+
+        Args:
+            channel_id (`int`): ID of the channel
+            encounter (`Encounter`): The channel's encounter
+        """
+        # Channels may not be cached (see `MEMORY_PROFILE`), a partial channel is enough to send and edit messages
+        channel = self.bot.get_channel(channel_id) or self.bot.get_partial_messageable(channel_id)
+        async with encounter.publishing:
+            # Formatted once the lock is held, so the latest publish shows the latest changes
+            embed = format_tracker(encounter)
+            if encounter.message_id is not None:
+                try:
+                    # Trackers sent before they were embeds have content, which the embed replaces
+                    await channel.get_partial_message(encounter.message_id).edit(content=None, embed=embed)
+                    return
+                except NotFound:
+                    # The tracker was deleted, send a new one
+                    pass
+            # Combatants may be named after people, don't ping them. Embeds are never merged with other messages
+            message = await self.bot.dispatcher.send(channel, embed=embed, allowed_mentions=AllowedMentions.none())
+            encounter.message_id = message.id
+            self.tracker.dirty = True
+
+    @group(name="init", help="Track initiative in this channel", invoke_without_command=True)
+    @init_limited
+    async def show_tracker(self: "Initiative", ctx: Context) -> None:
+        """Send the channel's tracker again, below the latest messages. Later changes edit the new tracker
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+        """
+        if (encounter := self.tracker.get(ctx.channel.id)) is None:
+            await ctx.send("**Error:** There's no encounter in this channel, start one with `!init add <name> <initiative>`")
+            return
+        # Waits for a publish in flight, which may be sending a tracker whose ID would replace this
+        async with encounter.publishing:
+            encounter.message_id = None
+        await self.tracker.publish_now(ctx.channel.id)
+
+    @show_tracker.command(name="add", help="Add a combatant to the encounter, starting one if needed")
+    @init_limited
+    async def add_combatant(
+        self: "Initiative",
+        ctx: Context,
+        *,
+        combatant: str = parameter(
+            description="Name of the combatant, then their initiative or a modifier to roll with (e.g. 'Goblin 2 12', 'Thorin +3' or 'Zombie =-1')"
+        ),
+    ) -> None:
+        """Add a combatant to the channel's encounter
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+            combatant (`str`): Name of the combatant, followed by their initiative (e.g. '15', or '=-1' if negative) or a modifier to roll with (e.g. '+3')
+        """
+        name, _, initiative = combatant.strip().rpartition(" ")
+        try:
+            if not name:
+                raise InvalidCombatantError("Give the combatant's name, then their initiative (e.g. `!init add Goblin 12` or `!init add Thorin +3`)")
+            value, _ = parse_initiative(initiative)
+            self.tracker.get(ctx.channel.id, create=True).add(name, value)
+        except InvalidCombatantError as error:
+            await ctx.send(f"**Error:** {error}")
+            return
+        self.tracker.changed(ctx.channel.id)
+
+    @show_tracker.command(name="remove", help="Remove a combatant from the encounter")
+    @init_limited
+    async def remove_combatant(self: "Initiative", ctx: Context, *, name: str = parameter(description="Name of the combatant to remove")) -> None:
+        """Remove a combatant from the channel's encounter
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+            name (`str`): Name of the combatant to remove
+        """
+        if (encounter := self.tracker.get(ctx.channel.id)) is None:
+            await ctx.send("**Error:** There's no encounter in this channel")
+            return
+        try:
+            encounter.remove(name)
+        except InvalidCombatantError as error:
+            await ctx.send(f"**Error:** {error}")
+            return
+        self.tracker.changed(ctx.channel.id)
+
+    @show_tracker.command(name="next", help="Pass the turn to the next combatant")
+    @init_limited
+    async def next_turn(self: "Initiative", ctx: Context) -> None:
+        """Pass the turn to the next combatant of the channel's encounter, starting the first round if it hasn't started
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+        """
+        encounter = self.tracker.get(ctx.channel.id)
+        if encounter is None or encounter.next_turn() is None:
+            await ctx.send(f"**Error:** There's nobody to take a turn, add up to {MAX_COMBATANTS} combatants with `!init add <name> <initiative>`")
+            return
+        self.tracker.changed(ctx.channel.id)
+
+    @show_tracker.command(name="end", help="End the encounter")
+    @init_limited
+    async def end_encounter(self: "Initiative", ctx: Context) -> None:
+        """End the channel's encounter
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+        """
+        if (encounter := self.tracker.end(ctx.channel.id)) is None:
+            await ctx.send("**Error:** There's no encounter in this channel")
+            return
+        rounds = f" after {encounter.round} round{'s' if encounter.round != 1 else ''}" if encounter.round else ""
+        await ctx.send(f"Encounter ended{rounds}.")
+
+
+async def setup(bot: Bot) -> None:
+    """Setup Cog
+
+    Args:
+        bot (`Bot`): Discord Bot object
+    """
+    await bot.add_cog(Initiative(bot))
@@ -1,8 +1,28 @@
 """Inventory Commands"""
 
-from discord.ext.commands import Bot, Cog, Context, command, parameter
-
-from utils.inventory import get_item, remove_item, store_item
+from discord.ext.commands import Bot, Cog, Context, command, group, parameter
+
+from utils.embed import dict_to_embed
+from utils.fuzzy import format_suggestions
+from utils.inventory import (
+    MAX_HISTORY_CHANGES,
+    InvalidQuantityError,
+    InvalidTimeError,
+    format_quantity_change,
+    get_history,
+    get_history_embed,
+    get_inventory_at,
+    get_item,
+    parse_past_time,
+    remove_item,
+    store_item,
+    suggest_items,
+    undo_change,
+)
+from utils.limits import limited
+
+# Subcommands don't run their group's hooks, so the group and its subcommands share a single set of cooldowns
+bag_limited = limited("bag")
 
 
 class Inventory(Cog):
@@ -16,7 +36,8 @@ class Inventory(Cog):
         """
         self.bot = bot
 
-    @command(name="bag", help="Check the party's inventory")
+    @group(name="bag", help="Check the party's inventory", invoke_without_command=True)
+    @bag_limited
     async def check_inventory(
         self: "Inventory",
         ctx: Context,
@@ -25,19 +46,63 @@ class Inventory(Cog):
             description=" The name of the inventory item to list. If ommitted, entire inventory will be listed",
         ),
     ) -> None:
-        """Displays the contents of inventory.json
+        """Displays the contents of the guild's inventory
 
         Args:
             ctx (`Context`): Message context object from Discord
             item (`str`, optional): The name of the inventory item to list. If ommitted, entire inventory will be listed. Defaults to `None`.
         """
-        if embed := await get_item(item):
+        if embed := await get_item(item, ctx.guild_id):
             await ctx.send(embed=embed)
         else:
-            response = f"Could not find item '{item}' in your inventory."
+            suggestions = await suggest_items(item, ctx.guild_id)
+            response = f"Could not find item '{item}' in your inventory." + format_suggestions(suggestions)
             await ctx.send(response)
 
+    @check_inventory.command(name="history", help="List the latest changes to the party's inventory")
+    @bag_limited
+    async def check_history(
+        self: "Inventory",
+        ctx: Context,
+        count: int = parameter(default=10, description=f"The number of changes to list, at most {MAX_HISTORY_CHANGES}"),
+    ) -> None:
+        """List the latest changes to the guild's inventory, newest first
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+            count (`int`, optional): The number of changes to list. Defaults to '10'.
+        """
+        records = await get_history(ctx.guild_id, max(1, min(count, MAX_HISTORY_CHANGES)))
+        await ctx.send(embed=get_history_embed(records))
+
+    @check_inventory.command(name="at", help="Check the party's inventory as it was at some point")
+    @bag_limited
+    async def check_inventory_at(
+        self: "Inventory",
+        ctx: Context,
+        *,
+        when: str = parameter(description="When to check the inventory at, e.g. '2h ago', '3d ago' or '2024-05-01 18:30' (UTC)"),
+    ) -> None:
+        """Displays the contents of the guild's inventory as it was at a point in time
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+            when (`str`): When to check the inventory at, e.g. '2h ago' or '2024-05-01 18:30'
+        """
+        try:
+            moment = parse_past_time(when)
+        except InvalidTimeError as error:
+            await ctx.send(f"**Error:** {error}")
+            return
+        if (inventory := await get_inventory_at(moment, ctx.guild_id)) is None:
+            await ctx.send(f"No changes to your inventory had been recorded by <t:{int(moment)}:f>.")
+            return
+        embed = dict_to_embed("Inventory", inventory)
+        embed.description = f"As of <t:{int(moment)}:f>"
+        await ctx.send(embed=embed)
+
     @command(name="store", help="Store items in the party's inventory")
+    @limited("store")
     async def store_inventory(
         self: "Inventory",
         ctx: Context,
@@ -45,7 +110,7 @@ class Inventory(Cog):
         quantity: int = parameter(default=1, description="The quantity of the item to store"),
         description: str = parameter(default=None, description="A description of the stored item"),
     ) -> None:
-        """Store items in inventory (write to inventory.json)
+        """Store items in the guild's inventory
 
         Args:
             ctx (`Context`): Message context object from Discord
@@ -53,32 +118,54 @@ class Inventory(Cog):
             quantity (`int`, optional): The quantity of the item to store. Defaults to '1'.
             description (`str`, optional): A description of the stored item. Defaults to `None`.
         """
-        await store_item(item, quantity, description)
+        try:
+            await store_item(item, quantity, description, ctx.guild_id, ctx.author.id)
+        except InvalidQuantityError as error:
+            await ctx.send(f"**Error:** {error}")
+            return
 
         response = f"Added {quantity} {item} to your inventory."
 
         await ctx.send(response)
 
     @command(name="remove", help="Remove items from the party's inventory")
+    @limited("remove")
     async def remove_inventory(
         self: "Inventory",
         ctx: Context,
         item: str = parameter(description="The name of the item to remove"),
         quantity: int = parameter(default=None, description="The quantity of the item to remove"),
     ) -> None:
-        """Remove items from inventory.json
+        """Remove items from the guild's inventory
 
         Args:
             ctx (`Context`): Message context object from Discord
             item (`str`): Item to remove from the inventory
             quantity (`int`, optional): The quantity of items to remove. Defaults to `None` (Removes all items).
         """
-        await remove_item(item, quantity)
+        try:
+            await remove_item(item, quantity, ctx.guild_id, ctx.author.id)
+        except InvalidQuantityError as error:
+            await ctx.send(f"**Error:** {error}")
+            return
 
         response = f"Removed {'all' if quantity is None else quantity} {item} from your inventory."
 
         await ctx.send(response)
 
+    @command(name="undo", help="Undo the last change to the party's inventory")
+    @limited("undo")
+    async def undo_inventory(self: "Inventory", ctx: Context) -> None:
+        """Undo the latest change to the guild's inventory. Each use undoes one more change
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+        """
+        if (record := await undo_change(ctx.guild_id, ctx.author.id)) is None:
+            await ctx.send("There's nothing to undo.")
+            return
+        await ctx.send(f"Undid change `#{record.index + 1}`: {format_quantity_change(record)}.")
+
 
 async def setup(bot: Bot) -> None:
     """Setup Cog
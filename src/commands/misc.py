@@ -2,11 +2,16 @@
 
 import os
 import random
+from typing import Literal, Optional
 
-from discord import Embed, File
+from discord import AllowedMentions, Embed, File, User
 from discord.ext.commands import Bot, Cog, Context, command, parameter
 
+from constants.limits import EXPENSIVE_ROLL_DICE
 from constants.paths import MEME_DIR
+from utils.dice import roll_and_summarize
+from utils.limits import limited
+from utils.rolls import MAX_LISTED_ROLLS, PlayerRoll, format_latest_rolls, get_channel_stats_embed, get_player_stats_embed
 
 
 class Misc(Cog):
@@ -21,6 +26,7 @@ class Misc(Cog):
         self.bot = bot
 
     @command(name="roll", help="Roll virtual dice")
+    @limited("roll")
     async def roll_dice(
         self: "Misc",
         ctx: Context,
@@ -34,12 +40,59 @@ class Misc(Cog):
             number_of_dice (`int`): The number of dice to be rolled
             number_of_sides (`int`): How many sides each rolled die should have
         """
-        # Chooses a random int between 1 and the given number of sides
-        # Repeats as many times as number_of_dice
-        dice = [str(random.choice(range(1, number_of_sides + 1))) for _ in range(number_of_dice)]
-        await ctx.send(", ".join(dice))
+        # Huge rolls are CPU-heavy, so they are rolled in a worker and only a few are allowed to run at once
+        if number_of_dice > EXPENSIVE_ROLL_DICE:
+            async with self.bot.gate.slot():
+                result = await self.bot.executor.run(roll_and_summarize, number_of_dice, number_of_sides, kind="dice")
+        else:
+            result = roll_and_summarize(number_of_dice, number_of_sides)
+        if number_of_dice > 0:
+            self.bot.rolls.record(ctx.channel.id, ctx.author.id, PlayerRoll(number_of_sides, number_of_dice, result.total, result.highest, result.lowest))
+        await ctx.send(result.text)
+
+    @command(name="rolls", help="List recent rolls in this channel")
+    @limited("rolls")
+    async def list_rolls(
+        self: "Misc",
+        ctx: Context,
+        _last: Optional[Literal["last"]] = parameter(default=None, displayed_name="last", description="Optional, e.g. `!rolls last 20`"),
+        count: int = parameter(default=10, description=f"Number of rolls to list (at most {MAX_LISTED_ROLLS})"),
+    ) -> None:
+        """List the most recent rolls in the channel
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+            count (`int`, optional): Number of rolls to list. Defaults to `10`.
+        """
+        rolls = self.bot.rolls.latest(ctx.channel.id, max(1, min(count, MAX_LISTED_ROLLS)))
+        # Mention players so their names are shown, without notifying them
+        await ctx.send(format_latest_rolls(rolls), allowed_mentions=AllowedMentions.none())
+
+    @command(name="rollstats", help="Show roll stats for this channel")
+    @limited("rollstats")
+    async def send_roll_stats(
+        self: "Misc",
+        ctx: Context,
+        player: Optional[User] = parameter(default=None, description="Player to show detailed stats for. If ommitted, d20 stats for every player are shown"),
+    ) -> None:
+        """Show roll stats (averages, nat 20/nat 1 rates, d20 streaks) for the channel's recent rolls
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+            player (`Optional[User]`, optional): Player to show detailed stats for. Defaults to `None` (every player).
+        """
+        players = self.bot.rolls.players(ctx.channel.id)
+        if player is None:
+            embed = get_channel_stats_embed(players)
+        elif player.id in players:
+            embed = get_player_stats_embed(player.display_name, players[player.id])
+        else:
+            await ctx.send(f"{player.display_name} hasn't rolled in this channel recently.")
+            return
+        await ctx.send(embed=embed)
 
     @command(name="meme", help="Dank Me Me")
+    @limited("meme")
     async def send_meme(self: "Misc", ctx: Context) -> None:
         """Sends a meme to context
 
@@ -65,6 +118,10 @@ class Misc(Cog):
         # Calculate the time difference between ping request and pong response
         ping = (response.created_at - ctx.message.created_at).total_seconds() * 1000
         embed.add_field(name=":ping_pong:", value=f"{int(ping)} ms")  # Add calculated ping to the embed
+        # The owner also gets to see how responsive the event loop has been
+        if await self.bot.is_owner(ctx.author):
+            lag = self.bot.watchdog.lag_percentiles()
+            embed.add_field(name="Event loop lag", value=f"p50 {lag['p50']:.1f} ms | p99 {lag['p99']:.1f} ms | max {lag['max']:.1f} ms")
         await response.edit(embed=embed)  # edit response to include calculated ping (ms)
 
 
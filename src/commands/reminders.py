@@ -0,0 +1,124 @@
+"""Reminder Commands"""
+
+from discord import AllowedMentions, Forbidden, NotFound
+from discord.ext.commands import Bot, Cog, Context, command, parameter
+
+from utils.limits import limited
+from utils.reminders import InvalidReminderError, Reminder, ReminderScheduler, ReminderTarget, format_fired_reminders, format_interval, format_reminder_list
+
+# Maximum number of reminders listed by `!reminders`
+MAX_LISTED_REMINDERS = 25
+
+
+class Reminders(Cog):
+    """Cog defining commands related to reminders. Owns the reminder scheduler, which runs while the cog is loaded"""
+
+    def __init__(self: "Reminders", bot: Bot) -> None:
+        """Init Cog
+
+        Args:
+            bot (`Bot`): Discord Bot object
+        """
+        self.bot = bot
+        self.scheduler = ReminderScheduler(self.deliver)
+
+    async def cog_load(self: "Reminders") -> None:
+        """Load saved reminders and start the scheduler. Reminders missed while the bot was down fire straight away"""
+        await self.scheduler.load()
+        self.scheduler.start()
+
+    async def cog_unload(self: "Reminders") -> None:
+        """Stop the scheduler and save the reminders, e.g. when reloading the cog or shutting down"""
+        self.scheduler.stop()
+        await self.scheduler.save()
+
+    async def deliver(self: "Reminders", channel_id: int, reminders: list[Reminder]) -> None:
+        """Send the reminders due in a channel, as few messages as possible
+
+        Args:
+            channel_id (`int`): ID of the channel
+            reminders (`list[Reminder]`): Reminders due in the channel
+
+        Raises:
+            `Forbidden`, `NotFound`: The reminders can't be sent to the channel. They are cancelled rather than retried
+        """
+        # Channels may not be cached (see `MEMORY_PROFILE`), a partial channel is enough to send messages
+        channel = self.bot.get_channel(channel_id) or self.bot.get_partial_messageable(channel_id, guild_id=reminders[0].guild_id)
+        try:
+            for message in format_fired_reminders(reminders, self.scheduler.clock()):
+                await self.bot.dispatcher.send(channel, message, allowed_mentions=AllowedMentions(everyone=False, roles=False, users=True))
+        except (Forbidden, NotFound):
+            # The channel is gone, or we can't post in it any more. Don't keep retrying or repeating reminders nobody can see
+            for reminder in reminders:
+                self.scheduler.cancel(reminder.id)
+            raise
+
+    @command(name="remind", help="Set a reminder, once or repeating")
+    @limited("remind")
+    async def set_reminder(
+        self: "Reminders",
+        ctx: Context,
+        message: str = parameter(description="What to remind you of (in quotes if it's more than one word)"),
+        *,
+        when: str = parameter(description="When to remind you, e.g. 'in 3d', 'in 2h 30m', 'every week' or 'daily'"),
+    ) -> None:
+        """Set a reminder, sent to this channel when it's due
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+            message (`str`): What to remind the user of
+            when (`str`): When to remind the user, e.g. 'in 3d' or 'every week'
+        """
+        try:
+            reminder = self.scheduler.add(message, when, ReminderTarget(ctx.channel.id, ctx.guild_id, ctx.author.id))
+        except InvalidReminderError as error:
+            await ctx.send(f"**Error:** {error}")
+            return
+        recurrence = "" if reminder.interval is None else f", then every {format_interval(reminder.interval)}"
+        await ctx.send(f"Okay, I'll remind you <t:{int(reminder.due)}:R>{recurrence} (`#{reminder.id}`).")
+
+    @command(name="reminders", help="List your reminders")
+    @limited("reminders")
+    async def list_reminders(self: "Reminders", ctx: Context) -> None:
+        """List the author's reminders in this server
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+        """
+        reminders = self.scheduler.list_user(ctx.author.id, ctx.guild_id)
+        if not reminders:
+            await ctx.send("You don't have any reminders here.")
+            return
+        # Reminders may mention people, they'll be pinged when the reminder fires
+        for message in format_reminder_list(reminders[:MAX_LISTED_REMINDERS]):
+            await ctx.send(message, allowed_mentions=AllowedMentions.none())
+
+    @command(name="unremind", help="Cancel one of your reminders")
+    @limited("unremind")
+    async def cancel_reminder(
+        self: "Reminders",
+        ctx: Context,
+        reminder_id: str = parameter(description="Number of the reminder to cancel (see !reminders)"),
+    ) -> None:
+        """Cancel one of the author's reminders
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+            reminder_id (`str`): Number of the reminder to cancel, e.g. '12' or '#12'
+        """
+        number = reminder_id.removeprefix("#")
+        reminder = self.scheduler.get(int(number)) if number.isdigit() else None
+        if reminder is None or reminder.user_id != ctx.author.id:
+            await ctx.send(f"You don't have a reminder `#{number}`.")
+            return
+        self.scheduler.cancel(reminder.id)
+        await ctx.send(f"Cancelled reminder `#{reminder.id}`.")
+
+
+async def setup(bot: Bot) -> None:
+    """Setup Cog
+
+    Args:
+        bot (`Bot`): Discord Bot object
+    """
+    await bot.add_cog(Reminders(bot))
@@ -3,7 +3,9 @@
 from discord import Embed
 from discord.ext.commands import Bot, Cog, Context, command, parameter
 
-from utils.rules import get_rule
+from utils.fuzzy import format_suggestions
+from utils.limits import limited
+from utils.rules import get_rule, suggest_rules
 
 
 class Rule(Cog):
@@ -18,6 +20,7 @@ class Rule(Cog):
         self.bot = bot
 
     @command(name="rule", help="Search rule descriptions")
+    @limited("rule")
     async def send_rule_description(
         self: "Rule",
         ctx: Context,
@@ -29,11 +32,14 @@ class Rule(Cog):
             ctx (`Context`): Message context object from Discord
             rule_name (`str`, optional): The name of the rule to search for. If ommitted, known rules will be listed. Defaults to `None`.
         """
-        response = await get_rule(rule_name)
+        response = await get_rule(rule_name, ctx.guild_id)
         if isinstance(response, Embed):
+            if rule_name:
+                self.bot.usage.record("rule", rule_name)
             await ctx.send(embed=response)
         else:
-            response = f"Could not find rule '{rule_name}' in your inventory."
+            suggestions = await suggest_rules(rule_name, ctx.guild_id)
+            response = f"Could not find rule '{rule_name}'." + format_suggestions(suggestions)
             await ctx.send(response)
 
 
@@ -1,9 +1,12 @@
 """Spell Commands"""
 
 from discord import Embed
-from discord.ext.commands import Bot, Cog, Context, command, parameter
+from discord.ext.commands import Bot, Cog, Context, check_any, command, has_role, is_owner, parameter
 
-from utils.spell import get_spell
+from utils.embed import paginate_embeds
+from utils.limits import limited
+from utils.spell import MAX_SPELLS_PER_LOOKUP, WebLookupSettings, get_spell, get_spells, parse_spell_query
+from utils.spellbook import DM_ROLE, add_spell, delete_spell, edit_spell
 
 
 class Spell(Cog):
@@ -18,25 +21,127 @@ class Spell(Cog):
         self.bot = bot
 
     @command(name="spell", help="Search spell descriptions")
+    @limited("spell")
     async def send_spell_description(
         self: "Spell",
         ctx: Context,
-        spell_name: str = parameter(description="The name of the spell to search for"),
-        source: str = parameter(default="all", description="Source to get spell info from ('web' | 'local' | 'all')"),
+        *,
+        query: str = parameter(
+            description="The name of the spell to search for, or several separated by commas, optionally followed by the source to get spell info from"
+            " ('web' | 'local' | 'all')"
+        ),
     ) -> None:
-        """Search for a spell and return its description
+        """Search for one or more spells and return their descriptions
 
         Args:
             ctx (`Context`): Message context object from Discord
-            spell_name (`str`): The name of the spell to search for
-            source (`str`, optional): The source to check for spell info. Defaults to 'all'
+            query (`str`): The names of the spells to search for, separated by commas, optionally followed by the source to check. Source defaults to 'all'
         """
-        response = await get_spell(spell_name, source)
+        spell_names, source = parse_spell_query(query)
+        if len(spell_names) > 1:
+            await self.send_spell_descriptions(ctx, spell_names, source)
+            return
+        spell_name = spell_names[0] if spell_names else query
+
+        lookup = await get_spell(spell_name, source, ctx.guild_id, WebLookupSettings(self.bot.executor, self.bot.gate))
+        if isinstance(lookup.response, Embed):
+            self.bot.usage.record("spell", spell_name)
+            # Only spells D&D Beyond answered with are worth prefetching from it
+            if lookup.from_web:
+                self.bot.usage.record("spell.web", spell_name)
+            await ctx.send(embed=lookup.response)
+        else:
+            await ctx.send(lookup.response)
+
+    async def send_spell_descriptions(self: "Spell", ctx: Context, spell_names: list[str], source: str) -> None:
+        """Look up several spells at once, and send them as few messages as possible. Spells which couldn't be found are
+        reported along with the first message
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+            spell_names (`list[str]`): The names of the spells to search for
+            source (`str`): The source to check for spell info
+        """
+        if len(spell_names) > MAX_SPELLS_PER_LOOKUP:
+            await ctx.send(f"**Error:** I can look up at most {MAX_SPELLS_PER_LOOKUP} spells at once")
+            return
+        lookups = await get_spells(spell_names, source, ctx.guild_id, WebLookupSettings(self.bot.executor, self.bot.gate))
+
+        embeds = []
+        errors = []
+        for lookup in lookups:
+            if isinstance(lookup.response, Embed):
+                embeds.append(lookup.response)
+                self.bot.usage.record("spell", lookup.name)
+                if lookup.from_web:
+                    self.bot.usage.record("spell.web", lookup.name)
+            else:
+                errors.append(lookup.response)
+
+        pages = paginate_embeds(embeds) or [[]]
+        await ctx.send("\n".join(errors) or None, embeds=pages[0] or None)
+        for page in pages[1:]:
+            await ctx.send(embeds=page)
+
+    @command(name="addspell", help=f"Add a homebrew spell (bot owner or '{DM_ROLE}' role only)")
+    @check_any(is_owner(), has_role(DM_ROLE))
+    @limited("addspell")
+    async def add_homebrew_spell(
+        self: "Spell",
+        ctx: Context,
+        *,
+        spell: str = parameter(description="The spell's name, then a line for each field (e.g. 'Level: 3')"),
+    ) -> None:
+        """Add a homebrew spell to the guild's spells
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+            spell (`str`): The spell's name on the first line, followed by a "Field: value" line for each field
+        """
+        response = await add_spell(spell, ctx.guild_id)
+        if isinstance(response, Embed):
+            await ctx.send(f"Added spell '{response.title}'.", embed=response)
+        else:
+            await ctx.send(response)
+
+    @command(name="editspell", help=f"Change fields of a spell (bot owner or '{DM_ROLE}' role only)")
+    @check_any(is_owner(), has_role(DM_ROLE))
+    @limited("editspell")
+    async def edit_homebrew_spell(
+        self: "Spell",
+        ctx: Context,
+        *,
+        spell: str = parameter(description="The spell's name, then a line for each field to change (e.g. 'Range: 60 feet')"),
+    ) -> None:
+        """Change fields of a spell. Changing one of the global spells gives the guild its own version of it
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+            spell (`str`): The spell's name on the first line, followed by a "Field: value" line for each field to change
+        """
+        response = await edit_spell(spell, ctx.guild_id)
         if isinstance(response, Embed):
-            await ctx.send(embed=response)
+            await ctx.send(f"Updated spell '{response.title}'.", embed=response)
         else:
             await ctx.send(response)
 
+    @command(name="delspell", help=f"Delete a homebrew spell (bot owner or '{DM_ROLE}' role only)")
+    @check_any(is_owner(), has_role(DM_ROLE))
+    @limited("delspell")
+    async def delete_homebrew_spell(
+        self: "Spell",
+        ctx: Context,
+        *,
+        spell_name: str = parameter(description="The name of the homebrew spell to delete"),
+    ) -> None:
+        """Delete one of the guild's homebrew spells
+
+        Args:
+            ctx (`Context`): Message context object from Discord
+            spell_name (`str`): The name of the homebrew spell to delete
+        """
+        await ctx.send(await delete_spell(spell_name, ctx.guild_id))
+
 
 async def setup(bot: Bot) -> None:
     """Setup Cog
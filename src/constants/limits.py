@@ -0,0 +1,70 @@
+"""Command Limit Constants"""
+
+#############
+# Cooldowns #
+#############
+
+# Maps command names to (uses, per_seconds) allowed for a single user/guild.
+# Commands without an entry are not limited.
+USER_COOLDOWNS = {
+    "batch": (2, 10.0),
+    "roll": (5, 10.0),
+    "rolls": (3, 10.0),
+    "rollstats": (3, 10.0),
+    "spell": (3, 10.0),
+    "addspell": (3, 10.0),
+    "editspell": (3, 10.0),
+    "delspell": (3, 10.0),
+    "monster": (3, 10.0),
+    "item": (3, 10.0),
+    "feat": (3, 10.0),
+    "crit": (5, 10.0),
+    "fumble": (5, 10.0),
+    "rule": (5, 10.0),
+    "bag": (5, 10.0),
+    "store": (5, 10.0),
+    "remove": (5, 10.0),
+    "undo": (3, 10.0),
+    "meme": (2, 10.0),
+    "init": (10, 10.0),
+    "remind": (3, 10.0),
+    "reminders": (3, 10.0),
+    "unremind": (5, 10.0),
+}
+GUILD_COOLDOWNS = {
+    "batch": (10, 10.0),
+    "roll": (30, 10.0),
+    "rolls": (10, 10.0),
+    "rollstats": (10, 10.0),
+    "spell": (15, 10.0),
+    "addspell": (10, 10.0),
+    "editspell": (10, 10.0),
+    "delspell": (10, 10.0),
+    "monster": (15, 10.0),
+    "item": (15, 10.0),
+    "feat": (15, 10.0),
+    "crit": (30, 10.0),
+    "fumble": (30, 10.0),
+    "rule": (30, 10.0),
+    "bag": (30, 10.0),
+    "store": (30, 10.0),
+    "remove": (30, 10.0),
+    "undo": (15, 10.0),
+    "meme": (10, 10.0),
+    "init": (30, 10.0),
+    "remind": (15, 10.0),
+    "reminders": (15, 10.0),
+    "unremind": (15, 10.0),
+}
+
+
+##################
+# Expensive Work #
+##################
+
+# Number of expensive tasks (web scrapes, huge rolls, big embeds) allowed to run at once
+MAX_EXPENSIVE_TASKS = 2
+# Number of expensive tasks allowed to wait for a slot, further requests are rejected
+MAX_EXPENSIVE_WAITERS = 8
+# Rolls of more dice than this are considered expensive
+EXPENSIVE_ROLL_DICE = 1000
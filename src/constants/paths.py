@@ -6,6 +6,8 @@
 
 CONSTANTS_DIR = "constants"
 DATA_DIR = "data"
+GUILDS_DIR = f"{DATA_DIR}/guilds"
+GUILD_DATA_DIR = f"{GUILDS_DIR}/{{guild_id}}"  # Per-guild copies of data files, taking precedence over DATA_DIR
 MEME_DIR = f"{DATA_DIR}/memes"  # Do memes count as 'data'?
 UTILS_DIR = "utils"
 
@@ -20,3 +22,11 @@ INVENTORY_PATH = f"{DATA_DIR}/inventory.json"
 CRIT_TABLE_PATH = f"{DATA_DIR}/critical_hit_table.csv"
 FUMBLE_TABLE_PATH = f"{DATA_DIR}/fumble_table.csv"
 RULES_PATH = f"{DATA_DIR}/rules.json"
+USAGE_PATH = f"{DATA_DIR}/usage.json"  # Command usage stats, written by the bot
+ROLLS_PATH = f"{DATA_DIR}/rolls.json"  # Snapshot of recent rolls, written by the bot
+REMINDERS_PATH = f"{DATA_DIR}/reminders.json"  # Pending reminders, written by the bot
+INITIATIVE_PATH = f"{DATA_DIR}/initiative.json"  # Snapshot of running encounters, written by the bot
+TRACES_PATH = f"{DATA_DIR}/traces.jsonl"  # Exported command traces, written by the bot
+
+# Data files watched for changes. Guilds' copies of these files (in GUILD_DATA_DIR) are watched too
+DATA_FILE_PATHS = [SPELLS_PATH, INVENTORY_PATH, CRIT_TABLE_PATH, FUMBLE_TABLE_PATH, RULES_PATH]
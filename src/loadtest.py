@@ -0,0 +1,312 @@
+"""Synthetic load generator for VoloBot
+
+Feeds synthetic command messages into `VoloBot.process_commands`, with every initial extension loaded, through fake
+Discord messages and channels. No connection to Discord is made. Reports throughput, per-command latency percentiles and
+event-loop lag for each target rate, so the saturation point of a single process can be found.
+
+Usage (from the `src` directory):
+    python3 loadtest.py --rates 250,500,1000,2000 --duration 10
+"""
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import random
+import time
+from collections import Counter
+from typing import Any, Optional
+
+from discord.ext.commands import CommandError, Context
+
+import utils.dispatch
+from utils.metrics import Histogram
+from volobot import CLIENT_OPTIONS, COMMAND_PREFIX, DESCRIPTION, INITIAL_EXTENSIONS, VoloBot
+
+# Default mix of commands to send, weighted. Only local data sources are used, we don't want to load test D&D Beyond
+DEFAULT_COMMANDS = {
+    "roll 2 20": 5,
+    "roll 8 6": 3,
+    "crit {percent} {dmg_type}": 3,
+    "fumble {percent}": 2,
+    "spell fireball local": 3,
+    "spell 'magic missile' local": 1,
+    "rule": 1,
+    "rule grappling": 1,
+    "bag": 1,
+}
+DAMAGE_TYPES = ["slashing", "bludgeoning", "piercing", "fire", "cold", "lightning", "force", "necrotic", "radiant", "acid", "psychic", "thunder"]
+
+# Interval at which event-loop lag is sampled (seconds)
+LAG_SAMPLE_INTERVAL = 0.01
+# Seconds to wait for in-flight commands once a step has finished sending
+DRAIN_TIMEOUT = 30.0
+
+
+class FakeUser:
+    """Stand-in for `discord.User`/`discord.Member`"""
+
+    def __init__(self: "FakeUser", user_id: int, bot: bool = False) -> None:
+        """Init FakeUser
+
+        Args:
+            user_id (`int`): ID of the user
+            bot (`bool`): Whether the user is a bot. Defaults to `False`.
+        """
+        self.id = user_id
+        self.bot = bot
+        self.name = f"user{user_id}"
+        self.display_name = self.name
+        self.mention = f"<@{user_id}>"
+
+
+class FakeGuild:
+    """Stand-in for `discord.Guild`"""
+
+    def __init__(self: "FakeGuild", guild_id: int) -> None:
+        """Init FakeGuild
+
+        Args:
+            guild_id (`int`): ID of the guild
+        """
+        self.id = guild_id
+        self.name = f"guild{guild_id}"
+        self.me = None
+
+
+class FakeMessage:
+    """Stand-in for `discord.Message`"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self: "FakeMessage", content: str, author: FakeUser, channel: "FakeChannel") -> None:
+        """Init FakeMessage
+
+        Args:
+            content (`str`): Text content of the message
+            author (`FakeUser`): Author of the message
+            channel (`FakeChannel`): Channel the message was sent in
+        """
+        self.id = next(self._ids)
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.attachments = []
+        self.embeds = []
+        self.webhook_id = None
+        self._state = None
+
+    async def edit(self: "FakeMessage", **_kwargs: Any) -> "FakeMessage":
+        """Pretend to edit the message
+
+        Returns:
+            `FakeMessage`: This message
+        """
+        return self
+
+
+class FakeChannel:
+    """Stand-in for `discord.TextChannel`. Sent messages are counted, and optionally delayed to simulate API latency"""
+
+    def __init__(self: "FakeChannel", channel_id: int, guild: FakeGuild, bot_user: FakeUser, api_latency: float = 0.0) -> None:
+        """Init FakeChannel
+
+        Args:
+            channel_id (`int`): ID of the channel
+            guild (`FakeGuild`): Guild the channel belongs to
+            bot_user (`FakeUser`): The bot's user, used as the author of sent messages
+            api_latency (`float`): Seconds each send should take. Defaults to `0.0`.
+        """
+        self.id = channel_id
+        self.guild = guild
+        self.bot_user = bot_user
+        self.api_latency = api_latency
+        self.sent = 0
+
+    async def send(self: "FakeChannel", content: Optional[str] = None, **_kwargs: Any) -> FakeMessage:
+        """Pretend to send a message
+
+        Args:
+            content (`Optional[str]`): Text content of the message. Defaults to `None`.
+
+        Returns:
+            `FakeMessage`: The "sent" message
+        """
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+        self.sent += 1
+        return FakeMessage(content or "", self.bot_user, self)
+
+
+class LoadStep:
+    """Results of running load at a single target rate"""
+
+    def __init__(self: "LoadStep", rate: int) -> None:
+        """Init LoadStep
+
+        Args:
+            rate (`int`): Target messages per second
+        """
+        self.rate = rate
+        self.sent = 0
+        self.completed = 0
+        self.elapsed = 0.0
+        self.latency: dict[str, Histogram] = {}
+        self.loop_lag = Histogram(window=100_000)
+        self.outcomes: Counter = Counter()
+
+    def record(self: "LoadStep", command: str, latency_ms: float) -> None:
+        """Record the latency of a command
+
+        Args:
+            command (`str`): Name of the command
+            latency_ms (`float`): Time taken to process the command message
+        """
+        self.latency.setdefault(command, Histogram(window=100_000)).observe(latency_ms)
+        self.completed += 1
+
+    def report(self: "LoadStep") -> str:
+        """Format the results of the step
+
+        Returns:
+            `str`: Human readable summary
+        """
+        lines = [
+            f"=== Target {self.rate} msg/s ===",
+            f"sent {self.sent}, completed {self.completed} in {self.elapsed:.1f}s -> {self.completed / self.elapsed:.0f} msg/s",
+            f"loop lag ms: p50={self.loop_lag.percentile(50):.2f} p99={self.loop_lag.percentile(99):.2f} max={self.loop_lag.max:.2f}",
+            f"outcomes: {dict(self.outcomes)}",
+            f"{'command':<10} {'count':>8} {'p50 ms':>10} {'p99 ms':>10} {'max ms':>10}",
+        ]
+        for command, histogram in sorted(self.latency.items()):
+            lines.append(f"{command:<10} {histogram.count:>8} {histogram.percentile(50):>10.2f} {histogram.percentile(99):>10.2f} {histogram.max:>10.2f}")
+        return "\n".join(lines)
+
+
+def make_content(commands: list[str], weights: list[int]) -> str:
+    """Build the content of a synthetic command message
+
+    Args:
+        commands (`list[str]`): Command templates to choose from
+        weights (`list[int]`): Weight of each template
+
+    Returns:
+        `str`: Message content
+    """
+    template = random.choices(commands, weights)[0]
+    return COMMAND_PREFIX + template.format(percent=random.randint(1, 100), dmg_type=random.choice(DAMAGE_TYPES))
+
+
+async def monitor_loop_lag(step: LoadStep, stop: asyncio.Event) -> None:
+    """Measure how late the event loop wakes us up, until told to stop
+
+    Args:
+        step (`LoadStep`): Step to record lag in
+        stop (`asyncio.Event`): Set when monitoring should end
+    """
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(LAG_SAMPLE_INTERVAL)
+        step.loop_lag.observe(max((time.perf_counter() - started - LAG_SAMPLE_INTERVAL) * 1000, 0))
+
+
+async def run_step(bot: VoloBot, channels: list[FakeChannel], users: list[FakeUser], rate: int, duration: float) -> LoadStep:
+    """Send synthetic commands at a target rate for a while
+
+    Args:
+        bot (`VoloBot`): Bot to load
+        channels (`list[FakeChannel]`): Channels to send messages in
+        users (`list[FakeUser]`): Users to send messages as
+        rate (`int`): Target messages per second
+        duration (`float`): Seconds to send messages for
+
+    Returns:
+        `LoadStep`: Results of the step
+    """
+    step = LoadStep(rate)
+    commands, weights = list(DEFAULT_COMMANDS), list(DEFAULT_COMMANDS.values())
+    in_flight = set()
+
+    async def process(message: FakeMessage) -> None:
+        command = message.content.split()[0][len(COMMAND_PREFIX) :]
+        started = time.perf_counter()
+        try:
+            await bot.process_commands(message)
+        except Exception as error:
+            step.outcomes[type(error).__name__] += 1
+        step.record(command, (time.perf_counter() - started) * 1000)
+
+    async def on_command_completion(_ctx: Context) -> None:
+        step.outcomes["success"] += 1
+
+    async def on_command_error(_ctx: Context, error: CommandError) -> None:
+        step.outcomes[type(error).__name__] += 1
+
+    bot.add_listener(on_command_completion)
+    bot.add_listener(on_command_error)
+
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop_lag(step, stop))
+    started = time.perf_counter()
+    while (elapsed := time.perf_counter() - started) < duration:
+        # Send every message that is due, then sleep until the next one
+        due = int(elapsed * rate) - step.sent
+        for _ in range(due):
+            message = FakeMessage(make_content(commands, weights), random.choice(users), random.choice(channels))
+            task = asyncio.create_task(process(message))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        step.sent += max(due, 0)
+        await asyncio.sleep(1 / rate)
+
+    if in_flight:
+        await asyncio.wait(in_flight, timeout=DRAIN_TIMEOUT)
+    step.elapsed = time.perf_counter() - started
+    stop.set()
+    await monitor
+    step.outcomes["unfinished"] = len(in_flight)
+    bot.remove_listener(on_command_completion)
+    bot.remove_listener(on_command_error)
+    return step
+
+
+async def main(args: argparse.Namespace) -> None:
+    """Run the load test
+
+    Args:
+        args (`argparse.Namespace`): Command line arguments
+    """
+    if args.unlimited:
+        # Take Discord's rate limits out of the picture to measure the bot itself
+        utils.dispatch.CHANNEL_BUCKET_CAPACITY = utils.dispatch.GLOBAL_BUCKET_CAPACITY = 10**9
+
+    bot = VoloBot(extensions=INITIAL_EXTENSIONS, command_prefix=COMMAND_PREFIX, description=DESCRIPTION, **CLIENT_OPTIONS)
+    # Synthetic traffic shouldn't count towards (or be warmed from) real usage stats
+    bot.usage.path = bot.rolls.path = None
+    bot_user = FakeUser(0, bot=True)
+    guilds = [FakeGuild(guild_id) for guild_id in range(1, args.guilds + 1)]
+    channels = [FakeChannel(channel_id, guild, bot_user, args.api_latency) for channel_id, guild in enumerate(guilds, start=1)]
+    users = [FakeUser(user_id) for user_id in range(1, args.users + 1)]
+
+    async with bot:
+        # There is no login, so give the bot a user of its own (used to ignore its own messages)
+        bot._connection.user = bot_user
+        await bot.setup_hook()
+
+        for rate in args.rates:
+            step = await run_step(bot, channels, users, rate, args.duration)
+            print(step.report(), flush=True)
+        print(f"=== Metrics ===\n{bot.metrics.format()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rates", type=lambda rates: [int(rate) for rate in rates.split(",")], default=[250, 500, 1000, 2000], help="Target msg/s per step")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run each step for")
+    parser.add_argument("--guilds", type=int, default=1000, help="Number of synthetic guilds (one channel each)")
+    parser.add_argument("--users", type=int, default=10000, help="Number of synthetic users")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Seconds each message send should take")
+    parser.add_argument("--unlimited", action="store_true", help="Disable outbound rate limiting")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,8 @@
+"""Shared test setup: modules are imported the way the bot imports them, from the `src` directory"""
+
+import os
+import sys
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
@@ -0,0 +1,33 @@
+"""Tests of fuzzy name matching"""
+
+import time
+
+from utils.fuzzy import NameIndex, get_suggestions
+
+NAMES = ["Fireball", "Fire Bolt", "Shield", "Magic Missile"]
+# Longest a Discord message can be, i.e. the longest query a user can send
+MAX_QUERY_LENGTH = 2000
+# Seconds a miss may take, far more than a miss should
+MAX_MISS_TIME = 0.01
+
+
+def test_close_names_are_suggested() -> None:
+    assert get_suggestions("firebal", [NameIndex(NAMES)]) == ["Fireball"]
+    assert get_suggestions("sheild", [NameIndex(NAMES)]) == ["Shield"]
+
+
+def test_removed_names_are_not_suggested() -> None:
+    index = NameIndex(NAMES)
+    index.remove("Magic Missile")
+
+    assert get_suggestions("magic missle", [index]) == []
+    assert index.longest == len("Fire Bolt")
+
+
+def test_long_query_misses_quickly() -> None:
+    index = NameIndex(NAMES)
+    query = "fireball " * (MAX_QUERY_LENGTH // len("fireball "))
+
+    start = time.perf_counter()
+    assert get_suggestions(query, [index]) == []
+    assert time.perf_counter() - start < MAX_MISS_TIME
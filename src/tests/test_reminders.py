@@ -0,0 +1,223 @@
+"""Tests of reminder scheduling, driven by a fake clock"""
+
+import asyncio
+from typing import Optional
+
+from utils.dispatch import MAX_MESSAGE_LENGTH
+from utils.reminders import (
+    DELIVERY_RETRY_DELAY,
+    MAX_DELIVERY_ATTEMPTS,
+    MAX_REMINDER_LENGTH,
+    MAX_REMINDERS_PER_USER,
+    TIME_UNITS,
+    Reminder,
+    ReminderScheduler,
+    ReminderTarget,
+    format_reminder_list,
+)
+
+HOUR = TIME_UNITS["h"]
+DAY = TIME_UNITS["d"]
+TARGET = ReminderTarget(channel_id=10, guild_id=20, user_id=30)
+
+
+class FakeClock:
+    """Wall clock which only moves when told to"""
+
+    def __init__(self: "FakeClock", now: float = 1_000_000.0) -> None:
+        """Init FakeClock
+
+        Args:
+            now (`float`): Starting time. Defaults to `1_000_000.0`.
+        """
+        self.now = now
+
+    def __call__(self: "FakeClock") -> float:
+        """Get the current time
+
+        Returns:
+            `float`: Current time
+        """
+        return self.now
+
+
+class Deliveries:
+    """Records delivered reminders, failing while told to"""
+
+    def __init__(self: "Deliveries") -> None:
+        """Init Deliveries"""
+        self.delivered: list[Reminder] = []
+        self.error: Optional[Exception] = None
+
+    async def __call__(self: "Deliveries", channel_id: int, reminders: list[Reminder]) -> None:
+        """Deliver the reminders due in a channel
+
+        Args:
+            channel_id (`int`): ID of the channel
+            reminders (`list[Reminder]`): Reminders due in the channel
+        """
+        assert all(reminder.channel_id == channel_id for reminder in reminders)
+        if self.error is not None:
+            raise self.error
+        self.delivered.extend(reminders)
+
+
+def make_scheduler(clock: FakeClock, path: Optional[str] = None) -> tuple[ReminderScheduler, Deliveries]:
+    """Make a scheduler delivering to a recorder
+
+    Args:
+        clock (`FakeClock`): Clock of the scheduler
+        path (`Optional[str]`): File reminders are stored in. Defaults to `None` (memory only).
+
+    Returns:
+        `tuple[ReminderScheduler, Deliveries]`: The scheduler, and its deliveries
+    """
+    deliveries = Deliveries()
+    return ReminderScheduler(deliveries, path=path, clock=clock), deliveries
+
+
+def test_pop_due_waits_until_due() -> None:
+    clock = FakeClock()
+    scheduler, _ = make_scheduler(clock)
+    reminder = scheduler.add("session", "in 2h", TARGET)
+
+    assert scheduler.pop_due(clock.now + HOUR) == []
+    assert [due.id for due in scheduler.pop_due(clock.now + 2 * HOUR)] == [reminder.id]
+
+
+def test_recurring_reminder_skips_missed_occurrences() -> None:
+    clock = FakeClock()
+    scheduler, _ = make_scheduler(clock)
+    reminder = scheduler.add("stretch", "every 1h", TARGET)
+    first_due = reminder.due
+
+    # Five and a half hours late: fired once, then due at the next occurrence still to come
+    due = scheduler.pop_due(first_due + 5.5 * HOUR)
+    assert [(fired.id, fired.due) for fired in due] == [(reminder.id, first_due)]
+    assert scheduler.get(reminder.id).due == first_due + 6 * HOUR
+    assert scheduler.next_due() == first_due + 6 * HOUR
+
+    # Exactly on time: the next occurrence is a whole interval later
+    assert len(scheduler.pop_due(first_due + 6 * HOUR)) == 1
+    assert scheduler.next_due() == first_due + 7 * HOUR
+
+
+def test_cancelled_reminder_is_skipped_lazily() -> None:
+    clock = FakeClock()
+    scheduler, _ = make_scheduler(clock)
+    soonest = scheduler.add("first", "in 1h", TARGET)
+    later = scheduler.add("second", "in 2h", TARGET)
+
+    assert scheduler.cancel(soonest.id) is soonest
+    assert scheduler.cancel(soonest.id) is None
+    # The cancelled entry stays on the heap until it reaches the top
+    assert sorted(reminder_id for _, reminder_id in scheduler.heap) == [soonest.id, later.id]
+    assert scheduler.next_due() == later.due
+    assert [reminder_id for _, reminder_id in scheduler.heap] == [later.id]
+    assert [due.id for due in scheduler.pop_due(clock.now + DAY)] == [later.id]
+    assert scheduler.next_due() is None
+
+
+def test_fire_due_delivers_and_drops_one_shot_reminders() -> None:
+    clock = FakeClock()
+    scheduler, deliveries = make_scheduler(clock)
+    reminder = scheduler.add("session", "in 1h", TARGET)
+
+    clock.now += HOUR
+    assert asyncio.run(scheduler.fire_due()) == 1
+    assert [delivered.id for delivered in deliveries.delivered] == [reminder.id]
+    assert scheduler.get(reminder.id) is None
+    assert scheduler.list_user(TARGET.user_id, TARGET.guild_id) == []
+
+
+def test_failed_one_shot_delivery_is_retried_with_backoff() -> None:
+    clock = FakeClock()
+    scheduler, deliveries = make_scheduler(clock)
+    reminder = scheduler.add("session", "in 1h", TARGET)
+    deliveries.error = RuntimeError("Discord is down")
+
+    clock.now += HOUR
+    assert asyncio.run(scheduler.fire_due()) == 1
+    assert scheduler.get(reminder.id) is not None
+    assert scheduler.next_due() == clock.now + DELIVERY_RETRY_DELAY
+
+    clock.now += DELIVERY_RETRY_DELAY
+    asyncio.run(scheduler.fire_due())
+    assert scheduler.next_due() == clock.now + 2 * DELIVERY_RETRY_DELAY
+
+    deliveries.error = None
+    clock.now += 2 * DELIVERY_RETRY_DELAY
+    asyncio.run(scheduler.fire_due())
+    assert [(delivered.id, delivered.due) for delivered in deliveries.delivered] == [(reminder.id, reminder.due)]
+    assert scheduler.get(reminder.id) is None
+
+
+def test_failed_one_shot_delivery_gives_up() -> None:
+    clock = FakeClock()
+    scheduler, deliveries = make_scheduler(clock)
+    reminder = scheduler.add("session", "in 1h", TARGET)
+    deliveries.error = RuntimeError("Discord is down")
+
+    clock.now += HOUR
+    for _ in range(MAX_DELIVERY_ATTEMPTS):
+        assert scheduler.get(reminder.id) is not None
+        clock.now = scheduler.next_due()
+        asyncio.run(scheduler.fire_due())
+    assert scheduler.get(reminder.id) is None
+    assert scheduler.next_due() is None
+
+
+def test_reminder_cancelled_during_delivery_is_not_retried() -> None:
+    clock = FakeClock()
+    scheduler, _ = make_scheduler(clock)
+    reminder = scheduler.add("session", "in 1h", TARGET)
+
+    async def deliver_to_missing_channel(channel_id: int, reminders: list[Reminder]) -> None:
+        for due in reminders:
+            scheduler.cancel(due.id)
+        raise LookupError(f"Channel {channel_id} is gone")
+
+    scheduler.deliver = deliver_to_missing_channel
+    clock.now += HOUR
+    asyncio.run(scheduler.fire_due())
+    assert scheduler.get(reminder.id) is None
+    assert scheduler.next_due() is None
+
+
+def test_reminders_missed_while_down_fire_after_load(tmp_path) -> None:
+    path = str(tmp_path / "reminders.json")
+    clock = FakeClock()
+    scheduler, _ = make_scheduler(clock, path)
+    one_shot = scheduler.add("session", "in 1h", TARGET)
+    recurring = scheduler.add("stretch", "every 1d", TARGET)
+    upcoming = scheduler.add("holiday", "in 30d", TARGET)
+    asyncio.run(scheduler.save())
+
+    # Back up two and a half days later
+    clock.now += 2.5 * DAY
+    restarted, deliveries = make_scheduler(clock, path)
+    asyncio.run(restarted.load())
+    assert sorted(restarted.reminders) == [one_shot.id, recurring.id, upcoming.id]
+
+    fired = asyncio.run(restarted.fire_due())
+    assert sorted(delivered.id for delivered in deliveries.delivered) == [one_shot.id, recurring.id]
+    assert fired == len(deliveries.delivered)
+    assert restarted.get(one_shot.id) is None
+    assert restarted.get(recurring.id).due == recurring.due + 2 * DAY
+    assert restarted.next_due() == recurring.due + 2 * DAY
+    assert restarted.get(upcoming.id).due == upcoming.due
+
+    # New reminders don't reuse saved IDs
+    assert restarted.add("another", "in 1h", TARGET).id > upcoming.id
+
+
+def test_long_reminder_list_is_split_into_messages() -> None:
+    clock = FakeClock()
+    scheduler, _ = make_scheduler(clock)
+    reminders = [scheduler.add("x" * MAX_REMINDER_LENGTH, "every 1d", TARGET) for _ in range(MAX_REMINDERS_PER_USER)]
+
+    messages = format_reminder_list(scheduler.list_user(TARGET.user_id, TARGET.guild_id))
+    assert len(messages) > 1
+    assert all(len(message) <= MAX_MESSAGE_LENGTH for message in messages)
+    listed = "\n".join(messages)
+    assert all(f"`#{reminder.id}`" in listed for reminder in reminders)
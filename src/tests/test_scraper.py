@@ -0,0 +1,142 @@
+"""Tests of the D&D Beyond page specs, run over saved pages (see `tests/fixtures/ddb`)"""
+
+import asyncio
+import os
+from urllib.error import HTTPError, URLError
+
+import pytest
+
+import utils.ddb
+from utils.cache import ExpiringCache
+from utils.ddb import DDB_PAGES, get_ddb_entry, get_ddb_url, is_ddb_entry_cached, scrape_ddb_page
+from utils.scraper import extract_page
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "ddb")
+
+
+def read_fixture(kind: str) -> bytes:
+    """Read a saved D&D Beyond page
+
+    Args:
+        kind (`str`): Kind of page, e.g. 'spell'
+
+    Returns:
+        `bytes`: Raw HTML of the page
+    """
+    with open(os.path.join(FIXTURES_DIR, f"{kind}.html"), "rb") as page:
+        return page.read()
+
+
+@pytest.fixture(autouse=True)
+def empty_ddb_cache(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Give each test an empty D&D Beyond cache"""
+    monkeypatch.setattr(utils.ddb, "DDB_ENTRIES", ExpiringCache(16, utils.ddb.DDB_ENTRY_TTL))
+
+
+def test_extract_spell_page() -> None:
+    title, fields = extract_page(read_fixture("spell"), DDB_PAGES["spell"])
+
+    assert title == "Fireball"
+    assert list(fields) == ["Description", "Level", "Casting Time", "Range", "Components", "Duration", "School", "Attack/Save", "Damage Type"]
+    assert fields["Level"] == "3rd"
+    assert fields["Casting Time"] == "1 Action"
+    assert fields["Range"] == "150 ft."
+    assert fields["Components"] == "V, S, M"
+    assert fields["School"] == "Evocation"
+    assert fields["Damage Type"] == "Fire"
+    paragraphs = fields["Description"].split("\n\n")
+    assert paragraphs[0].startswith("A bright streak flashes from your pointing finger")
+    # Inline emphasis stays in its paragraph
+    assert paragraphs[2].startswith("At Higher Levels. When you cast this spell")
+    assert paragraphs[3] == "* - (a tiny ball of bat guano and sulfur)"
+    # The related spells sidebar comes after the spell's own description
+    assert "Delayed Blast Fireball" not in fields["Description"]
+
+
+def test_extract_monster_page() -> None:
+    title, fields = extract_page(read_fixture("monster"), DDB_PAGES["monster"])
+
+    assert title == "Goblin"
+    assert fields == {
+        "Type": "Small Humanoid (Goblinoid), Neutral Evil",
+        "Armor Class": "15 (Leather Armor, Shield)",
+        "Hit Points": "7 (2d6)",
+        "Speed": "30 ft.",
+        "Ability Scores": "STR 8 (-1) | DEX 14 (+2) | CON 10 (+0) | INT 10 (+0) | WIS 8 (-1) | CHA 8 (-1)",
+        "Skills": "Stealth +6",
+        "Senses": "Darkvision 60 ft., Passive Perception 9",
+        "Languages": "Common, Goblin",
+        "Challenge": "1/4 (50 XP)",
+        "Traits": "Nimble Escape. The goblin can take the Disengage or Hide action as a bonus action on each of its turns.",
+        "Actions": "Scimitar. Melee Weapon Attack: +4 to hit, reach 5 ft., one target. Hit: 5 (1d6 + 2) slashing damage.\n\n"
+        "Shortbow. Ranged Weapon Attack: +4 to hit, range 80/320 ft., one target. Hit: 5 (1d6 + 2) piercing damage.",
+    }
+
+
+def test_extract_item_page() -> None:
+    title, fields = extract_page(read_fixture("item"), DDB_PAGES["item"])
+
+    assert title == "Bag of Holding"
+    assert fields["Type"] == "Wondrous item, uncommon"
+    paragraphs = fields["Description"].split("\n\n")
+    assert [paragraph[:30] for paragraph in paragraphs] == ["This bag has an interior space", "If the bag is overloaded, pier"]
+
+
+def test_extract_feat_page() -> None:
+    title, fields = extract_page(read_fixture("feat"), DDB_PAGES["feat"])
+
+    assert title == "Grappler"
+    assert fields["Prerequisite"] == "Prerequisite: Strength 13 or higher"
+    paragraphs = fields["Description"].split("\n\n")
+    assert paragraphs[0].startswith("You’ve developed the skills necessary")
+    # Each list item is a paragraph of its own
+    assert paragraphs[1] == "You have advantage on attack rolls against a creature you are grappling."
+    assert paragraphs[2].startswith("You can use your action to try to pin a creature")
+
+
+@pytest.mark.parametrize("kind", ["spell", "item", "feat"])
+def test_monster_spec_rejects_other_pages(kind: str) -> None:
+    assert extract_page(read_fixture(kind), DDB_PAGES["monster"]) is None
+
+
+@pytest.mark.parametrize("kind", list(DDB_PAGES))
+def test_scrape_ddb_page_links_back(kind: str) -> None:
+    url = get_ddb_url(kind, "Anything")
+    title, fields = scrape_ddb_page(read_fixture(kind), url, kind)
+
+    assert title
+    assert list(fields)[-1] == "Source"
+    assert fields["Source"] == url
+
+
+def test_ddb_urls_are_quoted() -> None:
+    assert get_ddb_url("spell", "Tasha's Hideous Laughter") == "https://www.dndbeyond.com/spells/tashas-hideous-laughter"
+    assert get_ddb_url("spell", "Évard's Black Tentacles") == "https://www.dndbeyond.com/spells/%C3%A9vards-black-tentacles"
+    assert get_ddb_url("monster", "Hag/Coven") == "https://www.dndbeyond.com/monsters/hag%2Fcoven"
+
+
+def test_get_ddb_entry_scrapes_page(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(utils.ddb, "fetch_ddb_page", lambda _: read_fixture("spell"))
+
+    embed = asyncio.run(get_ddb_entry("spell", "Fireball"))
+    assert embed.title == "Fireball"
+    assert is_ddb_entry_cached("spell", "Fireball")
+
+
+def test_missing_ddb_page_is_cached(monkeypatch: pytest.MonkeyPatch) -> None:
+    def fetch_missing(url: str) -> bytes:
+        raise HTTPError(url, 404, "Not Found", None, None)
+
+    monkeypatch.setattr(utils.ddb, "fetch_ddb_page", fetch_missing)
+    assert asyncio.run(get_ddb_entry("spell", "Not A Spell")) is None
+    assert is_ddb_entry_cached("spell", "Not A Spell")
+
+
+@pytest.mark.parametrize("error", [URLError("Name or service not known"), UnicodeEncodeError("ascii", "É", 0, 1, "ordinal not in range(128)")])
+def test_unreachable_ddb_page_is_not_cached(monkeypatch: pytest.MonkeyPatch, error: Exception) -> None:
+    def fetch_failing(_: str) -> bytes:
+        raise error
+
+    monkeypatch.setattr(utils.ddb, "fetch_ddb_page", fetch_failing)
+    assert asyncio.run(get_ddb_entry("spell", "Éclair")) is None
+    assert not is_ddb_entry_cached("spell", "Éclair")
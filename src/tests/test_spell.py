@@ -0,0 +1,79 @@
+"""Tests of spell lookups, over a temporary data directory"""
+
+import asyncio
+import json
+from typing import Optional
+
+import pytest
+from discord import Embed
+
+import utils.datasets
+import utils.spell
+from constants.paths import DATA_DIR, SPELLS_PATH
+from utils.datasets import DatasetCache
+from utils.spell import get_spell, get_spells
+from utils.spellbook import edit_spell
+
+GUILD_ID = 1234
+FIREBALL = {
+    "Casting Time": "1 action",
+    "Components": "V, S, M (a tiny ball of bat guano and sulfur)",
+    "Description": "A bright streak flashes from your pointing finger to a point you choose within range.",
+    "Duration": "Instantaneous",
+    "Level": 3,
+    "Range": "150 feet",
+    "School": "Evocation",
+}
+
+
+@pytest.fixture(autouse=True)
+def spell_data(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Give each test its own data directory with a global spell file, an empty dataset cache, and a D&D Beyond which
+    knows every spell"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / DATA_DIR).mkdir()
+    (tmp_path / SPELLS_PATH).write_text(json.dumps({"Fireball": FIREBALL}))
+    monkeypatch.setattr(utils.datasets, "DATASETS", DatasetCache())
+
+    async def get_spell_from_web(spell_name: str, _executor: Optional[object] = None) -> Embed:
+        return Embed(title=spell_name, description="From D&D Beyond")
+
+    monkeypatch.setattr(utils.spell, "get_spell_from_web", get_spell_from_web)
+
+
+def get_range(embed: Embed) -> Optional[str]:
+    """Get the range of a spell embed
+
+    Args:
+        embed (`Embed`): Spell embed
+
+    Returns:
+        `Optional[str]`: Value of the embed's range field, `None` if it doesn't have one
+    """
+    return next((field.value for field in embed.fields if field.name == "Range"), None)
+
+
+def test_local_spell_is_found_before_the_web() -> None:
+    lookup = asyncio.run(get_spell("fireball", "all", GUILD_ID))
+
+    assert not lookup.from_web
+    assert get_range(lookup.response) == "150 feet"
+
+
+def test_edited_global_spell_wins() -> None:
+    assert isinstance(asyncio.run(edit_spell("Fireball\nRange: 60 feet", GUILD_ID)), Embed)
+
+    single = asyncio.run(get_spell("fireball", "all", GUILD_ID))
+    several = asyncio.run(get_spells(["fireball", "shield"], "all", GUILD_ID))
+
+    assert get_range(single.response) == "60 feet"
+    assert get_range(several[0].response) == "60 feet"
+    # Other guilds still get the global version
+    assert get_range(asyncio.run(get_spell("fireball", "all", GUILD_ID + 1)).response) == "150 feet"
+
+
+def test_web_source_skips_local_spells() -> None:
+    lookup = asyncio.run(get_spell("fireball", "web", GUILD_ID))
+
+    assert lookup.from_web
+    assert lookup.response.description == "From D&D Beyond"
@@ -0,0 +1,209 @@
+"""Batch Command Utils
+
+`!batch` runs several commands from a single message, one per line. Each command goes through the normal command
+pipeline (checks, cooldowns, error handling, tracing) with a `BatchContext`, which collects its replies instead of
+sending them, and the replies are sent back together in one combined embed.
+
+Commands run concurrently, except for those in `BATCH_ORDERED_COMMANDS` (which change or read back what earlier
+commands did, e.g. `!store` then `!bag`). Those wait for every command before them, and commands after them wait for
+them.
+"""
+
+import asyncio
+import copy
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from discord import Embed, Message
+from discord.ext.commands import Bot, Context
+
+from utils.context import VoloContext
+from utils.embed import MAX_EMBED_CHARACTERS_PER_MESSAGE, paginate_embeds
+
+# Most commands a single batch may run
+MAX_BATCH_COMMANDS = 10
+# Commands which can't be batched: batches themselves, and commands which reply with files or edit their reply
+BATCH_EXCLUDED_COMMANDS = {"batch", "meme", "ping"}
+# Commands which run in order with the commands around them, rather than concurrently
+BATCH_ORDERED_COMMANDS = {
+    "store",
+    "remove",
+    "undo",
+    "bag",
+    "rolls",
+    "rollstats",
+    "addspell",
+    "editspell",
+    "delspell",
+    "remind",
+    "reminders",
+    "unremind",
+    "init",
+}
+# Seconds to wait for the error handler to reply to a failed command
+BATCH_ERROR_TIMEOUT = 5.0
+# Embed field names and values are limited to 256 and 1024 characters
+MAX_FIELD_NAME_LENGTH = 100
+MAX_FIELD_VALUE_LENGTH = 1024
+# Room left in the combined embed for its title
+BATCH_EMBED_OVERHEAD = 100
+
+
+class BatchContext(VoloContext):
+    """Command context of a command run by `!batch`. Replies are collected rather than sent"""
+
+    def __init__(self: "BatchContext", **kwargs: Any) -> None:
+        """Init BatchContext, passing kwargs to the Context constructor"""
+        super().__init__(**kwargs)
+        self.replies: list[tuple[Optional[str], list[Embed]]] = []
+        # Set once the error handler has replied to a failed command (see `commands.event`)
+        self.error_reported = asyncio.Event()
+
+    async def send(self: "BatchContext", content: Optional[str] = None, **kwargs: Any) -> None:
+        """Collect a reply of the command
+
+        Args:
+            content (`Optional[str]`): Text content of the reply. Defaults to `None`.
+        """
+        embeds = list(kwargs.get("embeds") or [])
+        if kwargs.get("embed") is not None:
+            embeds.insert(0, kwargs["embed"])
+        self.replies.append((None if content is None else str(content), embeds))
+        if self.command_failed:
+            self.error_reported.set()
+
+
+@dataclass
+class BatchResult:
+    """Outcome of one command of a batch"""
+
+    line: str  # The command, as written in the batch
+    text: list[str] = field(default_factory=list)  # Text replies
+    embeds: list[Embed] = field(default_factory=list)  # Embed replies
+
+
+def parse_batch(content: str, prefix: str) -> list[str]:
+    """Split the content of `!batch` into commands, one per line. The command prefix is optional
+
+    Args:
+        content (`str`): Commands to run, one per line
+        prefix (`str`): Command prefix, e.g. '!'
+
+    Returns:
+        `list[str]`: Commands, each starting with the prefix
+    """
+    lines = (line.strip() for line in content.splitlines())
+    return [line if line.startswith(prefix) else prefix + line for line in lines if line and line != prefix]
+
+
+def group_batch(contexts: list[BatchContext]) -> list[list[BatchContext]]:
+    """Group a batch's commands into steps. Commands of a step run concurrently, steps run one after the other
+
+    Args:
+        contexts (`list[BatchContext]`): Contexts of the batch's commands, in order
+
+    Returns:
+        `list[list[BatchContext]]`: Commands of each step
+    """
+    steps: list[list[BatchContext]] = []
+    for ctx in contexts:
+        if ctx.command.qualified_name in BATCH_ORDERED_COMMANDS:
+            steps.extend([[ctx], []])
+        elif steps:
+            steps[-1].append(ctx)
+        else:
+            steps.append([ctx])
+    return [step for step in steps if step]
+
+
+async def run_batched_command(bot: Bot, ctx: BatchContext) -> None:
+    """Run a command of a batch, waiting for the error handler's reply if it fails
+
+    Args:
+        bot (`Bot`): Discord Bot object
+        ctx (`BatchContext`): Context of the command
+    """
+    await bot.invoke(ctx)
+    if ctx.command_failed:
+        try:
+            await asyncio.wait_for(ctx.error_reported.wait(), BATCH_ERROR_TIMEOUT)
+        except asyncio.TimeoutError:
+            ctx.replies.append(("**Error:** The command failed", []))
+
+
+async def run_batch(bot: Bot, ctx: Context, lines: list[str]) -> list[BatchResult]:
+    """Run a batch of commands
+
+    Args:
+        bot (`Bot`): Discord Bot object
+        ctx (`Context`): Context of `!batch`
+        lines (`list[str]`): Commands to run, each starting with the prefix
+
+    Returns:
+        `list[BatchResult]`: Outcome of each command, in order
+    """
+    results = [BatchResult(line) for line in lines]
+    contexts: list[Optional[BatchContext]] = []
+    for line, result in zip(lines, results):
+        # The commands are run as if each had been sent in its own message
+        message: Message = copy.copy(ctx.message)
+        message.content = line
+        batched_ctx = await bot.get_context(message, cls=BatchContext)
+        if batched_ctx.command is None:
+            result.text.append(f"**Error:** Unknown command `{batched_ctx.invoked_with}`")
+        elif batched_ctx.command.hidden or batched_ctx.command.qualified_name in BATCH_EXCLUDED_COMMANDS:
+            result.text.append(f"**Error:** `{batched_ctx.invoked_with}` can't be batched")
+        else:
+            contexts.append(batched_ctx)
+            continue
+        contexts.append(None)
+
+    # Each command runs in its own task, like commands sent in separate messages
+    for step in group_batch([batched_ctx for batched_ctx in contexts if batched_ctx is not None]):
+        await asyncio.gather(*(run_batched_command(bot, batched_ctx) for batched_ctx in step))
+
+    for batched_ctx, result in zip(contexts, results):
+        if batched_ctx is None:
+            continue
+        for text, embeds in batched_ctx.replies:
+            if text:
+                result.text.append(text)
+            result.embeds.extend(embeds)
+    return results
+
+
+def truncate(text: str, max_length: int) -> str:
+    """Shorten text to fit in an embed
+
+    Args:
+        text (`str`): Text to shorten
+        max_length (`int`): Longest allowed length
+
+    Returns:
+        `str`: Text, shortened (ending with '…') if it's too long
+    """
+    return text if len(text) <= max_length else text[: max(max_length - 1, 0)] + "…"
+
+
+def get_batch_pages(results: list[BatchResult]) -> list[list[Embed]]:
+    """Build the reply to a batch: a combined embed with a field per command, followed by the embeds commands replied with
+
+    Args:
+        results (`list[BatchResult]`): Outcome of each command
+
+    Returns:
+        `list[list[Embed]]`: Embeds of each message, as few messages as possible
+    """
+    names = [truncate(result.line, MAX_FIELD_NAME_LENGTH) for result in results]
+    # Share the embed's character limit between the commands
+    room = (MAX_EMBED_CHARACTERS_PER_MESSAGE - BATCH_EMBED_OVERHEAD - sum(len(name) for name in names)) // max(len(results), 1)
+    combined = Embed(title="Batch")
+    for name, result in zip(names, results):
+        if result.text:
+            value = "\n".join(result.text)
+        elif result.embeds:
+            value = ", ".join(f"*{embed.title}*" if embed.title else "*Embed*" for embed in result.embeds) + " (below)"
+        else:
+            value = "*No reply*"
+        combined.add_field(name=name, value=truncate(value, min(room, MAX_FIELD_VALUE_LENGTH)), inline=False)
+    return paginate_embeds([combined, *(embed for result in results for embed in result.embeds)])
@@ -0,0 +1,114 @@
+"""Response Cache Utils"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+
+class ExpiringCache:
+    """LRU cache whose entries expire after a time to live. Concurrent loads of the same key share a single load"""
+
+    def __init__(self: "ExpiringCache", max_entries: int, ttl: float) -> None:
+        """Init ExpiringCache
+
+        Args:
+            max_entries (`int`): Maximum number of entries to keep
+            ttl (`float`): Default seconds entries stay fresh for
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # (expiry time, value) of each key, ordered from least to most recently used
+        self.entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.loading: dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self: "ExpiringCache") -> int:
+        """Get the number of cached entries
+
+        Returns:
+            `int`: Number of entries, including any which have expired but haven't been evicted yet
+        """
+        return len(self.entries)
+
+    def __contains__(self: "ExpiringCache", key: Hashable) -> bool:
+        """Check if a fresh value is cached for a key, without counting as a use
+
+        Args:
+            key (`Hashable`): Key to check
+
+        Returns:
+            `bool`: True if a fresh value is cached
+        """
+        entry = self.entries.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def put(self: "ExpiringCache", key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Cache a value, evicting the least recently used entries if the cache is full
+
+        Args:
+            key (`Hashable`): Key to cache the value under
+            value (`Any`): Value to cache
+            ttl (`Optional[float]`): Seconds the value stays fresh for. Defaults to the cache's `ttl`.
+        """
+        self.entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def get_or_load(self: "ExpiringCache", key: Hashable, load: Callable[[], Awaitable[Any]], ttl: Optional[Callable[[Any], float]] = None) -> Any:
+        """Get a cached value, loading (and caching) it if it's missing or expired
+
+        Args:
+            key (`Hashable`): Key of the value
+            load (`Callable[[], Awaitable[Any]]`): Coroutine function loading the value
+            ttl (`Optional[Callable[[Any], float]]`): Function getting the seconds a loaded value stays fresh for,
+                e.g. to cache misses for less time. Defaults to the cache's `ttl`.
+
+        Returns:
+            `Any`: Cached or loaded value
+        """
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[1]
+
+        if key in self.loading:
+            return await asyncio.shield(self.loading[key])
+
+        self.misses += 1
+        future = self.loading[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await load()
+        except Exception as error:
+            future.set_exception(error)
+            # Mark the exception as retrieved, in case nobody else was waiting for this load
+            future.exception()
+            raise
+        else:
+            self.put(key, value, None if ttl is None else ttl(value))
+            future.set_result(value)
+        finally:
+            # The load was cancelled (e.g. a command timed out), release the callers waiting for it
+            if not future.done():
+                future.cancel()
+            del self.loading[key]
+        return value
+
+    def shrink(self: "ExpiringCache", fraction: float) -> int:
+        """Evict least recently used entries until the cache is at most a fraction of its current size
+
+        Args:
+            fraction (`float`): Fraction of the current size to shrink to
+
+        Returns:
+            `int`: Number of entries evicted
+        """
+        target = int(len(self.entries) * fraction)
+        evicted = 0
+        while len(self.entries) > target:
+            self.entries.popitem(last=False)
+            evicted += 1
+        return evicted
@@ -0,0 +1,33 @@
+"""Command Context Utils"""
+
+from typing import Any, Optional
+
+from discord import Message
+from discord.ext.commands import Context
+
+
+class VoloContext(Context):
+    """Command context used by VoloBot.
+
+    Replies sent with `ctx.send` are routed through the bot's outbound `Dispatcher` rather than straight to Discord.
+    """
+
+    async def send(self: "VoloContext", content: Optional[str] = None, **kwargs: Any) -> Message:
+        """Send a message to the context's channel through the bot's dispatcher
+
+        Args:
+            content (`Optional[str]`): Text content of the message. Defaults to `None`.
+
+        Returns:
+            `Message`: The sent message
+        """
+        # Interaction responses (slash commands) aren't subject to channel rate limits
+        if self.interaction is not None:
+            return await super().send(content, **kwargs)
+        kwargs.pop("ephemeral", None)
+        return await self.bot.dispatcher.send(self.channel, content, **kwargs)
+
+    @property
+    def guild_id(self: "VoloContext") -> Optional[int]:
+        """ID of the guild the command was invoked in, `None` outside of guilds (e.g. DMs). Used to select guild data"""
+        return self.guild.id if self.guild is not None else None
@@ -1,11 +1,25 @@
 """Critical Hit/Miss Utils"""
 
-from typing import Union
+import random
+import re
+from operator import itemgetter
+from typing import Optional, Union
 
 import aiofiles
 from aiocsv import AsyncDictReader
+from discord import Embed
 
 from constants.paths import CRIT_TABLE_PATH, FUMBLE_TABLE_PATH
+from utils.datasets import get_layer_paths, load_derived, load_override_dataset
+from utils.fuzzy import format_suggestions, get_suggestions, load_name_indexes
+
+# Most crits that can be resolved with a single command (an embed has at most 25 fields)
+MAX_CRITS_PER_COMMAND = 25
+# Name of the crit table's outcome columns, derived from the loaded table (see `utils.datasets.load_derived`)
+CRIT_COLUMNS = "crit_columns"
+# Number of crits to roll, e.g. '8x'
+ROLLED_CRITS = re.compile(r"(\d+)x", re.IGNORECASE)
+INVALID_PERCENTAGE_TEXT = "**Error:** Invalid Percentage Roll\nMust be value from 1-100"
 
 
 def validate_crit_percentage(input_percentage: int) -> bool:
@@ -70,41 +84,148 @@ async def read_crit_csv_async(path: str) -> tuple[list[str], dict[int, dict]]:
     return headers, data
 
 
-async def get_crit_result(crit_percentage: int, dmg_type: str) -> str:
+def get_damage_types(crit_table: tuple[list[str], dict[int, dict]]) -> list[str]:
+    """Get the damage types of a loaded critical hit table
+
+    Args:
+        crit_table (`tuple[list[str], dict[int, dict]]`): CSV headers and data, as returned by `read_crit_csv_async`
+
+    Returns:
+        `list[str]`: Damage types
+    """
+    return crit_table[0]
+
+
+def build_crit_columns(crit_table: tuple[list[str], dict[int, dict]]) -> dict[str, tuple[str, ...]]:
+    """Turn a critical hit table into a column of outcomes per damage type, indexed by roll, so that many rolls can be
+    looked up at once
+
+    Args:
+        crit_table (`tuple[list[str], dict[int, dict]]`): CSV headers and data, as returned by `read_crit_csv_async`
+
+    Returns:
+        `dict[str, tuple[str, ...]]`: Outcome of each roll (index 0 is unused) by damage type
+    """
+    headers, data = crit_table
+    rows = [data.get(roll, {}) for roll in range(max(max(data, default=0), 100) + 1)]
+    return {dmg_type: tuple(row.get(dmg_type, "") for row in rows) for dmg_type in headers}
+
+
+async def load_crit_columns(guild_id: Optional[int] = None) -> dict[str, tuple[str, ...]]:
+    """Load the outcome columns of the crit table used in a guild
+
+    Args:
+        guild_id (`Optional[int]`): ID of the guild, whose custom crit table takes precedence. Defaults to `None`.
+
+    Returns:
+        `dict[str, tuple[str, ...]]`: Outcome of each roll by damage type
+    """
+    for path in get_layer_paths(CRIT_TABLE_PATH, guild_id):
+        if (columns := await load_derived(path, CRIT_COLUMNS, build_crit_columns, read_crit_csv_async)) is not None:
+            return columns
+    return {}
+
+
+def parse_crit_rolls(rolls: str) -> Optional[list[int]]:
+    """Parse the crit rolls of a command: comma separated percentages (e.g. '12,57,88'), or a number of crits to roll (e.g. '8x')
+
+    Args:
+        rolls (`str`): Rolls to parse
+
+    Returns:
+        `Optional[list[int]]`: Percentages, `None` if they aren't valid
+    """
+    if match := ROLLED_CRITS.fullmatch(rolls.strip()):
+        count = int(match.group(1))
+        return random.choices(range(1, 101), k=count) if 0 < count <= MAX_CRITS_PER_COMMAND else None
+    parts = [part.strip() for part in rolls.split(",") if part.strip()]
+    if not parts or len(parts) > MAX_CRITS_PER_COMMAND or not all(part.isdigit() for part in parts):
+        return None
+    percentages = [int(part) for part in parts]
+    return percentages if all(validate_crit_percentage(percentage) for percentage in percentages) else None
+
+
+async def get_damage_type_error(dmg_type: str, valid_dmg_types: list[str], guild_id: Optional[int] = None) -> str:
+    """Get the error message for an invalid damage type, suggesting the closest valid types
+
+    Args:
+        dmg_type (`str`): Damage type that isn't valid
+        valid_dmg_types (`list[str]`): Valid damage types
+        guild_id (`Optional[int]`): ID of the guild, whose custom crit table takes precedence. Defaults to `None`.
+
+    Returns:
+        `str`: Error message
+    """
+    indexes = await load_name_indexes(CRIT_TABLE_PATH, guild_id, read_crit_csv_async, get_damage_types, override=True)
+    suggestions = format_suggestions(get_suggestions(dmg_type, indexes))
+    valid_list = "\n".join(valid_dmg_types)
+    return f"**Error:** Invalid Damage Type{suggestions}\nSupported types: ```\n{valid_list}```"
+
+
+async def get_crit_results(rolls: list[int], dmg_type: str, guild_id: Optional[int] = None) -> Union[str, Embed]:
+    """Resolve several critical hits at once (e.g. an area of effect spell), grouping identical outcomes
+
+    Args:
+        rolls (`list[int]`): Percentages representing each critical hit's severity, each from 1 to 100
+        dmg_type (`str`): Type of damage being inflicted
+        guild_id (`Optional[int]`): ID of the guild, whose custom crit table takes precedence. Defaults to `None`.
+
+    Returns:
+        `Union[str, Embed]`: Discord embed with a field per distinct outcome, or an error message
+    """
+    columns = await load_crit_columns(guild_id)
+    if not (clean_dmg_type := validate_damage_type(list(columns), dmg_type)):
+        return await get_damage_type_error(dmg_type, list(columns), guild_id)
+
+    # Look every roll up in one go. `itemgetter` returns a bare value (rather than a tuple) for a single roll
+    outcomes = itemgetter(*rolls)(columns[clean_dmg_type]) if len(rolls) > 1 else (columns[clean_dmg_type][rolls[0]],)
+    # Rolls of each outcome, from the least to the most severe outcome
+    groups: dict[str, list[int]] = {}
+    for roll, outcome in sorted(zip(rolls, outcomes)):
+        groups.setdefault(outcome, []).append(roll)
+
+    embed = Embed(title=f"{len(rolls)} critical hit{'s' if len(rolls) != 1 else ''} ({clean_dmg_type})")
+    for outcome, outcome_rolls in groups.items():
+        embed.add_field(name=f"{len(outcome_rolls)}× (rolled {', '.join(map(str, outcome_rolls))})", value=outcome or "*No effect*", inline=False)
+    return embed
+
+
+async def get_crit_result(crit_percentage: int, dmg_type: str, guild_id: Optional[int] = None) -> str:
     """Get critical hit result
 
     Args:
         crit_percentage (`int`): Percentage representing critical hit severity
         dmg_type (`str`): Type of damage being inflicted
+        guild_id (`Optional[int]`): ID of the guild, whose custom crit table takes precedence. Defaults to `None`.
 
     Returns:
         `str`: Description of the crit result
     """
     if validate_crit_percentage(crit_percentage):
-        valid_dmg_types, crit_table = await read_crit_csv_async(CRIT_TABLE_PATH)
+        valid_dmg_types, crit_table = await load_override_dataset(CRIT_TABLE_PATH, guild_id, read_crit_csv_async)
         if clean_dmg_type := validate_damage_type(valid_dmg_types, dmg_type):
             response = crit_table[crit_percentage][clean_dmg_type]
         else:
-            # using chr(10) as newline, because f-string doesn't support \n in expression part
-            response = f"**Error:** Invalid Damage Type\nSupported types: ```\n{chr(10).join(valid_dmg_types)}```"
+            response = await get_damage_type_error(dmg_type, valid_dmg_types, guild_id)
     else:
-        response = "**Error:** Invalid Percentage Roll\nMust be value from 1-100"
+        response = INVALID_PERCENTAGE_TEXT
     return response
 
 
-async def get_fumble_result(fumble_percentage: int) -> str:
+async def get_fumble_result(fumble_percentage: int, guild_id: Optional[int] = None) -> str:
     """Get critical miss result
 
     Args:
         fumble_percentage (`int`): Percentage representing critical miss severity
+        guild_id (`Optional[int]`): ID of the guild, whose custom fumble table takes precedence. Defaults to `None`.
 
     Returns:
         `str`: Description of the fumble result
     """
     if validate_crit_percentage(fumble_percentage):
-        headers, fumble_table = await read_crit_csv_async(FUMBLE_TABLE_PATH)
+        headers, fumble_table = await load_override_dataset(FUMBLE_TABLE_PATH, guild_id, read_crit_csv_async)
         fumble_column = headers[0]
         response = fumble_table[fumble_percentage][fumble_column]
     else:
-        response = "**Error:** Invalid Percentage Roll\nMust be value from 1-100"
+        response = INVALID_PERCENTAGE_TEXT
     return response
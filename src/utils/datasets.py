@@ -0,0 +1,551 @@
+"""Dataset Loading Utils
+
+Data files (spells, rules, inventories, crit tables) are loaded once and kept in an LRU cache with a total memory budget.
+Datasets that haven't been used for a while are evicted, so memory use depends on the guilds that are actually active.
+
+Each guild may have its own data namespace (see `constants.paths.GUILD_DATA_DIR`) which takes precedence over the global
+defaults in `constants.paths.DATA_DIR`.
+
+Cached datasets are never re-checked on the request path. Instead, the data file watcher calls `refresh_dataset` when a
+file changes on disk, and the new version is swapped in once it has been loaded.
+
+Single entries of dict-like datasets can be changed in place with `apply_dataset_change`. Derived structures with an
+`apply_change(key, old, new)` method (e.g. `NameMap`, `RenderedResponses`, `utils.fuzzy.NameIndex`) are updated along
+with the data, others are dropped and rebuilt on next use.
+"""
+
+import asyncio
+import os
+import time
+from collections import ChainMap, OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional
+
+from constants.paths import GUILD_DATA_DIR
+from utils.json_utils import read_json_async
+from utils.logging import get_logger
+from utils.tracing import span
+
+LOGGER = get_logger(os.path.basename(__file__))
+
+# Total (estimated) memory cached datasets may use, in bytes
+DATASET_MEMORY_BUDGET = int(os.getenv("DATASET_MEMORY_BUDGET", str(64 * 1024 * 1024)))
+# Datasets not used for this many seconds are evicted
+DATASET_IDLE_SECONDS = float(os.getenv("DATASET_IDLE_SECONDS", str(30 * 60)))
+# Rough ratio between the size of a data file on disk and the size of the Python objects it's loaded into
+IN_MEMORY_SIZE_FACTOR = 4
+# Estimated size of an entry recording that a file doesn't exist
+MISSING_ENTRY_SIZE = 256
+
+# Names of the derived structures holding a dataset's rendered responses, and its names by their lowercase form
+RENDERED = "rendered"
+NAME_MAP = "name_map"
+
+Loader = Callable[[str], Awaitable[Any]]
+Builder = Callable[[Any], Any]
+
+
+@dataclass
+class CachedDataset:
+    """A loaded data file"""
+
+    path: str
+    data: Any  # `None` if the file doesn't exist
+    size: int
+    mtime: Optional[int]  # Modification time (ns) of the file when it was loaded, `None` if it doesn't exist
+    loader: Loader
+    last_used: float = field(default_factory=time.monotonic)
+    # Structures built from the data (e.g. search indexes), dropped along with it when the file changes
+    derived: dict[str, Any] = field(default_factory=dict)
+
+
+class NameMap(dict):
+    """Names of a dict-like dataset's entries by their lowercase form, for case-insensitive lookups"""
+
+    def apply_change(self: "NameMap", key: str, _old: Any, new: Any) -> None:
+        """Update the map after an entry of the dataset changed
+
+        Args:
+            key (`str`): Name of the entry
+            _old (`Any`): Previous value of the entry, `None` if it was added
+            new (`Any`): New value of the entry, `None` if it was deleted
+        """
+        if new is None:
+            self.pop(key.lower(), None)
+        else:
+            self[key.lower()] = key
+
+
+class RenderedResponses(dict):
+    """Responses rendered from a dataset's entries, keyed by entry name or its lowercase form"""
+
+    def apply_change(self: "RenderedResponses", key: str, _old: Any, _new: Any) -> None:
+        """Drop the responses of an entry of the dataset which changed
+
+        Args:
+            key (`str`): Name of the entry
+            _old (`Any`): Previous value of the entry, `None` if it was added
+            _new (`Any`): New value of the entry, `None` if it was deleted
+        """
+        self.pop(key, None)
+        self.pop(key.lower(), None)
+
+
+def get_mtime(path: str) -> Optional[int]:
+    """Get the modification time of a file
+
+    Args:
+        path (`str`): Path to the file
+
+    Returns:
+        `Optional[int]`: Modification time in nanoseconds, `None` if the file doesn't exist
+    """
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+async def read_dataset(path: str, loader: Loader) -> CachedDataset:
+    """Read a data file from disk
+
+    Args:
+        path (`str`): Path to the data file
+        loader (`Loader`): Coroutine function used to load the file
+
+    Returns:
+        `CachedDataset`: Loaded data file, with `None` data if the file doesn't exist
+    """
+    if (mtime := get_mtime(path)) is None:
+        return CachedDataset(path, None, MISSING_ENTRY_SIZE, None, loader)
+    data = await loader(path)
+    return CachedDataset(path, data, os.path.getsize(path) * IN_MEMORY_SIZE_FACTOR, mtime, loader)
+
+
+class DatasetCache:
+    """LRU cache of loaded data files, bounded by a memory budget and evicting idle entries"""
+
+    def __init__(self: "DatasetCache", budget: int = DATASET_MEMORY_BUDGET, idle_seconds: float = DATASET_IDLE_SECONDS) -> None:
+        """Init DatasetCache
+
+        Args:
+            budget (`int`): Total estimated bytes cached datasets may use. Defaults to `DATASET_MEMORY_BUDGET`.
+            idle_seconds (`float`): Seconds after which unused datasets are evicted. Defaults to `DATASET_IDLE_SECONDS`.
+        """
+        self.budget = budget
+        self.idle_seconds = idle_seconds
+        # Ordered from least to most recently used
+        self.entries: OrderedDict[str, CachedDataset] = OrderedDict()
+        self.size = 0
+        # Loads in progress, so concurrent requests for the same file share a single read
+        self.loading: dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self: "DatasetCache", path: str, loader: Loader = read_json_async) -> Any:
+        """Get the content of a data file, loading it if it isn't cached
+
+        Args:
+            path (`str`): Path to the data file
+            loader (`Loader`): Coroutine function used to load the file. Defaults to `read_json_async`.
+
+        Returns:
+            `Any`: Loaded data, or `None` if the file doesn't exist
+        """
+        self.evict_idle()
+        if (entry := self.entries.get(path)) is not None:
+            self.hits += 1
+            entry.last_used = time.monotonic()
+            self.entries.move_to_end(path)
+            return entry.data
+
+        if path in self.loading:
+            return await asyncio.shield(self.loading[path])
+
+        self.misses += 1
+        future = self.loading[path] = asyncio.get_running_loop().create_future()
+        try:
+            with span("load", path):
+                entry = await read_dataset(path, loader)
+        except Exception as error:
+            future.set_exception(error)
+            # Mark the exception as retrieved, in case nobody else was waiting for this load
+            future.exception()
+            raise
+        else:
+            self._insert(entry)
+            future.set_result(entry.data)
+        finally:
+            # The load was cancelled (e.g. a command timed out), release the callers waiting for it
+            if not future.done():
+                future.cancel()
+            del self.loading[path]
+        return entry.data
+
+    async def derive(self: "DatasetCache", path: str, name: str, build: Builder, loader: Loader = read_json_async) -> Any:
+        """Get a structure built from a data file's content, building it the first time it's needed.
+        Whenever the file is rewritten or reloaded, the structure is rebuilt on next use.
+
+        Args:
+            path (`str`): Path to the data file
+            name (`str`): Name of the derived structure
+            build (`Builder`): Function building the structure from the file's content
+            loader (`Loader`): Coroutine function used to load the file. Defaults to `read_json_async`.
+
+        Returns:
+            `Any`: Derived structure, or `None` if the file doesn't exist
+        """
+        data = await self.get(path, loader)
+        if data is None:
+            return None
+        entry = self.entries.get(path)
+        # The entry may already have been evicted again (e.g. if it's bigger than the whole budget)
+        if entry is None or entry.data is not data:
+            return build(data)
+        if name not in entry.derived:
+            entry.derived[name] = build(data)
+        return entry.derived[name]
+
+    def put(self: "DatasetCache", path: str, data: Any, loader: Loader = read_json_async) -> None:
+        """Replace the cached content of a data file (e.g. after writing it)
+
+        Args:
+            path (`str`): Path to the data file
+            data (`Any`): New content of the file
+            loader (`Loader`): Coroutine function used to (re)load the file. Defaults to `read_json_async`.
+        """
+        mtime = get_mtime(path)
+        size = MISSING_ENTRY_SIZE if mtime is None else os.path.getsize(path) * IN_MEMORY_SIZE_FACTOR
+        self._insert(CachedDataset(path, data, size, mtime, loader))
+
+    def apply_change(self: "DatasetCache", path: str, key: str, value: Any) -> bool:
+        """Change a single entry of a cached dict-like data file in place, after the change has been written to disk.
+        Derived structures are updated in place where they support it, and dropped otherwise.
+
+        Args:
+            path (`str`): Path to the data file
+            key (`str`): Key of the entry
+            value (`Any`): New value of the entry, `None` to delete it
+
+        Returns:
+            `bool`: True if the file was cached and changed, False if it will be loaded (with the change) when next needed
+        """
+        entry = self.entries.get(path)
+        if entry is None or entry.data is None:
+            return False
+        old = entry.data.get(key)
+        if value is None:
+            entry.data.pop(key, None)
+        else:
+            entry.data[key] = value
+        for name, structure in list(entry.derived.items()):
+            if (apply_change := getattr(structure, "apply_change", None)) is None:
+                del entry.derived[name]
+            else:
+                apply_change(key, old, value)
+        return True
+
+    def mark_written(self: "DatasetCache", path: str) -> None:
+        """Record that a cached data file was rewritten with the content already cached (e.g. when compacting it),
+        so the watcher doesn't reload it and its derived structures are kept
+
+        Args:
+            path (`str`): Path to the data file
+        """
+        if (entry := self.entries.get(path)) is not None and (mtime := get_mtime(path)) is not None:
+            size = os.path.getsize(path) * IN_MEMORY_SIZE_FACTOR
+            self.size += size - entry.size
+            entry.size = size
+            entry.mtime = mtime
+
+    async def refresh(self: "DatasetCache", path: str) -> bool:
+        """Reload a cached data file which has changed on disk, swapping in the new version once it has loaded.
+
+        Files which aren't cached are left alone, they will be loaded when next needed.
+        If the new version can't be loaded (e.g. a half-finished hand edit), the old version is kept.
+
+        Args:
+            path (`str`): Path to the data file
+
+        Returns:
+            `bool`: True if a new version was swapped in
+        """
+        entry = self.entries.get(path)
+        # Skip files we aren't caching, and changes we already know about (e.g. our own writes)
+        if entry is None or get_mtime(path) == entry.mtime:
+            return False
+
+        try:
+            new_entry = await read_dataset(path, entry.loader)
+        except Exception as error:
+            LOGGER.warning("Keeping previous version of '%s', failed to reload it: %s", path, error)
+            return False
+
+        # Don't clobber a version written (or evicted) while we were loading
+        if self.entries.get(path) is not entry:
+            return False
+        new_entry.last_used = entry.last_used
+        self._insert(new_entry)
+        LOGGER.info("Reloaded '%s'", path)
+        return True
+
+    def invalidate(self: "DatasetCache", path: str) -> None:
+        """Drop a data file from the cache, it will be reloaded next time it's needed
+
+        Args:
+            path (`str`): Path to the data file
+        """
+        if (entry := self.entries.pop(path, None)) is not None:
+            self.size -= entry.size
+
+    def _insert(self: "DatasetCache", entry: CachedDataset) -> None:
+        """Add an entry to the cache, evicting least recently used entries to stay within budget
+
+        Args:
+            entry (`CachedDataset`): Entry to add
+        """
+        self.invalidate(entry.path)
+        self.entries[entry.path] = entry
+        self.size += entry.size
+        # Never evict the entry we just added, even if it's bigger than the whole budget
+        while self.size > self.budget and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.size
+
+    def evict_idle(self: "DatasetCache") -> None:
+        """Evict datasets which haven't been used recently"""
+        cutoff = time.monotonic() - self.idle_seconds
+        # Entries are ordered by last use, so we only ever need to look at the front
+        while self.entries and next(iter(self.entries.values())).last_used < cutoff:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.size
+
+    def shrink(self: "DatasetCache", fraction: float) -> int:
+        """Evict least recently used datasets until the cache is at most a fraction of its current size
+
+        Args:
+            fraction (`float`): Fraction of the current size to shrink to
+
+        Returns:
+            `int`: Estimated bytes freed
+        """
+        target = self.size * fraction
+        freed = 0
+        while self.entries and self.size > target:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.size
+            freed += evicted.size
+        return freed
+
+    def stats(self: "DatasetCache") -> dict[str, int]:
+        """Get cache statistics
+
+        Returns:
+            `dict[str, int]`: Number of entries, estimated size, budget, hits and misses
+        """
+        return {"entries": len(self.entries), "size": self.size, "budget": self.budget, "hits": self.hits, "misses": self.misses}
+
+
+# Shared by all data utils. Reloading utils modules (i.e. `!reload`) starts with a fresh cache
+DATASETS = DatasetCache()
+
+
+def get_guild_path(path: str, guild_id: Optional[int]) -> str:
+    """Get the path of a guild's own copy of a data file
+
+    e.g. `data/spells.json` -> `data/guilds/1234/spells.json`
+
+    Args:
+        path (`str`): Path to the global data file
+        guild_id (`Optional[int]`): ID of the guild, `None` outside of guilds (e.g. DMs)
+
+    Returns:
+        `str`: Path to the guild's data file, or the global path if there is no guild
+    """
+    if guild_id is None:
+        return path
+    return f"{GUILD_DATA_DIR.format(guild_id=guild_id)}/{os.path.basename(path)}"
+
+
+def get_layer_paths(path: str, guild_id: Optional[int]) -> list[str]:
+    """Get the paths of every layer of a data file, highest precedence first
+
+    Args:
+        path (`str`): Path to the global data file
+        guild_id (`Optional[int]`): ID of the guild, `None` outside of guilds (e.g. DMs)
+
+    Returns:
+        `list[str]`: Path to the guild's data file (if there is a guild), then the global path
+    """
+    return [path] if guild_id is None else [get_guild_path(path, guild_id), path]
+
+
+async def load_dataset(path: str, loader: Loader = read_json_async) -> Any:
+    """Load a data file through the shared cache
+
+    Args:
+        path (`str`): Path to the data file
+        loader (`Loader`): Coroutine function used to load the file. Defaults to `read_json_async`.
+
+    Returns:
+        `Any`: Loaded data, or `None` if the file doesn't exist
+    """
+    return await DATASETS.get(path, loader)
+
+
+async def load_merged_dataset(path: str, guild_id: Optional[int]) -> ChainMap:
+    """Load a dict-like data file with a guild's entries layered over the global ones (e.g. homebrew spells, house rules)
+
+    Args:
+        path (`str`): Path to the global data file
+        guild_id (`Optional[int]`): ID of the guild, `None` outside of guilds
+
+    Returns:
+        `ChainMap`: Guild entries (if any), falling back to global entries
+    """
+    layers = [data for layer_path in get_layer_paths(path, guild_id) if (data := await load_dataset(layer_path))]
+    return ChainMap(*layers)
+
+
+async def load_override_dataset(path: str, guild_id: Optional[int], loader: Loader = read_json_async) -> Any:
+    """Load a guild's own copy of a data file if it has one, otherwise the global file (e.g. custom crit tables)
+
+    Args:
+        path (`str`): Path to the global data file
+        guild_id (`Optional[int]`): ID of the guild, `None` outside of guilds
+        loader (`Loader`): Coroutine function used to load the file. Defaults to `read_json_async`.
+
+    Returns:
+        `Any`: Loaded data
+    """
+    if guild_id is not None and (guild_data := await load_dataset(get_guild_path(path, guild_id), loader)) is not None:
+        return guild_data
+    return await load_dataset(path, loader)
+
+
+async def load_derived(path: str, name: str, build: Builder, loader: Loader = read_json_async) -> Any:
+    """Load a structure built from a data file's content (e.g. a search index) through the shared cache
+
+    Args:
+        path (`str`): Path to the data file
+        name (`str`): Name of the derived structure
+        build (`Builder`): Function building the structure from the file's content
+        loader (`Loader`): Coroutine function used to load the file. Defaults to `read_json_async`.
+
+    Returns:
+        `Any`: Derived structure, or `None` if the file doesn't exist
+    """
+    return await DATASETS.derive(path, name, build, loader)
+
+
+async def load_name_map(path: str, loader: Loader = read_json_async) -> Optional[NameMap]:
+    """Load the names of a dict-like data file's entries by their lowercase form, for case-insensitive lookups
+
+    Args:
+        path (`str`): Path to the data file
+        loader (`Loader`): Coroutine function used to load the file. Defaults to `read_json_async`.
+
+    Returns:
+        `Optional[NameMap]`: Names by their lowercase form, or `None` if the file doesn't exist
+    """
+    return await load_derived(path, NAME_MAP, lambda data: NameMap((name.lower(), name) for name in data), loader)
+
+
+async def load_rendered(path: str, key: str, render: Builder, loader: Loader = read_json_async) -> Any:
+    """Load a response rendered from a data file (e.g. a spell's embed), rendering it the first time it's needed.
+    Rendered responses are dropped whenever the file is rewritten or reloaded.
+
+    Args:
+        path (`str`): Path to the data file
+        key (`str`): Key of the response (e.g. the spell name)
+        render (`Builder`): Function rendering the response from the file's content, returning `None` if there's nothing to render
+        loader (`Loader`): Coroutine function used to load the file. Defaults to `read_json_async`.
+
+    Returns:
+        `Any`: Rendered response, or `None` if the file doesn't exist or `render` returned `None`
+    """
+    rendered = await load_derived(path, RENDERED, lambda _: RenderedResponses(), loader)
+    if rendered is None:
+        return None
+    if (response := rendered.get(key)) is None:
+        response = render(await load_dataset(path, loader))
+        # Misses aren't cached, so the cache can't grow beyond the entries in the file
+        if response is not None:
+            rendered[key] = response
+    return response
+
+
+async def refresh_dataset(path: str) -> bool:
+    """Reload a data file in the shared cache after it has changed on disk
+
+    Args:
+        path (`str`): Path to the data file
+
+    Returns:
+        `bool`: True if a new version was swapped in
+    """
+    return await DATASETS.refresh(path)
+
+
+def store_dataset(path: str, data: Any, loader: Loader = read_json_async) -> None:
+    """Update the cached content of a data file after it has been written
+
+    Args:
+        path (`str`): Path to the data file
+        data (`Any`): New content of the file
+        loader (`Loader`): Coroutine function used to (re)load the file. Defaults to `read_json_async`.
+    """
+    DATASETS.put(path, data, loader)
+
+
+def apply_dataset_change(path: str, key: str, value: Any) -> bool:
+    """Change a single entry of a cached dict-like data file in place, after the change has been written to disk
+
+    Args:
+        path (`str`): Path to the data file
+        key (`str`): Key of the entry
+        value (`Any`): New value of the entry, `None` to delete it
+
+    Returns:
+        `bool`: True if the file was cached and changed, False if it will be loaded (with the change) when next needed
+    """
+    return DATASETS.apply_change(path, key, value)
+
+
+def mark_dataset_written(path: str) -> None:
+    """Record that a cached data file was rewritten with the content already cached
+
+    Args:
+        path (`str`): Path to the data file
+    """
+    DATASETS.mark_written(path)
+
+
+def shrink_datasets(fraction: float) -> int:
+    """Shrink the shared dataset cache, e.g. under memory pressure
+
+    Args:
+        fraction (`float`): Fraction of the current size to shrink to
+
+    Returns:
+        `int`: Estimated bytes freed
+    """
+    return DATASETS.shrink(fraction)
+
+
+def get_datasets_size() -> int:
+    """Get the estimated size of the shared dataset cache
+
+    Returns:
+        `int`: Estimated bytes used by cached datasets
+    """
+    return DATASETS.size
+
+
+def get_dataset_stats() -> dict[str, int]:
+    """Get statistics of the shared dataset cache
+
+    Returns:
+        `dict[str, int]`: Number of entries, estimated size, budget, hits and misses
+    """
+    return DATASETS.stats()
@@ -1,47 +1,250 @@
-"""General D&D Beyond Scraping Utils"""
+"""General D&D Beyond Scraping Utils
 
+Spells, monsters, magic items and feats are scraped from D&D Beyond with the page specs below (see `utils.scraper`).
+Every kind of page shares the same fetching, parsing (in the executor service) and cache, in which concurrent lookups of
+the same page share a single fetch.
+"""
+
+import asyncio
+import os
+from typing import Optional
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote
 from urllib.request import Request, urlopen
 
-from bs4 import BeautifulSoup
+from discord import Embed
+
+from utils.cache import ExpiringCache
+from utils.embed import dict_to_embed
+from utils.executor import ExecutorService, offload
+from utils.logging import get_logger
+from utils.scraper import PARAGRAPHS, TEXT, Field, LabeledFields, PageSpec, extract_page
+from utils.tracing import span
+
+LOGGER = get_logger(os.path.basename(__file__))
 
 USER_AGENT = "Mozilla/5.0"
-HTML_PARSER = "html.parser"
 
 BASE_URL = "https://www.dndbeyond.com"
-SPELL_URL = BASE_URL + "/spells/{spell_name}"
+# URL of each kind of page, by kind
+DDB_URLS = {
+    "spell": BASE_URL + "/spells/{slug}",
+    "monster": BASE_URL + "/monsters/{slug}",
+    "item": BASE_URL + "/magic-items/{slug}",
+    "feat": BASE_URL + "/feats/{slug}",
+}
+
+# Pages scraped from D&D Beyond are kept for a while, pages rarely change
+DDB_CACHE_SIZE = 512
+DDB_ENTRY_TTL = 6 * 60 * 60
+# Pages D&D Beyond doesn't have are remembered for less time
+MISSING_DDB_ENTRY_TTL = 60 * 60
+# Rough size of a cached embed, in bytes
+DDB_ENTRY_SIZE_ESTIMATE = 8 * 1024
 
+# Reloading utils modules (i.e. `!reload`) starts with a fresh cache
+DDB_ENTRIES = ExpiringCache(DDB_CACHE_SIZE, DDB_ENTRY_TTL)
 
-def get_ddb_page(url: str) -> BeautifulSoup:
-    """Get parsed HTML of a ddb webpage
+
+def get_statblock_field(name: str, item: str) -> Field:
+    """Get the field of a value in a spell's (or feat's) statblock
 
     Args:
-        url (`str`): URL of the page to parse
+        name (`str`): Name of the field, e.g. 'Casting Time'
+        item (`str`): Name of the statblock item, e.g. 'casting-time'
 
     Returns:
-        `BeautifulSoup`: Parsed HTML as BeautifulSoup object
+        `Field`: Field of the statblock item
+    """
+    return Field(name, f"div.ddb-statblock-item-{item}", ".ddb-statblock-item-value")
+
+
+SPELL_PAGE = PageSpec(
+    "spell",
+    "h1.page-title",
+    (
+        Field("Description", "div.more-info-content", extract=PARAGRAPHS),
+        get_statblock_field("Level", "level"),
+        get_statblock_field("Casting Time", "casting-time"),
+        get_statblock_field("Range", "range-area"),
+        get_statblock_field("Components", "components"),
+        get_statblock_field("Duration", "duration"),
+        get_statblock_field("School", "school"),
+        get_statblock_field("Attack/Save", "attack-save"),
+        get_statblock_field("Damage Type", "damage-effect"),
+    ),
+)
+MONSTER_PAGE = PageSpec(
+    "monster",
+    "a.mon-stat-block__name-link",
+    (
+        Field("Type", "div.mon-stat-block__meta", extract=TEXT),
+        LabeledFields("div.mon-stat-block__attribute", ".mon-stat-block__attribute-label", ".mon-stat-block__attribute-value"),
+        LabeledFields("div.ability-block__stat", ".ability-block__heading", ".ability-block__data", combine="Ability Scores"),
+        LabeledFields("div.mon-stat-block__tidbit", ".mon-stat-block__tidbit-label", ".mon-stat-block__tidbit-data"),
+        LabeledFields(
+            "div.mon-stat-block__description-block",
+            ".mon-stat-block__description-block-heading",
+            ".mon-stat-block__description-block-content",
+            extract=PARAGRAPHS,
+            default_label="Traits",
+        ),
+    ),
+)
+ITEM_PAGE = PageSpec(
+    "item",
+    "h1.page-title",
+    (
+        Field("Type", "div.item-info", ".details", extract=TEXT),
+        Field("Description", "div.more-info-content", extract=PARAGRAPHS),
+    ),
+)
+FEAT_PAGE = PageSpec(
+    "feat",
+    "h1.page-title",
+    (
+        Field("Prerequisite", "p.prerequisite", extract=TEXT),
+        Field("Description", "div.more-info-content", extract=PARAGRAPHS),
+    ),
+)
+# Page spec of each kind of page, by kind
+DDB_PAGES = {spec.kind: spec for spec in (SPELL_PAGE, MONSTER_PAGE, ITEM_PAGE, FEAT_PAGE)}
+
+
+def fetch_ddb_page(url: str) -> bytes:
+    """Download the HTML of a ddb webpage
+
+    Args:
+        url (`str`): URL of the page to download
+
+    Returns:
+        `bytes`: Raw HTML
     """
     req = Request(url, headers={"User-Agent": USER_AGENT})
-    # Open the url and parse the HTML
-    with urlopen(req) as spell_page:
-        # Parse the site's HTML using the Beautiful Soup web-scraping library
-        parsed_html = BeautifulSoup(spell_page, HTML_PARSER)
+    with urlopen(req) as page:
+        return page.read()
+
+
+def get_ddb_slug(name: str) -> str:
+    """Get the part of a page's URL naming it
+
+    Args:
+        name (`str`): Name of the spell, monster, etc.
+
+    Returns:
+        `str`: e.g. 'magic-missile'
+    """
+    return name.strip().lower().replace("'", "").replace(" ", "-")
+
+
+def get_ddb_url(kind: str, name: str) -> str:
+    """Get the D&D Beyond URL of a page
+
+    Args:
+        kind (`str`): Kind of page, e.g. 'spell'
+        name (`str`): Name of the spell, monster, etc.
+
+    Returns:
+        `str`: URL of the page
+    """
+    # Names may have characters which aren't allowed in URLs, e.g. accents or '/'
+    return DDB_URLS[kind].format(slug=quote(get_ddb_slug(name), safe=""))
+
+
+def scrape_ddb_page(html: bytes, url: str, kind: str) -> Optional[tuple[str, dict]]:
+    """Scrape a D&D Beyond page.
+    Parsing is CPU-heavy, so this is meant to run in the executor service and only returns plain (picklable) data
 
-    return parsed_html
+    Args:
+        html (`bytes`): Raw HTML of the page
+        url (`str`): URL of the page
+        kind (`str`): Kind of page, e.g. 'spell'
+
+    Returns:
+        `Optional[tuple[str, dict]]`: Title, info to be turned into an Embed. `None` if the page isn't of the given kind
+    """
+    if (scraped := extract_page(html, DDB_PAGES[kind])) is None:
+        return None
+    title, fields = scraped
+    # Link back to the page
+    fields["Source"] = url
+    return title, fields
+
+
+def get_ddb_key(kind: str, name: str) -> str:
+    """Get the key of a page in the cache
+
+    Args:
+        kind (`str`): Kind of page, e.g. 'spell'
+        name (`str`): Name of the spell, monster, etc.
+
+    Returns:
+        `str`: Cache key
+    """
+    return f"{kind}:{get_ddb_slug(name)}"
+
+
+async def get_ddb_entry(kind: str, name: str, executor: Optional[ExecutorService] = None) -> Optional[Embed]:
+    """Get a spell, monster, etc. from D&D Beyond, through the cache
+
+    Args:
+        kind (`str`): Kind of page, e.g. 'spell'
+        name (`str`): Name of the spell, monster, etc.
+        executor (`Optional[ExecutorService]`): Executor service to parse the page in. Defaults to `None` (a thread).
 
+    Returns:
+        `Optional[Embed]`: Discord embed of the page, `None` if D&D Beyond doesn't have it (or can't be reached)
+    """
+
+    async def scrape() -> Optional[Embed]:
+        url = get_ddb_url(kind, name)
+        try:
+            # Downloading is blocking I/O, keep it off the event loop
+            with span("fetch", url):
+                html = await asyncio.to_thread(fetch_ddb_page, url)
+        except HTTPError:
+            return None
+        with span("parse", kind):
+            scraped = await offload(executor, scrape_ddb_page, html, url, kind, kind="parse")
+        return None if scraped is None else dict_to_embed(*scraped)
+
+    try:
+        return await DDB_ENTRIES.get_or_load(get_ddb_key(kind, name), scrape, lambda embed: DDB_ENTRY_TTL if embed else MISSING_DDB_ENTRY_TTL)
+    except (URLError, UnicodeEncodeError) as error:
+        # D&D Beyond couldn't be reached, which doesn't mean it doesn't have the page, so the failure isn't cached
+        LOGGER.warning("Failed to fetch %s '%s' from D&D Beyond: %s", kind, name, error)
+        return None
+
+
+def is_ddb_entry_cached(kind: str, name: str) -> bool:
+    """Check if a D&D Beyond lookup is cached
+
+    Args:
+        kind (`str`): Kind of page, e.g. 'spell'
+        name (`str`): Name of the spell, monster, etc.
 
-def get_ddb_statblock_value(item_name: str, parsed_html: BeautifulSoup) -> str:
+    Returns:
+        `bool`: True if a fresh result (including "not found") is cached
     """
-    Extract all text from a ddb-statblock-item
+    return get_ddb_key(kind, name) in DDB_ENTRIES
+
+
+def shrink_ddb_entries(fraction: float) -> int:
+    """Shrink the D&D Beyond cache, e.g. under memory pressure
 
     Args:
-        item_name (`str`): Name of the statblock-item to scrape
-        parsed_html (`BeautifulSoup`): HTML of the site containing the statblocks
+        fraction (`float`): Fraction of the current size to shrink to
 
     Returns:
-        `str`: Scraped text from ddb
+        `int`: Estimated bytes freed
     """
-    # Identify the item containing the information we want
-    item = parsed_html.find("div", class_=f"ddb-statblock-item ddb-statblock-item-{item_name}")
+    return DDB_ENTRIES.shrink(fraction) * DDB_ENTRY_SIZE_ESTIMATE
+
 
-    # Get all text containied in the value section of the statblock
-    return item.find("div", class_="ddb-statblock-item-value").get_text(";", True).split(";")[0]
+def get_ddb_entries_size() -> int:
+    """Get the estimated size of the D&D Beyond cache
+
+    Returns:
+        `int`: Estimated bytes used by cached pages
+    """
+    return len(DDB_ENTRIES) * DDB_ENTRY_SIZE_ESTIMATE
@@ -0,0 +1,40 @@
+"""Dice Rolling Utils"""
+
+import random
+from typing import NamedTuple
+
+
+class RollResult(NamedTuple):
+    """Outcome of a roll"""
+
+    text: str  # Comma separated result of each die
+    total: int
+    highest: int  # Number of dice showing their highest face (e.g. nat 20s)
+    lowest: int  # Number of dice showing a 1
+
+
+def roll_dice(number_of_dice: int, number_of_sides: int) -> list[int]:
+    """Roll dice
+
+    Args:
+        number_of_dice (`int`): The number of dice to be rolled
+        number_of_sides (`int`): How many sides each rolled die should have
+
+    Returns:
+        `list[int]`: Result of each die
+    """
+    return random.choices(range(1, number_of_sides + 1), k=number_of_dice)
+
+
+def roll_and_summarize(number_of_dice: int, number_of_sides: int) -> RollResult:
+    """Roll dice, formatting the result of each die and summarizing them. Huge rolls are CPU-heavy, see `utils.executor`
+
+    Args:
+        number_of_dice (`int`): The number of dice to be rolled
+        number_of_sides (`int`): How many sides each rolled die should have
+
+    Returns:
+        `RollResult`: Formatted dice and their summary
+    """
+    dice = roll_dice(number_of_dice, number_of_sides)
+    return RollResult(", ".join(map(str, dice)), sum(dice), dice.count(number_of_sides), dice.count(1))
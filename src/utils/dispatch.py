@@ -0,0 +1,252 @@
+"""Outbound Message Dispatch Utils
+
+Every message VoloBot sends goes through a `Dispatcher`. Messages are queued per channel and released by token buckets
+matching Discord's rate limits, so bursts wait in our queue instead of running into 429s (and discord.py's retry stalling
+everything else sharing the bucket). Short text replies queued for the same channel can be merged into a single message.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from discord import Message
+from discord.abc import Messageable
+
+from utils.logging import get_logger
+from utils.metrics import MetricsRegistry
+from utils.tracing import span
+
+LOGGER = get_logger(os.path.basename(__file__))
+
+# Discord allows 5 messages per 5 seconds per channel, and 50 requests per second across the bot
+CHANNEL_BUCKET_CAPACITY = 5
+CHANNEL_BUCKET_PERIOD = 5.0
+GLOBAL_BUCKET_CAPACITY = 50
+GLOBAL_BUCKET_PERIOD = 1.0
+
+# Discord's limit on message length
+MAX_MESSAGE_LENGTH = 2000
+# Text replies at most this long may be merged with their neighbours
+COALESCE_MAX_LENGTH = 500
+COALESCE_SEPARATOR = "\n"
+# Seconds to hold a short reply waiting for others to merge with. Set to a negative value to disable merging
+COALESCE_WINDOW = float(os.getenv("DISPATCH_COALESCE_WINDOW", "0.1"))
+
+
+class TokenBucket:
+    """Token bucket rate limiter"""
+
+    def __init__(self: "TokenBucket", capacity: int, period: float) -> None:
+        """Init TokenBucket
+
+        Args:
+            capacity (`int`): Maximum number of tokens (burst size)
+            period (`float`): Seconds taken to refill an empty bucket
+        """
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def _refill(self: "TokenBucket") -> None:
+        """Add tokens accumulated since the last update"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self: "TokenBucket") -> None:
+        """Take a token, waiting for one to become available if the bucket is empty"""
+        self._refill()
+        while self.tokens < 1:
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+            self._refill()
+        self.tokens -= 1
+
+    def seconds_until_full(self: "TokenBucket") -> float:
+        """Get the time until the bucket is completely refilled
+
+        Returns:
+            `float`: Seconds until the bucket is full
+        """
+        self._refill()
+        return (self.capacity - self.tokens) / self.rate
+
+
+@dataclass
+class OutboundMessage:
+    """A message waiting to be sent"""
+
+    content: Optional[str]
+    kwargs: dict[str, Any]
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def coalescible(self: "OutboundMessage") -> bool:
+        """Whether this message is short plain text that can be merged with others"""
+        return not self.kwargs and self.content is not None and len(self.content) <= COALESCE_MAX_LENGTH
+
+
+class ChannelQueue:
+    """Queue of messages waiting to be sent to a single channel"""
+
+    def __init__(self: "ChannelQueue", channel: Messageable) -> None:
+        """Init ChannelQueue
+
+        Args:
+            channel (`Messageable`): Channel messages will be sent to
+        """
+        self.channel = channel
+        self.messages: deque[OutboundMessage] = deque()
+        self.bucket = TokenBucket(CHANNEL_BUCKET_CAPACITY, CHANNEL_BUCKET_PERIOD)
+        self.worker: Optional[asyncio.Task] = None
+
+
+class Dispatcher:
+    """Rate-limit aware outbound message scheduler"""
+
+    def __init__(self: "Dispatcher", metrics: MetricsRegistry, coalesce_window: float = COALESCE_WINDOW) -> None:
+        """Init Dispatcher
+
+        Args:
+            metrics (`MetricsRegistry`): Registry to report queue depth and wait times to
+            coalesce_window (`float`): Seconds to hold short replies for merging, negative to disable. Defaults to `COALESCE_WINDOW`.
+        """
+        self.metrics = metrics
+        self.coalesce_window = coalesce_window
+        self.global_bucket = TokenBucket(GLOBAL_BUCKET_CAPACITY, GLOBAL_BUCKET_PERIOD)
+        self.queues: dict[int, ChannelQueue] = {}
+        metrics.gauge("dispatch.queue_depth", self.queue_depth)
+        metrics.gauge("dispatch.active_channels", lambda: len(self.queues))
+
+    def queue_depth(self: "Dispatcher") -> int:
+        """Get the number of messages waiting to be sent
+
+        Returns:
+            `int`: Number of queued messages across all channels
+        """
+        return sum(len(queue.messages) for queue in self.queues.values())
+
+    async def send(self: "Dispatcher", channel: Messageable, content: Optional[str] = None, **kwargs: Any) -> Message:
+        """Queue a message and wait for it to be sent. Accepts the same arguments as `Messageable.send`
+
+        Args:
+            channel (`Messageable`): Channel to send the message to
+            content (`Optional[str]`): Text content of the message. Defaults to `None`.
+
+        Returns:
+            `Message`: The sent message. Merged replies all resolve to the same message
+        """
+        # Drop arguments left unset so that they don't prevent merging
+        kwargs = {key: value for key, value in kwargs.items() if value is not None}
+        outbound = OutboundMessage(None if content is None else str(content), kwargs, asyncio.get_running_loop().create_future())
+
+        queue = self.queues.get(channel.id)
+        if queue is None:
+            queue = self.queues[channel.id] = ChannelQueue(channel)
+        queue.messages.append(outbound)
+        if queue.worker is None:
+            queue.worker = asyncio.create_task(self._drain(channel.id, queue))
+
+        # Includes time spent queued behind rate limits
+        with span("send"):
+            return await outbound.future
+
+    def _take_batch(self: "Dispatcher", queue: ChannelQueue) -> list[OutboundMessage]:
+        """Pop the next message off a queue, along with any queued short replies it can be merged with
+
+        Args:
+            queue (`ChannelQueue`): Queue to take messages from
+
+        Returns:
+            `list[OutboundMessage]`: Messages to be sent together
+        """
+        batch = [queue.messages.popleft()]
+        if self.coalesce_window < 0 or not batch[0].coalescible:
+            return batch
+
+        length = len(batch[0].content)
+        while queue.messages and queue.messages[0].coalescible:
+            next_length = length + len(COALESCE_SEPARATOR) + len(queue.messages[0].content)
+            if next_length > MAX_MESSAGE_LENGTH:
+                break
+            batch.append(queue.messages.popleft())
+            length = next_length
+        return batch
+
+    async def _drain(self: "Dispatcher", channel_id: int, queue: ChannelQueue) -> None:
+        """Send queued messages for a channel until its queue is empty
+
+        Args:
+            channel_id (`int`): ID of the channel
+            queue (`ChannelQueue`): Queue of messages for the channel
+        """
+        try:
+            while queue.messages:
+                # Give other short replies a chance to arrive before sending
+                first = queue.messages[0]
+                if self.coalesce_window > 0 and first.coalescible:
+                    await asyncio.sleep(max(first.enqueued_at + self.coalesce_window - time.monotonic(), 0))
+
+                await queue.bucket.acquire()
+                await self.global_bucket.acquire()
+                batch = self._take_batch(queue)
+                await self._send_batch(queue.channel, batch)
+        finally:
+            queue.worker = None
+            # Forget the channel once its bucket has refilled, so memory scales with active channels only
+            asyncio.get_running_loop().call_later(queue.bucket.seconds_until_full(), self._forget_if_idle, channel_id, queue)
+
+    def _forget_if_idle(self: "Dispatcher", channel_id: int, queue: ChannelQueue) -> None:
+        """Drop a channel's queue if nothing has been queued since its worker finished
+
+        Args:
+            channel_id (`int`): ID of the channel
+            queue (`ChannelQueue`): Queue of messages for the channel
+        """
+        idle = queue.worker is None and not queue.messages and queue.bucket.seconds_until_full() == 0
+        if idle and self.queues.get(channel_id) is queue:
+            del self.queues[channel_id]
+
+    async def _send_batch(self: "Dispatcher", channel: Messageable, batch: list[OutboundMessage]) -> None:
+        """Send a batch of messages as a single message, resolving every message's future
+
+        Args:
+            channel (`Messageable`): Channel to send to
+            batch (`list[OutboundMessage]`): Messages to send
+        """
+        now = time.monotonic()
+        for outbound in batch:
+            self.metrics.observe("dispatch.wait_ms", (now - outbound.enqueued_at) * 1000)
+        if len(batch) > 1:
+            self.metrics.incr("dispatch.coalesced", len(batch) - 1)
+
+        if len(batch) == 1:
+            content, kwargs = batch[0].content, batch[0].kwargs
+        else:
+            content, kwargs = COALESCE_SEPARATOR.join(outbound.content for outbound in batch), {}
+
+        try:
+            message = await channel.send(content, **kwargs)
+        except Exception as error:
+            self.metrics.incr("dispatch.errors")
+            for outbound in batch:
+                if not outbound.future.done():
+                    outbound.future.set_exception(error)
+        else:
+            self.metrics.incr("dispatch.sent")
+            for outbound in batch:
+                if not outbound.future.done():
+                    outbound.future.set_result(message)
+
+    async def close(self: "Dispatcher") -> None:
+        """Stop every channel worker, cancelling messages that haven't been sent"""
+        for queue in list(self.queues.values()):
+            if queue.worker is not None:
+                queue.worker.cancel()
+            for outbound in queue.messages:
+                outbound.future.cancel()
+        self.queues.clear()
@@ -2,6 +2,12 @@
 
 from discord import Embed
 
+from utils.tracing import span
+
+# A message may have at most 10 embeds, with at most 6000 characters between them
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBED_CHARACTERS_PER_MESSAGE = 6000
+
 
 def dict_to_embed(title: str, content: dict) -> Embed:
     """Convert a dict object to a Discord Embed object
@@ -13,26 +19,53 @@ def dict_to_embed(title: str, content: dict) -> Embed:
     Returns:
         `Embed`: Discord Embed object
     """
-    embed = Embed(title=title)
-    for key, value in content.items():
-        if key == "Description":
-            embed.description = value
-        elif key == "Content" and isinstance(value, list):
-            formatted_values = ""
-            for line in value:
-                formatted_values += f"{line}\n\n"
-            embed.description = formatted_values
-        else:
-            if isinstance(value, dict):
+    with span("render", title):
+        embed = Embed(title=title)
+        for key, value in content.items():
+            if key == "Description":
+                embed.description = value
+            elif key == "Content" and isinstance(value, list):
                 formatted_values = ""
-                for k, v in value.items():
-                    formatted_values += f"{k}: {v}\n\n"
+                for line in value:
+                    formatted_values += f"{line}\n\n"
+                embed.description = formatted_values
             else:
-                formatted_values = value
-            embed.add_field(name=key, value=formatted_values, inline=False)
+                if isinstance(value, dict):
+                    formatted_values = ""
+                    for k, v in value.items():
+                        formatted_values += f"{k}: {v}\n\n"
+                else:
+                    formatted_values = value
+                embed.add_field(name=key, value=formatted_values, inline=False)
     return embed
 
 
+def paginate_embeds(embeds: list[Embed]) -> list[list[Embed]]:
+    """Split embeds into pages which each fit in a single message, numbering the pages if there are several
+
+    Args:
+        embeds (`list[Embed]`): Embeds to send, in order
+
+    Returns:
+        `list[list[Embed]]`: Embeds of each message
+    """
+    # Leave room for the page numbers
+    max_characters = MAX_EMBED_CHARACTERS_PER_MESSAGE - 20
+    pages: list[list[Embed]] = []
+    characters = 0
+    for embed in embeds:
+        if not pages or len(pages[-1]) >= MAX_EMBEDS_PER_MESSAGE or characters + len(embed) > max_characters:
+            pages.append([])
+            characters = 0
+        pages[-1].append(embed)
+        characters += len(embed)
+    if len(pages) > 1:
+        for number, page in enumerate(pages, 1):
+            # Embeds may be shared (e.g. cached spell embeds), only number a copy
+            page[-1] = page[-1].copy().set_footer(text=f"Page {number}/{len(pages)}")
+    return pages
+
+
 def create_error_embed(error: Exception) -> Embed:
     """Create a Discord Embed describing a Python Exception
 
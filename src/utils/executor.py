@@ -0,0 +1,159 @@
+"""Executor Utils
+
+A shared pool of worker processes for CPU-heavy work (HTML parsing, huge dice rolls), so it doesn't hold the event loop.
+Falls back to a thread pool where worker processes can't be started, or if the process pool breaks.
+
+Functions run in worker processes must be defined at module level, and their arguments and results must be picklable.
+Worker processes import their own copy of our modules, so they don't see changes loaded with `!reload`.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from utils.logging import get_logger
+from utils.metrics import MetricsRegistry
+
+LOGGER = get_logger(os.path.basename(__file__))
+
+# Number of worker processes (or threads, when falling back)
+EXECUTOR_WORKERS = int(os.getenv("EXECUTOR_WORKERS", str(min(2, os.cpu_count() or 1))))
+# 'process' to use worker processes, 'thread' to only use threads
+EXECUTOR_MODE = os.getenv("EXECUTOR_MODE", "process").lower()
+
+
+def warm_worker() -> None:
+    """Worker initializer. Import (and exercise) the parser up front, so the first real task doesn't pay for it"""
+    from bs4 import BeautifulSoup
+
+    import utils.ddb  # noqa: F401  Imported for its side effect of loading the scraping utils
+
+    BeautifulSoup("<html><body><h1>warm</h1></body></html>", "html.parser")
+
+
+def call_timed(function: Callable, args: tuple) -> tuple[Any, float]:
+    """Call a function, timing it. Runs in the worker
+
+    Args:
+        function (`Callable`): Function to call
+        args (`tuple`): Positional arguments to pass
+
+    Returns:
+        `tuple[Any, float]`: Result of the function, seconds it ran for
+    """
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+class ExecutorService:
+    """Bounded pool running CPU-heavy work off the event loop"""
+
+    def __init__(self: "ExecutorService", metrics: MetricsRegistry, workers: int = EXECUTOR_WORKERS, mode: str = EXECUTOR_MODE) -> None:
+        """Init ExecutorService
+
+        Args:
+            metrics (`MetricsRegistry`): Registry to report queue depth and task timings to
+            workers (`int`): Number of worker processes (or threads). Defaults to `EXECUTOR_WORKERS`.
+            mode (`str`): 'process' to use worker processes, 'thread' to only use threads. Defaults to `EXECUTOR_MODE`.
+        """
+        self.metrics = metrics
+        self.workers = max(workers, 1)
+        self.mode = mode
+        self.executor: Optional[Executor] = None
+        self.backend: Optional[str] = None
+        # Tasks submitted which haven't finished yet
+        self.pending = 0
+        self.warmup_task: Optional[asyncio.Task] = None
+        metrics.gauge("executor.pending", lambda: self.pending)
+
+    def start(self: "ExecutorService") -> None:
+        """Start the pool, and warm up its workers in the background. Must be called from the event loop"""
+        if self.mode == "process":
+            try:
+                # Spawn fresh interpreters rather than forking the bot, with its event loop and helper threads
+                self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=warm_worker)
+                self.backend = "process"
+            except (OSError, NotImplementedError) as error:
+                LOGGER.warning("Worker processes unavailable (%s), using threads instead", error)
+        if self.executor is None:
+            self._use_threads()
+        self.warmup_task = asyncio.create_task(self._warm_up())
+
+    def _use_threads(self: "ExecutorService") -> None:
+        """Switch to a thread pool"""
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix="volobot-worker", initializer=warm_worker)
+        self.backend = "thread"
+
+    async def _warm_up(self: "ExecutorService") -> None:
+        """Start every worker, so the first tasks don't wait for workers to start"""
+        started = time.perf_counter()
+        try:
+            # Workers are started on demand, so keep them all busy at once
+            await asyncio.gather(*(self.run(time.sleep, 0.05, kind="warmup") for _ in range(self.workers)))
+        except Exception as error:
+            LOGGER.warning("Failed to warm up %s workers: %s", self.backend, error)
+        else:
+            LOGGER.info("Started %d %s workers in %.0f ms", self.workers, self.backend, (time.perf_counter() - started) * 1000)
+
+    async def run(self: "ExecutorService", function: Callable, *args: Any, kind: str = "task") -> Any:
+        """Run a function in the pool
+
+        Args:
+            function (`Callable`): Module level function to run
+            *args (`Any`): Picklable positional arguments to pass
+            kind (`str`): Kind of task (e.g. 'parse'), to report timings by. Defaults to 'task'.
+
+        Returns:
+            `Any`: Result of the function
+        """
+        loop = asyncio.get_running_loop()
+        submitted = time.perf_counter()
+        self.pending += 1
+        try:
+            try:
+                result, run_seconds = await loop.run_in_executor(self.executor, call_timed, function, args)
+            except BrokenProcessPool:
+                # A worker died (e.g. was OOM killed). Carry on with threads rather than failing every task from now on
+                if self.backend == "process":
+                    LOGGER.warning("Worker process pool broke, using threads instead")
+                    self.executor.shutdown(wait=False, cancel_futures=True)
+                    self._use_threads()
+                    self.metrics.incr("executor.broken")
+                result, run_seconds = await loop.run_in_executor(self.executor, call_timed, function, args)
+        finally:
+            self.pending -= 1
+
+        total_seconds = time.perf_counter() - submitted
+        self.metrics.incr(f"executor.tasks.{kind}")
+        self.metrics.observe(f"executor.run_ms.{kind}", run_seconds * 1000)
+        self.metrics.observe("executor.queue_ms", max(total_seconds - run_seconds, 0) * 1000)
+        return result
+
+    async def close(self: "ExecutorService") -> None:
+        """Shut the pool down, cancelling tasks which haven't started and waiting for running ones"""
+        if self.warmup_task is not None:
+            self.warmup_task.cancel()
+        if self.executor is not None:
+            await asyncio.to_thread(self.executor.shutdown, True, cancel_futures=True)
+
+
+async def offload(executor: Optional[ExecutorService], function: Callable, *args: Any, kind: str = "task") -> Any:
+    """Run a function in the executor service, or in a thread if there is no executor service (e.g. outside the bot)
+
+    Args:
+        executor (`Optional[ExecutorService]`): Executor service to run the function in
+        function (`Callable`): Module level function to run
+        *args (`Any`): Picklable positional arguments to pass
+        kind (`str`): Kind of task (e.g. 'parse'), to report timings by. Defaults to 'task'.
+
+    Returns:
+        `Any`: Result of the function
+    """
+    if executor is None:
+        return await asyncio.to_thread(function, *args)
+    return await executor.run(function, *args, kind=kind)
@@ -0,0 +1,228 @@
+"""Fuzzy Name Matching Utils
+
+"Did you mean" suggestions for names that weren't found. Each dataset's names are indexed the first time a lookup misses,
+and the index is cached alongside the dataset (see `utils.datasets.load_derived`), so a miss only compares the query
+against a handful of similar names instead of scanning all of them.
+"""
+
+from collections import defaultdict
+from typing import Any, Callable, Iterable, Optional
+
+from utils.datasets import Loader, get_layer_paths, load_derived
+from utils.json_utils import read_json_async
+
+# Maximum number of suggestions to make
+MAX_SUGGESTIONS = 3
+# Names this far (in edits) from the query per character of the query may be suggested
+MAX_DISTANCE_RATIO = 1 / 3
+# Names are never suggested if they are further than this from the query. Index size grows quickly with this
+MAX_EDIT_DISTANCE = 2
+# Name of the derived index in the dataset cache
+NAME_INDEX = "name_index"
+
+
+def get_edit_distance(first: str, second: str) -> int:
+    """Get the Levenshtein distance between two strings, i.e. the number of single character insertions, deletions or
+    substitutions needed to change one into the other
+
+    Args:
+        first (`str`): First string
+        second (`str`): Second string
+
+    Returns:
+        `int`: Edit distance
+    """
+    if len(first) < len(second):
+        first, second = second, first
+    previous = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, 1):
+        current = [i]
+        for j, second_char in enumerate(second, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (first_char != second_char)))
+        previous = current
+    return previous[-1]
+
+
+def get_deletions(word: str, max_distance: int) -> set[str]:
+    """Get every string made by deleting up to a number of characters from a word, including the word itself
+
+    Args:
+        word (`str`): Word to delete characters from
+        max_distance (`int`): Maximum number of characters to delete
+
+    Returns:
+        `set[str]`: Deletions of the word
+    """
+    deletions = {word}
+    edge = {word}
+    for _ in range(max_distance):
+        edge = {variant[:i] + variant[i + 1 :] for variant in edge for i in range(len(variant))} - deletions
+        deletions |= edge
+    return deletions
+
+
+class NameIndex:
+    """Symmetric deletion index of names (as in SymSpell), for finding the names within an edit distance of a query.
+    Matching ignores case.
+
+    Every deletion of up to `max_distance` characters from each name is precomputed. Two strings within that edit
+    distance always share a deletion, so a search only needs to look up the query's own deletions and check the
+    (few) names they lead to.
+    """
+
+    def __init__(self: "NameIndex", names: Iterable[str] = (), max_distance: int = MAX_EDIT_DISTANCE) -> None:
+        """Init NameIndex
+
+        Args:
+            names (`Iterable[str]`): Names to index. Defaults to none.
+            max_distance (`int`): Maximum edit distance searches may use. Defaults to `MAX_EDIT_DISTANCE`.
+        """
+        self.max_distance = max_distance
+        # Names by their lowercase form
+        self.names: dict[str, str] = {}
+        # Lowercase names by each of their deletions
+        self.deletions: defaultdict[str, list[str]] = defaultdict(list)
+        # Length of the longest name, queries much longer than it can't match anything
+        self.longest = 0
+        for name in names:
+            self.add(name)
+
+    def add(self: "NameIndex", name: str) -> None:
+        """Add a name to the index
+
+        Args:
+            name (`str`): Name to add
+        """
+        key = name.lower()
+        if key in self.names:
+            return
+        self.names[key] = name
+        self.longest = max(self.longest, len(key))
+        for deletion in get_deletions(key, self.max_distance):
+            self.deletions[deletion].append(key)
+
+    def remove(self: "NameIndex", name: str) -> None:
+        """Remove a name from the index
+
+        Args:
+            name (`str`): Name to remove
+        """
+        key = name.lower()
+        if self.names.pop(key, None) is None:
+            return
+        for deletion in get_deletions(key, self.max_distance):
+            keys = self.deletions[deletion]
+            keys.remove(key)
+            if not keys:
+                del self.deletions[deletion]
+        if len(key) == self.longest:
+            self.longest = max(map(len, self.names), default=0)
+
+    def apply_change(self: "NameIndex", key: str, _old: Any, new: Any) -> None:
+        """Update the index after an entry of the indexed dataset changed (see `utils.datasets.apply_dataset_change`)
+
+        Args:
+            key (`str`): Name of the entry
+            _old (`Any`): Previous value of the entry, `None` if it was added
+            new (`Any`): New value of the entry, `None` if it was deleted
+        """
+        if new is None:
+            self.remove(key)
+        else:
+            self.add(key)
+
+    def search(self: "NameIndex", query: str, max_distance: int) -> list[tuple[int, str]]:
+        """Find names within an edit distance of a query
+
+        Args:
+            query (`str`): Name to search for
+            max_distance (`int`): Maximum edit distance of matches, at most the index's `max_distance`
+
+        Returns:
+            `list[tuple[int, str]]`: Distance and name of each match, closest first
+        """
+        max_distance = min(max_distance, self.max_distance)
+        # Deletions of a query grow with the square of its length, don't make them for queries too long to match
+        if len(query) > self.longest + max_distance:
+            return []
+        query = query.lower()
+        candidates = {key for deletion in get_deletions(query, max_distance) for key in self.deletions.get(deletion, ())}
+        matches = []
+        for key in candidates:
+            # Names sharing a deletion with the query may still be further away than that
+            if abs(len(key) - len(query)) <= max_distance and (distance := get_edit_distance(query, key)) <= max_distance:
+                matches.append((distance, self.names[key]))
+        return sorted(matches)
+
+
+def build_name_index(names: Iterable[str]) -> NameIndex:
+    """Build a name index
+
+    Args:
+        names (`Iterable[str]`): Names to index
+
+    Returns:
+        `NameIndex`: Index of the names
+    """
+    return NameIndex(names)
+
+
+async def load_name_indexes(
+    path: str,
+    guild_id: Optional[int] = None,
+    loader: Loader = read_json_async,
+    get_names: Callable[[Any], Iterable[str]] = list,
+    override: bool = False,
+) -> list[NameIndex]:
+    """Load the name indexes of a data file and the guild's copy of it, building them if they haven't been yet
+
+    Args:
+        path (`str`): Path to the global data file
+        guild_id (`Optional[int]`): ID of the guild, `None` outside of guilds. Defaults to `None`.
+        loader (`Loader`): Coroutine function used to load the file. Defaults to `read_json_async`.
+        get_names (`Callable[[Any], Iterable[str]]`): Function getting the names from the file's content. Defaults to the keys of a dict.
+        override (`bool`): Whether the guild's copy replaces the global file (see `load_override_dataset`), rather than being layered over it.
+            Defaults to `False`.
+
+    Returns:
+        `list[NameIndex]`: Name index of each existing layer, guild first
+    """
+    indexes = []
+    for layer_path in get_layer_paths(path, guild_id):
+        index = await load_derived(layer_path, NAME_INDEX, lambda data: build_name_index(get_names(data)), loader)
+        if index is not None:
+            indexes.append(index)
+            if override:
+                break
+    return indexes
+
+
+def get_suggestions(query: str, indexes: Iterable[NameIndex], limit: int = MAX_SUGGESTIONS) -> list[str]:
+    """Get the names closest to a query
+
+    Args:
+        query (`str`): Name that wasn't found
+        indexes (`Iterable[NameIndex]`): Name indexes to search
+        limit (`int`): Maximum number of suggestions. Defaults to `MAX_SUGGESTIONS`.
+
+    Returns:
+        `list[str]`: Closest names, closest first
+    """
+    max_distance = max(1, int(len(query) * MAX_DISTANCE_RATIO))
+    matches = sorted(match for index in indexes for match in index.search(query, max_distance))
+    # The same name may be in several layers
+    return list(dict.fromkeys(name for _, name in matches))[:limit]
+
+
+def format_suggestions(suggestions: list[str]) -> str:
+    """Format suggestions to be appended to an error message
+
+    Args:
+        suggestions (`list[str]`): Suggested names
+
+    Returns:
+        `str`: e.g. "\\nDid you mean: `Fireball`, `Fire Bolt`?", or an empty string if there are no suggestions
+    """
+    if not suggestions:
+        return ""
+    return f"\nDid you mean: {', '.join(f'`{name}`' for name in suggestions)}?"
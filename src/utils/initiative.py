@@ -0,0 +1,419 @@
+"""Initiative Tracker Utils
+
+Each channel can run one encounter: combatants in initiative order, whose turn it is, and the round. The turn order is
+kept as a sorted list of keys, so finding a combatant's place, the next turn or a removed combatant is a binary search.
+Encounters are capped at `MAX_COMBATANTS`, so shifting the list on insertion and removal stays a small memmove.
+
+Encounters are shown in a single tracker message per channel, which is edited as the encounter changes. The tracker is an
+embed, whose description fits a full encounter (about 3000 characters) where message content wouldn't. Edits are
+debounced, so a burst of changes (e.g. rolling initiative for a pack of goblins) becomes a single API call.
+
+Encounters are snapshotted to disk as plain data, so they survive the cog being reloaded (i.e. `!reload`) or the bot
+restarting.
+"""
+
+import asyncio
+import os
+import random
+import re
+import time
+from bisect import bisect_left, bisect_right, insort
+from dataclasses import asdict, dataclass
+from typing import Awaitable, Callable, Iterator, Optional
+
+from discord import Embed
+
+from constants.paths import INITIATIVE_PATH
+from utils.json_utils import read_json_async, write_json_async
+from utils.logging import get_logger
+
+LOGGER = get_logger(os.path.basename(__file__))
+
+# Most combatants in a single encounter
+MAX_COMBATANTS = 50
+# Longest combatant name
+MAX_NAME_LENGTH = 50
+# Seconds to wait for further changes before editing the tracker message
+TRACKER_EDIT_DELAY = 1.0
+# Seconds between snapshots of the encounters to disk
+SNAPSHOT_INTERVAL = 60
+# Encounters untouched for this long are forgotten
+ENCOUNTER_EXPIRY = 12 * 60 * 60
+# Initiative to roll (d20 plus a modifier), always signed, e.g. '+3' or '-1'
+MODIFIER = re.compile(r"[+-]\d{1,2}")
+# Initiative to use as is, e.g. '15'. Negative initiatives would read as modifiers, they're prefixed with '=', e.g. '=-1'
+FIXED_INITIATIVE = re.compile(r"\d{1,3}|=-?\d{1,3}")
+
+
+class InvalidCombatantError(ValueError):
+    """A combatant can't be added to or found in an encounter"""
+
+
+@dataclass(slots=True)
+class Combatant:
+    """A creature in an encounter"""
+
+    name: str
+    initiative: int
+    order: int  # When the combatant was added, earlier combatants go first on ties
+
+    @property
+    def key(self: "Combatant") -> tuple[int, int]:
+        """Position of the combatant in the turn order, highest initiative first"""
+        return (-self.initiative, self.order)
+
+
+class Encounter:
+    """Combatants of a channel's encounter, in initiative order"""
+
+    def __init__(self: "Encounter") -> None:
+        """Init Encounter"""
+        # Sorted keys of the combatants (see `Combatant.key`)
+        self.keys: list[tuple[int, int]] = []
+        self.combatants: dict[tuple[int, int], Combatant] = {}
+        # Keys of the combatants by lowercase name
+        self.names: dict[str, tuple[int, int]] = {}
+        # Key of the combatant whose turn it is, `None` until the first turn
+        self.current: Optional[tuple[int, int]] = None
+        self.round = 0
+        self.next_order = 0
+        # ID of the tracker message, `None` until it has been sent
+        self.message_id: Optional[int] = None
+        # Held while the tracker is being sent or edited, so concurrent publishes don't both send a new tracker
+        self.publishing = asyncio.Lock()
+        self.updated_at = time.time()
+
+    def __len__(self: "Encounter") -> int:
+        """Get the number of combatants
+
+        Returns:
+            `int`: Number of combatants
+        """
+        return len(self.keys)
+
+    def __iter__(self: "Encounter") -> Iterator[Combatant]:
+        """Iterate over the combatants in turn order
+
+        Returns:
+            `Iterator[Combatant]`: Combatants, highest initiative first
+        """
+        return (self.combatants[key] for key in self.keys)
+
+    def add(self: "Encounter", name: str, initiative: int) -> Combatant:
+        """Add a combatant. Combatants added mid-round get their turn when the order reaches them
+
+        Args:
+            name (`str`): Name of the combatant
+            initiative (`int`): Initiative of the combatant
+
+        Raises:
+            `InvalidCombatantError`: The name is taken or invalid, or the encounter is full
+
+        Returns:
+            `Combatant`: The added combatant
+        """
+        name = " ".join(name.split())
+        if not name or len(name) > MAX_NAME_LENGTH:
+            raise InvalidCombatantError(f"Combatant names must be 1 to {MAX_NAME_LENGTH} characters long")
+        if name.lower() in self.names:
+            raise InvalidCombatantError(f"'{name}' is already in the encounter")
+        if len(self.keys) >= MAX_COMBATANTS:
+            raise InvalidCombatantError(f"Encounters can have at most {MAX_COMBATANTS} combatants")
+        combatant = Combatant(name, initiative, self.next_order)
+        self.next_order += 1
+        self._insert(combatant)
+        return combatant
+
+    def _insert(self: "Encounter", combatant: Combatant) -> None:
+        """Insert a combatant into the turn order
+
+        Args:
+            combatant (`Combatant`): Combatant to insert
+        """
+        insort(self.keys, combatant.key)
+        self.combatants[combatant.key] = combatant
+        self.names[combatant.name.lower()] = combatant.key
+        self.updated_at = time.time()
+
+    def remove(self: "Encounter", name: str) -> Combatant:
+        """Remove a combatant. If it was their turn, the turn passes to the next combatant
+
+        Args:
+            name (`str`): Name of the combatant, case is ignored
+
+        Raises:
+            `InvalidCombatantError`: There is no combatant with that name
+
+        Returns:
+            `Combatant`: The removed combatant
+        """
+        if (key := self.names.pop(" ".join(name.split()).lower(), None)) is None:
+            raise InvalidCombatantError(f"There's no '{name}' in the encounter")
+        del self.keys[bisect_left(self.keys, key)]
+        combatant = self.combatants.pop(key)
+        if self.current == key:
+            # The combatant's turn is over, the next combatant is up (in the same round, unless they were last)
+            self.current = self._next_key(key)
+        self.updated_at = time.time()
+        return combatant
+
+    def _next_key(self: "Encounter", key: tuple[int, int]) -> Optional[tuple[int, int]]:
+        """Get the key of the combatant after a position in the turn order, wrapping around to the next round
+
+        Args:
+            key (`tuple[int, int]`): Position in the turn order
+
+        Returns:
+            `Optional[tuple[int, int]]`: Key of the next combatant, `None` if there are no combatants
+        """
+        if not self.keys:
+            return None
+        index = bisect_right(self.keys, key)
+        if index == len(self.keys):
+            self.round += 1
+            index = 0
+        return self.keys[index]
+
+    def next_turn(self: "Encounter") -> Optional[Combatant]:
+        """Pass the turn to the next combatant, starting the first round if the encounter hasn't started
+
+        Returns:
+            `Optional[Combatant]`: Combatant whose turn it is, `None` if there are no combatants
+        """
+        if self.current is None:
+            if not self.keys:
+                return None
+            self.round = max(self.round, 1)
+            self.current = self.keys[0]
+        else:
+            self.current = self._next_key(self.current)
+        self.updated_at = time.time()
+        return None if self.current is None else self.combatants[self.current]
+
+    def to_dict(self: "Encounter") -> dict:
+        """Convert the encounter to plain data, for snapshots
+
+        Returns:
+            `dict`: Combatants, turn, round and tracker message
+        """
+        return {
+            "combatants": [asdict(combatant) for combatant in self],
+            "current": None if self.current is None else self.combatants[self.current].name,
+            "round": self.round,
+            "next_order": self.next_order,
+            "message_id": self.message_id,
+            "updated_at": self.updated_at,
+        }
+
+    @classmethod
+    def from_dict(cls: type["Encounter"], serialized: dict) -> "Encounter":
+        """Restore an encounter from a snapshot
+
+        Args:
+            serialized (`dict`): Encounter, as returned by `to_dict`
+
+        Returns:
+            `Encounter`: The restored encounter
+        """
+        encounter = cls()
+        for combatant in serialized["combatants"]:
+            encounter._insert(Combatant(**combatant))
+        if serialized["current"] is not None:
+            encounter.current = encounter.names.get(serialized["current"].lower())
+        encounter.round = serialized["round"]
+        encounter.next_order = serialized["next_order"]
+        encounter.message_id = serialized["message_id"]
+        encounter.updated_at = serialized["updated_at"]
+        return encounter
+
+
+def parse_initiative(initiative: str) -> tuple[int, Optional[int]]:
+    """Parse a combatant's initiative: a number (e.g. '15', or '=-1' if negative), or a modifier to roll a d20 with (e.g. '+3')
+
+    Args:
+        initiative (`str`): Initiative to parse
+
+    Raises:
+        `InvalidCombatantError`: The initiative isn't a number or a modifier
+
+    Returns:
+        `tuple[int, Optional[int]]`: Initiative, d20 rolled for it (`None` if the initiative was given)
+    """
+    initiative = initiative.strip()
+    if MODIFIER.fullmatch(initiative):
+        roll = random.randint(1, 20)
+        return roll + int(initiative), roll
+    if FIXED_INITIATIVE.fullmatch(initiative):
+        return int(initiative.removeprefix("=")), None
+    raise InvalidCombatantError(
+        f"Invalid initiative '{initiative}', expected a number (e.g. '15', or '=-1' if negative) or a modifier to roll with (e.g. '+3' or '-1')"
+    )
+
+
+def format_tracker(encounter: Encounter) -> Embed:
+    """Format an encounter as the tracker embed
+
+    Args:
+        encounter (`Encounter`): Encounter to format
+
+    Returns:
+        `Embed`: Round as the title, then a line per combatant in turn order, pointing out whose turn it is
+    """
+    title = f"Initiative: Round {encounter.round}" if encounter.round else "Initiative: Not started (!init next to start)"
+    if not len(encounter):
+        return Embed(title=title, description="*No combatants yet, add some with `!init add <name> <initiative>`*")
+    width = max(len(str(combatant.initiative)) for combatant in encounter)
+    lines = []
+    for combatant in encounter:
+        if combatant.key == encounter.current:
+            lines.append(f"▶ `{combatant.initiative:>{width}}` **{combatant.name}**")
+        else:
+            lines.append(f"▫ `{combatant.initiative:>{width}}` {combatant.name}")
+    return Embed(title=title, description="\n".join(lines))
+
+
+class InitiativeTracker:
+    """Encounters of every channel, and the debounced edits of their tracker messages"""
+
+    def __init__(
+        self: "InitiativeTracker",
+        publish: Callable[[int, Encounter], Awaitable[None]],
+        path: Optional[str] = INITIATIVE_PATH,
+        edit_delay: float = TRACKER_EDIT_DELAY,
+        interval: float = SNAPSHOT_INTERVAL,
+    ) -> None:
+        """Init InitiativeTracker
+
+        Args:
+            publish (`Callable[[int, Encounter], Awaitable[None]]`): Coroutine function sending or editing a channel's tracker message
+            path (`Optional[str]`): File encounters are snapshotted to. `None` keeps them in memory only. Defaults to `INITIATIVE_PATH`.
+            edit_delay (`float`): Seconds to wait for further changes before publishing. Defaults to `TRACKER_EDIT_DELAY`.
+            interval (`float`): Seconds between snapshots. Defaults to `SNAPSHOT_INTERVAL`.
+        """
+        self.publish = publish
+        self.path = path
+        self.edit_delay = edit_delay
+        self.interval = interval
+        self.encounters: dict[int, Encounter] = {}
+        # Pending tracker edits, by channel ID
+        self.pending: dict[int, asyncio.Task] = {}
+        self.dirty = False
+        self.task: Optional[asyncio.Task] = None
+
+    def get(self: "InitiativeTracker", channel_id: int, create: bool = False) -> Optional[Encounter]:
+        """Get a channel's encounter
+
+        Args:
+            channel_id (`int`): ID of the channel
+            create (`bool`): Whether to start an encounter if the channel doesn't have one. Defaults to `False`.
+
+        Returns:
+            `Optional[Encounter]`: The channel's encounter, `None` if it doesn't have one (and `create` is False)
+        """
+        if (encounter := self.encounters.get(channel_id)) is None and create:
+            encounter = self.encounters[channel_id] = Encounter()
+        return encounter
+
+    def end(self: "InitiativeTracker", channel_id: int) -> Optional[Encounter]:
+        """End a channel's encounter, dropping any pending edit of its tracker
+
+        Args:
+            channel_id (`int`): ID of the channel
+
+        Returns:
+            `Optional[Encounter]`: The ended encounter, `None` if the channel didn't have one
+        """
+        if (edit := self.pending.pop(channel_id, None)) is not None:
+            edit.cancel()
+        self.dirty = True
+        return self.encounters.pop(channel_id, None)
+
+    def changed(self: "InitiativeTracker", channel_id: int) -> None:
+        """Schedule an edit of a channel's tracker message. Changes made before the edit goes out are included in it
+
+        Args:
+            channel_id (`int`): ID of the channel whose encounter changed
+        """
+        self.dirty = True
+        if channel_id not in self.pending:
+            self.pending[channel_id] = asyncio.create_task(self._publish_later(channel_id))
+
+    async def _publish_later(self: "InitiativeTracker", channel_id: int) -> None:
+        """Publish a channel's tracker once changes have settled
+
+        Args:
+            channel_id (`int`): ID of the channel
+        """
+        await asyncio.sleep(self.edit_delay)
+        # Changes made from here on schedule a new edit
+        del self.pending[channel_id]
+        if (encounter := self.encounters.get(channel_id)) is None:
+            return
+        try:
+            await self.publish(channel_id, encounter)
+        except Exception as error:
+            LOGGER.warning("Failed to update the initiative tracker in channel %s: %s", channel_id, error)
+
+    async def publish_now(self: "InitiativeTracker", channel_id: int) -> None:
+        """Publish a channel's tracker straight away, rather than waiting for changes to settle
+
+        Args:
+            channel_id (`int`): ID of the channel
+        """
+        if (edit := self.pending.pop(channel_id, None)) is not None:
+            edit.cancel()
+        if (encounter := self.encounters.get(channel_id)) is not None:
+            await self.publish(channel_id, encounter)
+
+    async def flush(self: "InitiativeTracker") -> None:
+        """Publish pending tracker edits straight away, e.g. before the cog is unloaded"""
+        for channel_id in list(self.pending):
+            try:
+                await self.publish_now(channel_id)
+            except Exception as error:
+                LOGGER.warning("Failed to update the initiative tracker in channel %s: %s", channel_id, error)
+
+    def expire(self: "InitiativeTracker") -> None:
+        """Forget encounters untouched for `ENCOUNTER_EXPIRY`"""
+        cutoff = time.time() - ENCOUNTER_EXPIRY
+        for channel_id in [channel_id for channel_id, encounter in self.encounters.items() if encounter.updated_at < cutoff]:
+            self.end(channel_id)
+
+    async def load(self: "InitiativeTracker") -> None:
+        """Load the last snapshot, if there is one"""
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            saved = await read_json_async(self.path)
+            encounters = {int(channel_id): Encounter.from_dict(encounter) for channel_id, encounter in saved.items()}
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            LOGGER.warning("Ignoring unreadable encounters in '%s': %s", self.path, error)
+            return
+        self.encounters.update(encounters)
+        self.expire()
+
+    async def save(self: "InitiativeTracker") -> None:
+        """Snapshot every encounter to disk, if they have changed"""
+        if self.path is None or not self.dirty:
+            return
+        self.dirty = False
+        await write_json_async(self.path, {channel_id: encounter.to_dict() for channel_id, encounter in self.encounters.items()}, compact=True)
+
+    def start(self: "InitiativeTracker") -> None:
+        """Start snapshotting periodically"""
+        self.task = asyncio.create_task(self._run())
+
+    def stop(self: "InitiativeTracker") -> None:
+        """Stop snapshotting periodically. Call `flush` and `save` afterwards to publish and save the latest changes"""
+        if self.task is not None:
+            self.task.cancel()
+
+    async def _run(self: "InitiativeTracker") -> None:
+        """Snapshot until stopped"""
+        while True:
+            await asyncio.sleep(self.interval)
+            self.expire()
+            try:
+                await self.save()
+            except OSError as error:
+                LOGGER.warning("Failed to save encounters to '%s': %s", self.path, error)
@@ -1,15 +1,202 @@
-"""Inventory Management Utils"""
+"""Inventory Management Utils
 
+Each guild has its own inventory. Inventories used outside of a guild (e.g. in DMs) are stored in the global inventory file.
+
+Changes are appended to the inventory's ledger (see `utils.ledger`) and applied in place to the cached inventory, rather
+than rewriting the inventory file. Inventories are always loaded with the ledger's records since its latest snapshot
+replayed on top, and the ledger keeps every change, for `!undo`, `!bag history` and `!bag at`.
+"""
+
+import asyncio
+import copy
+import os
+import re
+import time
+from datetime import datetime, timezone
 from typing import Optional
+from weakref import WeakValueDictionary
 
 from discord import Embed
 
 from constants.paths import INVENTORY_PATH
+from utils.datasets import apply_dataset_change, get_guild_path, load_dataset, mark_dataset_written, store_dataset
 from utils.embed import dict_to_embed
-from utils.json_utils import read_json_async, write_json_async
+from utils.fuzzy import get_suggestions, load_name_indexes
+from utils.json_utils import write_json_async
+from utils.ledger import MAX_QUANTITY, MIN_QUANTITY, InventoryLedger, ItemChange, LedgerRecord, get_ledger_paths
+from utils.logging import get_logger
+from utils.reminders import DURATION_PART_PATTERN, DURATION_PATTERN, TIME_UNITS
+
+LOGGER = get_logger(os.path.basename(__file__))
+
+# Most changes `!bag history` may list
+MAX_HISTORY_CHANGES = 25
+# Embed descriptions are limited to 4096 characters
+MAX_HISTORY_LENGTH = 4096
+# Discord timestamp, e.g. '<t:1700000000:f>'
+DISCORD_TIMESTAMP = re.compile(r"<t:(-?\d+)(?::\w)?>")
+
+# Serialize read-modify-write cycles on each inventory file. Locks are dropped once nobody holds them
+INVENTORY_LOCKS: WeakValueDictionary[str, asyncio.Lock] = WeakValueDictionary()
+# Serialize seeding guild inventories from the shared inventory (see `seed_guild_inventory`)
+SEED_LOCK = asyncio.Lock()
+# Open ledgers, by inventory file. Reloading utils modules (i.e. `!reload`) opens them again
+LEDGERS: dict[str, InventoryLedger] = {}
+
+
+class InvalidTimeError(ValueError):
+    """Raised when a point in time given in a command can't be understood"""
+
+
+class InvalidQuantityError(ValueError):
+    """Raised when a change would leave an item with a quantity the ledger can't record"""
+
+
+def check_quantity(item: str, quantity: int) -> None:
+    """Check that an item's quantity can be recorded in the ledger
+
+    Args:
+        item (`str`): Name of the item
+        quantity (`int`): Quantity of the item
+
+    Raises:
+        `InvalidQuantityError`: The quantity is out of range
+    """
+    if not MIN_QUANTITY <= quantity <= MAX_QUANTITY:
+        raise InvalidQuantityError(f"That would leave {quantity} {item}, quantities must be between {MIN_QUANTITY:,} and {MAX_QUANTITY:,}")
+
+
+def get_inventory_lock(path: str) -> asyncio.Lock:
+    """Get the lock guarding an inventory file
+
+    Args:
+        path (`str`): Path to the inventory file
+
+    Returns:
+        `asyncio.Lock`: Lock for the inventory file
+    """
+    if (lock := INVENTORY_LOCKS.get(path)) is None:
+        lock = INVENTORY_LOCKS[path] = asyncio.Lock()
+    return lock
+
+
+async def get_ledger(path: str) -> InventoryLedger:
+    """Get the ledger of an inventory file, opening it the first time it's needed
+
+    Args:
+        path (`str`): Path to the inventory file
+
+    Returns:
+        `InventoryLedger`: Ledger of the inventory
+    """
+    if (ledger := LEDGERS.get(path)) is None:
+        ledger = await asyncio.to_thread(InventoryLedger, path)
+        # Another task may have opened it in the meantime
+        ledger = LEDGERS.setdefault(path, ledger)
+    return ledger
+
+
+def read_inventory(path: str) -> dict:
+    """Read an inventory file, replaying its ledger's records since the latest snapshot on top
+
+    Args:
+        path (`str`): Path to the inventory file
+
+    Returns:
+        `dict`: Content of the inventory
+    """
+    if (ledger := LEDGERS.get(path)) is None:
+        ledger = LEDGERS.setdefault(path, InventoryLedger(path))
+    return ledger.state()
+
+
+async def read_inventory_async(path: str) -> dict:
+    """Read an inventory file, replaying its ledger's records since the latest snapshot on top, off the event loop
+
+    Args:
+        path (`str`): Path to the inventory file
+
+    Returns:
+        `dict`: Content of the inventory
+    """
+    return await asyncio.to_thread(read_inventory, path)
+
+
+async def seed_guild_inventory(path: str) -> Optional[dict]:
+    """Give a guild without an inventory a copy of the shared inventory, which every guild used before they had their own
+
+    Args:
+        path (`str`): Path to the guild's inventory file
+
+    Returns:
+        `Optional[dict]`: The guild's new inventory, `None` if there's no shared inventory to copy (or the guild already has history)
+    """
+    # A guild with a ledger has had an inventory before, even if its file has since been deleted
+    if path == INVENTORY_PATH or os.path.exists(get_ledger_paths(path)[0]):
+        return None
+    async with SEED_LOCK:
+        # Another command may have seeded it while this one waited
+        if os.path.exists(path):
+            return await load_dataset(path, read_inventory_async)
+        if not (legacy := await load_dataset(INVENTORY_PATH, read_inventory_async)):
+            return None
+        inventory = copy.deepcopy(legacy)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        await write_json_async(path, inventory)
+        store_dataset(path, inventory, read_inventory_async)
+    LOGGER.info("Seeded inventory '%s' from the shared inventory", path)
+    return inventory
+
+
+async def load_inventory(path: str) -> dict:
+    """Load an inventory. A guild's first load copies the shared inventory (see `seed_guild_inventory`)
+
+    Args:
+        path (`str`): Path to the inventory file
+
+    Returns:
+        `dict`: Content of the inventory, empty if the file doesn't exist yet
+    """
+    inventory = await load_dataset(path, read_inventory_async)
+    if inventory is None:
+        inventory = await seed_guild_inventory(path)
+    return {} if inventory is None else inventory
+
+
+async def save_inventory_change(path: str, item: str, entry: Optional[dict], user_id: Optional[int], undoes: int = -1) -> LedgerRecord:
+    """Record a change to an inventory in its ledger, and apply it to the cached inventory. The caller must hold the file's lock
+
+    Args:
+        path (`str`): Path to the inventory file
+        item (`str`): Name of the item
+        entry (`Optional[dict]`): New content of the item, `None` to remove it
+        user_id (`Optional[int]`): ID of the user making the change, `None` if unknown
+        undoes (`int`): Index of the record this change undoes, -1 if it isn't an undo. Defaults to `-1`.
+
+    Returns:
+        `LedgerRecord`: The recorded change
+    """
+    ledger = await get_ledger(path)
+    inventory = await load_inventory(path)
+    # A guild's first change creates its inventory file, and the first snapshot the ledger's records are replayed over
+    if not ledger.started or not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        await asyncio.to_thread(ledger.snapshot, inventory)
+        store_dataset(path, inventory, read_inventory_async)
 
+    record = await asyncio.to_thread(ledger.append, item, ItemChange(inventory.get(item), entry), user_id, undoes)
+    apply_dataset_change(path, item, entry)
 
-async def get_item(item: str = None) -> Optional[Embed]:
+    if ledger.needs_snapshot():
+        # Loads the inventory again (with the ledger) if it was evicted from the cache in the meantime
+        inventory = await load_inventory(path)
+        await asyncio.to_thread(ledger.snapshot, inventory)
+        mark_dataset_written(path)
+        LOGGER.info("Snapshotted inventory '%s' after %d changes", path, ledger.count)
+    return record
+
+
+async def get_item(item: str = None, guild_id: Optional[int] = None) -> Optional[Embed]:
     """Get content of the inventory.
 
     Return entry of the specified item.
@@ -17,11 +204,12 @@ async def get_item(item: str = None) -> Optional[Embed]:
 
     Args:
         item (`str`): The inventory item to list. Defaults to `None`.
+        guild_id (`Optional[int]`): ID of the guild the inventory belongs to. Defaults to `None`.
 
     Returns:
         `Optional[Embed]`: Discord embed representing inventory content
     """
-    inventory = await read_json_async(INVENTORY_PATH)
+    inventory = await load_inventory(get_guild_path(INVENTORY_PATH, guild_id))
 
     # If no item specified, return entire inventory
     if not item:
@@ -32,46 +220,223 @@ async def get_item(item: str = None) -> Optional[Embed]:
         return dict_to_embed(item, entry)
 
 
-async def store_item(item: str, quantity: int = 1, description: str = None) -> None:
+async def suggest_items(item: str, guild_id: Optional[int] = None) -> list[str]:
+    """Get the inventory items closest to an item that couldn't be found
+
+    Args:
+        item (`str`): Name of the item that couldn't be found
+        guild_id (`Optional[int]`): ID of the guild the inventory belongs to. Defaults to `None`.
+
+    Returns:
+        `list[str]`: Closest item names, closest first
+    """
+    path = get_guild_path(INVENTORY_PATH, guild_id)
+    # Seeds the guild's inventory if it doesn't have one yet
+    await load_inventory(path)
+    return get_suggestions(item, await load_name_indexes(path, loader=read_inventory_async))
+
+
+async def store_item(item: str, quantity: int = 1, description: str = None, guild_id: Optional[int] = None, user_id: Optional[int] = None) -> None:
     """Store an item in inventory
 
     Args:
         item (`str`): Item to add
         quantity (`int`): Quantity of items to remove. Defaults to `1`.
         description (`str`): Description of item. Defaults to `None`.
+        guild_id (`Optional[int]`): ID of the guild the inventory belongs to. Defaults to `None`.
+        user_id (`Optional[int]`): ID of the user storing the item, for the ledger. Defaults to `None`.
+
+    Raises:
+        `InvalidQuantityError`: The item's quantity would be out of range
     """
-    # Read inventory from disk
-    inventory = await read_json_async(INVENTORY_PATH)
+    path = get_guild_path(INVENTORY_PATH, guild_id)
+    async with get_inventory_lock(path):
+        inventory = await load_inventory(path)
 
-    # Check if the item already exists in inventory
-    # If so, increase the quantity
-    if item in inventory.keys():
-        inventory[item]["quantity"] += quantity
-        # Update the description of the item if given
-        if description is not None:
-            inventory[item]["description"] = description
-    # Otherwise, simply add the item to the dict
-    else:
-        inventory[item] = {"description": description, "quantity": quantity}
+        # Check if the item already exists in inventory
+        # If so, increase the quantity
+        if entry := inventory.get(item):
+            # Inventories from before the ledger may hold quantities it can't record
+            check_quantity(item, entry["quantity"])
+            entry = {**entry, "quantity": entry["quantity"] + quantity}
+            # Update the description of the item if given
+            if description is not None:
+                entry["description"] = description
+        # Otherwise, simply add the item
+        else:
+            entry = {"description": description, "quantity": quantity}
+        # Before the ledger is touched, so a rejected change leaves no trace in it
+        check_quantity(item, entry["quantity"])
 
-    # Save inventory
-    await write_json_async(INVENTORY_PATH, inventory)
+        # Save inventory
+        await save_inventory_change(path, item, entry, user_id)
 
 
-async def remove_item(item: str, quantity: int = None) -> None:
+async def remove_item(item: str, quantity: int = None, guild_id: Optional[int] = None, user_id: Optional[int] = None) -> None:
     """Remove an item from inventory
 
     Args:
         item (`str`): Item to remove
         quantity (`int`): Quantity of items to remove. If `None`, removes all. Defaults to `None`.
+        guild_id (`Optional[int]`): ID of the guild the inventory belongs to. Defaults to `None`.
+        user_id (`Optional[int]`): ID of the user removing the item, for the ledger. Defaults to `None`.
+
+    Raises:
+        `InvalidQuantityError`: The item's quantity would be out of range
+    """
+    path = get_guild_path(INVENTORY_PATH, guild_id)
+    async with get_inventory_lock(path):
+        inventory = await load_inventory(path)
+
+        entry = inventory[item]
+        check_quantity(item, entry["quantity"])
+        if quantity is None or quantity >= entry["quantity"]:
+            entry = None
+        else:
+            entry = {**entry, "quantity": entry["quantity"] - quantity}
+            check_quantity(item, entry["quantity"])
+
+        # Save inventory
+        await save_inventory_change(path, item, entry, user_id)
+
+
+async def undo_change(guild_id: Optional[int] = None, user_id: Optional[int] = None) -> Optional[LedgerRecord]:
+    """Undo the latest change to the inventory which hasn't been undone yet. Undoing is itself recorded in the ledger
+
+    Args:
+        guild_id (`Optional[int]`): ID of the guild the inventory belongs to. Defaults to `None`.
+        user_id (`Optional[int]`): ID of the user undoing the change, for the ledger. Defaults to `None`.
+
+    Returns:
+        `Optional[LedgerRecord]`: The change which was undone, `None` if there was nothing to undo
+    """
+    path = get_guild_path(INVENTORY_PATH, guild_id)
+    async with get_inventory_lock(path):
+        ledger = await get_ledger(path)
+        if (record := await asyncio.to_thread(ledger.last_change)) is None:
+            return None
+        await save_inventory_change(path, record.item, record.before, user_id, record.index)
+    return record
+
+
+async def get_history(guild_id: Optional[int] = None, count: int = MAX_HISTORY_CHANGES) -> list[LedgerRecord]:
+    """Get the latest changes to the inventory
+
+    Args:
+        guild_id (`Optional[int]`): ID of the guild the inventory belongs to. Defaults to `None`.
+        count (`int`): Most changes to get. Defaults to `MAX_HISTORY_CHANGES`.
+
+    Returns:
+        `list[LedgerRecord]`: The changes, newest first
     """
-    # Read inventory from disk
-    inventory = await read_json_async(INVENTORY_PATH)
+    ledger = await get_ledger(get_guild_path(INVENTORY_PATH, guild_id))
+    records = await asyncio.to_thread(ledger.read, ledger.count - count, ledger.count)
+    return records[::-1]
+
 
-    if quantity is None or quantity >= inventory[item]["quantity"]:
-        del inventory[item]
-    else:
-        inventory[item]["quantity"] -= quantity
+async def get_inventory_at(when: float, guild_id: Optional[int] = None) -> Optional[dict]:
+    """Rebuild the inventory as it was at a point in time
 
-    # Save inventory
-    await write_json_async(INVENTORY_PATH, inventory)
+    Args:
+        when (`float`): Point in time, as a UNIX timestamp
+        guild_id (`Optional[int]`): ID of the guild the inventory belongs to. Defaults to `None`.
+
+    Returns:
+        `Optional[dict]`: Content of the inventory, `None` if no changes had been recorded by then
+    """
+    ledger = await get_ledger(get_guild_path(INVENTORY_PATH, guild_id))
+
+    def rebuild() -> Optional[dict]:
+        """Find the changes made up to the time, and rebuild the inventory after them"""
+        # Nothing is known of the inventory before its first recorded change
+        if (count := ledger.count_until(when)) == 0:
+            return None
+        return ledger.state_at(count)
+
+    return await asyncio.to_thread(rebuild)
+
+
+def parse_past_time(text: str, now: Optional[float] = None) -> float:
+    """Parse a point in the past: how long ago (e.g. '2h ago' or '3d'), a date and time in UTC (e.g. '2024-05-01 18:30'),
+    or a Discord timestamp (e.g. '<t:1714588200:f>')
+
+    Args:
+        text (`str`): Point in time to parse
+        now (`Optional[float]`): Current time. Defaults to `None` (the time now).
+
+    Returns:
+        `float`: Point in time, as a UNIX timestamp
+
+    Raises:
+        `InvalidTimeError`: The text isn't a point in time
+    """
+    now = time.time() if now is None else now
+    text = text.strip().lower()
+    if match := DISCORD_TIMESTAMP.fullmatch(text):
+        return float(match.group(1))
+    duration = text.removesuffix("ago").strip()
+    if duration and DURATION_PATTERN.fullmatch(duration):
+        return now - sum(int(amount or 1) * TIME_UNITS[unit[0]] for amount, unit in DURATION_PART_PATTERN.findall(duration))
+    try:
+        moment = datetime.fromisoformat(text.upper())
+    except ValueError:
+        raise InvalidTimeError(f"I don't understand '{text}'. Try something like `2h ago`, `3d ago` or `2024-05-01 18:30` (UTC)") from None
+    return (moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)).timestamp()
+
+
+def format_quantity_change(record: LedgerRecord) -> str:
+    """Describe a change to an inventory
+
+    Args:
+        record (`LedgerRecord`): The change
+
+    Returns:
+        `str`: What changed, e.g. 'stored 5 Gold' or 'removed all 3 Rope'
+    """
+    before = 0 if record.before is None else record.before["quantity"]
+    after = 0 if record.after is None else record.after["quantity"]
+    if record.after is None:
+        return f"removed all {before} {record.item}"
+    if after > before:
+        return f"stored {after - before} {record.item}"
+    if after < before:
+        return f"removed {before - after} {record.item}"
+    if record.before is None:
+        return f"stored {record.item}"
+    return f"changed the description of {record.item}"
+
+
+def format_change(record: LedgerRecord) -> str:
+    """Format a change to an inventory for `!bag history`
+
+    Args:
+        record (`LedgerRecord`): The change
+
+    Returns:
+        `str`: Number, time, author and description of the change
+    """
+    author = f" <@{record.user_id}>" if record.user_id else ""
+    change = format_quantity_change(record)
+    if record.undoes >= 0:
+        change = f"undid #{record.undoes + 1} ({change})"
+    return f"`#{record.index + 1}` <t:{int(record.time)}:R>{author} {change}"
+
+
+def get_history_embed(records: list[LedgerRecord]) -> Embed:
+    """Build the reply to `!bag history`
+
+    Args:
+        records (`list[LedgerRecord]`): Changes to list, newest first
+
+    Returns:
+        `Embed`: Discord embed listing the changes, as many as fit
+    """
+    lines = []
+    length = 0
+    for record in records:
+        line = format_change(record)
+        if length + len(line) + 1 > MAX_HISTORY_LENGTH:
+            break
+        lines.append(line)
+        length += len(line) + 1
+    return Embed(title="Inventory History", description="\n".join(lines) or "*No changes yet*")
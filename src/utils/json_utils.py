@@ -1,32 +1,285 @@
-"""JSON Utils"""
+"""JSON Utils
 
+Reading and writing of every JSON data file.
+
+- Decoding (and compact encoding) uses the fastest codec installed: orjson, then msgspec, then the standard library.
+  Set `JSON_BACKEND` to force one.
+- Files people edit by hand (spells, rules, inventories) are written indented with the standard library, so their
+  formatting doesn't depend on the codec. Files only the bot reads can be written compact.
+- Writes are atomic: content is written to a temporary file in the same directory, synced, then renamed over the
+  original, so a crash never leaves a half-written file.
+- File I/O and decoding happen in a single thread hop per read or write.
+"""
+
+import asyncio
 import json
-from typing import Any, Union
+import os
+import re
+import stat
+import tempfile
+from typing import Any, AsyncIterator, Callable, TextIO, Union
+
+# 'auto' (the fastest installed), 'orjson', 'msgspec' or 'json'
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto").lower()
+# Indent of files written for people to read
+JSON_INDENT = 4
+# Bytes read at a time when streaming
+STREAM_CHUNK_SIZE = 64 * 1024
+# Characters which may start a number, and a pattern matching the first character after one
+NUMBER_START = "-0123456789"
+NUMBER_END = re.compile(r"[^0-9eE.+-]")
+# Permissions of new files, as `open` would create them. Reading the umask means setting it, so it's read once, before
+# any threads are writing files
+UMASK = os.umask(0)
+os.umask(UMASK)
+NEW_FILE_MODE = 0o666 & ~UMASK
+
+
+def load_codec(backend: str = JSON_BACKEND) -> tuple[str, Callable[[bytes], Any], Callable[[Any], bytes]]:
+    """Pick the codec used to decode, and compactly encode, JSON
 
-import aiofiles
+    Args:
+        backend (`str`): 'auto', 'orjson', 'msgspec' or 'json'. Defaults to `JSON_BACKEND`.
+
+    Returns:
+        `tuple[str, Callable[[bytes], Any], Callable[[Any], bytes]]`: Name of the codec, decode function, compact encode function
+    """
+    if backend in ("auto", "orjson"):
+        try:
+            import orjson
 
+            return "orjson", orjson.loads, lambda content: orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+        except ImportError:
+            pass
+    if backend in ("auto", "msgspec"):
+        try:
+            import msgspec
 
-async def read_json_async(file_path: str) -> dict[str, Any]:
+            return "msgspec", msgspec.json.decode, msgspec.json.encode
+        except ImportError:
+            pass
+    return "json", json.loads, lambda content: json.dumps(content, separators=(",", ":")).encode()
+
+
+JSON_CODEC, decode_json, encode_json_compact = load_codec()
+
+
+def encode_json(content: Any, compact: bool = False) -> bytes:
+    """Serialize a Python object to JSON
+
+    Args:
+        content (`Any`): Python object to convert to JSON
+        compact (`bool`): Whether to skip indentation, for files only the bot reads. Defaults to `False`.
+
+    Returns:
+        `bytes`: UTF-8 encoded JSON
+    """
+    if compact:
+        return encode_json_compact(content)
+    return json.dumps(content, indent=JSON_INDENT).encode()
+
+
+def read_json(file_path: str) -> Any:
     """Open and deserialize a JSON file to a Python object
 
     Args:
         file_path (`str`): Path to JSON file
 
     Returns:
-        `dict`: Deserialized JSON as a Python object
+        `Any`: Deserialized JSON as a Python object
+    """
+    with open(file_path, "rb") as jsonfile:
+        return decode_json(jsonfile.read())
+
+
+def write_atomic(file_path: str, data: bytes) -> None:
+    """Replace the content of a file atomically: write a temporary file, sync it, then rename it over the file
+
+    Args:
+        file_path (`str`): Path to the file
+        data (`bytes`): New content of the file
     """
-    async with aiofiles.open(file_path, mode="r", encoding="utf8") as jsonfile:
-        raw_json = await jsonfile.read()
-    deserialized_json = json.loads(raw_json)
-    return deserialized_json
+    directory = os.path.dirname(file_path) or "."
+    # Temporary files are only readable by their owner, keep the file's permissions instead
+    try:
+        mode = stat.S_IMODE(os.stat(file_path).st_mode)
+    except FileNotFoundError:
+        mode = NEW_FILE_MODE
+    # The temporary file must be on the same filesystem for the rename to be atomic
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(file_path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tempfile_:
+            tempfile_.write(data)
+            tempfile_.flush()
+            os.fsync(tempfile_.fileno())
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
 
+    # Sync the directory too, so the rename itself survives a crash. Not every platform supports this
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
 
-async def write_json_async(file_path: str, content: Union[list, dict]) -> None:
-    """Serialize a Python object to a JSON string and write to a file
+
+def write_json(file_path: str, content: Any, compact: bool = False) -> None:
+    """Serialize a Python object to JSON and atomically write it to a file
+
+    Args:
+        file_path (`str`): Path to JSON file
+        content (`Any`): Python object to convert to JSON
+        compact (`bool`): Whether to skip indentation, for files only the bot reads. Defaults to `False`.
+    """
+    write_atomic(file_path, encode_json(content, compact))
+
+
+async def read_json_async(file_path: str) -> Any:
+    """Open and deserialize a JSON file to a Python object, off the event loop
+
+    Args:
+        file_path (`str`): Path to JSON file
+
+    Returns:
+        `Any`: Deserialized JSON as a Python object
+    """
+    return await asyncio.to_thread(read_json, file_path)
+
+
+async def write_json_async(file_path: str, content: Union[list, dict], compact: bool = False) -> None:
+    """Serialize a Python object to JSON and atomically write it to a file, off the event loop
 
     Args:
         file_path (`str`): Path to JSON file
         content (`Union[list, dict]`): Python object to convert to JSON
+        compact (`bool`): Whether to skip indentation, for files only the bot reads. Defaults to `False`.
+    """
+    await asyncio.to_thread(write_json, file_path, content, compact)
+
+
+class JsonObjectReader:
+    """Reads the items of a JSON object from a file a chunk at a time, see `iter_json_object_async`"""
+
+    def __init__(self: "JsonObjectReader", jsonfile: TextIO, chunk_size: int) -> None:
+        """Init JsonObjectReader
+
+        Args:
+            jsonfile (`TextIO`): JSON file, opened for reading
+            chunk_size (`int`): Characters to read at a time
+        """
+        self.jsonfile = jsonfile
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+    async def fill(self: "JsonObjectReader") -> bool:
+        """Read another chunk into the buffer, dropping what has been parsed already
+
+        Returns:
+            `bool`: False at end of file
+        """
+        chunk = await asyncio.to_thread(self.jsonfile.read, self.chunk_size)
+        self.buffer = self.buffer[self.position :] + chunk
+        self.position = 0
+        self.eof = not chunk
+        return not self.eof
+
+    async def skip_whitespace(self: "JsonObjectReader") -> str:
+        """Skip to the next significant character
+
+        Returns:
+            `str`: The character, empty at end of file
+        """
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position].isspace():
+                self.position += 1
+            if self.position < len(self.buffer) or not await self.fill():
+                return self.buffer[self.position : self.position + 1]
+
+    async def expect(self: "JsonObjectReader", characters: str) -> str:
+        """Skip past the next significant character, which must be one of several
+
+        Args:
+            characters (`str`): Characters allowed next
+
+        Returns:
+            `str`: The character
+
+        Raises:
+            `ValueError`: The next character isn't allowed
+        """
+        character = await self.skip_whitespace()
+        if not character or character not in characters:
+            raise ValueError(f"Expected one of {characters!r} at {character!r} in '{self.jsonfile.name}'")
+        self.position += 1
+        return character
+
+    async def decode_next(self: "JsonObjectReader") -> Any:
+        """Decode the next value, reading more of the file until it is complete
+
+        Returns:
+            `Any`: The value
+        """
+        await self.skip_whitespace()
+        while True:
+            # A number cut off by the end of the buffer would still decode (e.g. '1.5' of '1.5e10'), so make sure it's complete
+            if not self.eof and self.buffer[self.position] in NUMBER_START and not NUMBER_END.search(self.buffer, self.position) and await self.fill():
+                continue
+            try:
+                value, self.position = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if self.eof or not await self.fill():
+                    raise
+                continue
+            return value
+
+    async def items(self: "JsonObjectReader") -> AsyncIterator[tuple[str, Any]]:
+        """Iterate over the items of the object
+
+        Yields:
+            `tuple[str, Any]`: Key and deserialized value of each item
+
+        Raises:
+            `ValueError`: The file isn't a JSON object
+        """
+        await self.expect("{")
+        if await self.skip_whitespace() == "}":
+            return
+        while True:
+            key = await self.decode_next()
+            await self.expect(":")
+            yield key, await self.decode_next()
+            if await self.expect(",}") == "}":
+                return
+
+
+async def iter_json_object_async(file_path: str, chunk_size: int = STREAM_CHUNK_SIZE) -> AsyncIterator[tuple[str, Any]]:
+    """Stream the items of a large JSON file whose top level is an object, without loading the whole file at once.
+    Only one value is held in memory at a time
+
+    Args:
+        file_path (`str`): Path to JSON file
+        chunk_size (`int`): Bytes to read at a time. Defaults to `STREAM_CHUNK_SIZE`.
+
+    Yields:
+        `tuple[str, Any]`: Key and deserialized value of each item
+
+    Raises:
+        `ValueError`: The file isn't a JSON object
     """
-    async with aiofiles.open(file_path, mode="w", encoding="utf8") as jsonfile:
-        await jsonfile.write(json.dumps(content, indent=4))
+    jsonfile = await asyncio.to_thread(open, file_path, encoding="utf8")
+    try:
+        async for item in JsonObjectReader(jsonfile, chunk_size).items():
+            yield item
+    finally:
+        jsonfile.close()
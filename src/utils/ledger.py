@@ -0,0 +1,317 @@
+"""Inventory Ledger Utils
+
+Every change to an inventory is appended to a ledger next to the inventory file (e.g. `inventory.ledger`), and the
+ledger is never rewritten, so past inventories can be rebuilt and changes undone.
+
+Records have a fixed size (see `RECORD`): when the change was made, by whom, the item and its quantity and description
+before and after. Item names and descriptions are appended to a strings file (e.g. `inventory.strings`) and referenced
+by offset, so record `n` is at byte `n * RECORD.size` and records are found by position, or by time with a binary search,
+without reading the records before them.
+
+Every `SNAPSHOT_INTERVAL` records the inventory is snapshotted: the inventory file is rewritten, and a copy is kept in
+the snapshot directory (e.g. `inventory.snapshots/512.json`, the inventory after the first 512 records). The current
+inventory is the inventory file with the records since the latest snapshot replayed on top, and the inventory at any
+point in time is the snapshot before it with the records up to it replayed, so neither reads more than
+`SNAPSHOT_INTERVAL` records. Records hold the item as it was after the change, so replaying a record twice (e.g. after a
+crash while snapshotting) is harmless.
+"""
+
+import os
+import struct
+import time
+from bisect import bisect_right
+from typing import BinaryIO, NamedTuple, Optional
+
+from utils.json_utils import read_json, write_json
+from utils.logging import get_logger
+
+LOGGER = get_logger(os.path.basename(__file__))
+
+# Records between snapshots, the most records replayed to rebuild an inventory
+SNAPSHOT_INTERVAL = 256
+# Layout of a record: time, user ID, record undone (-1 if none), item (offset, length), whether the item existed before
+# and after the change (`HAD_ITEM` and `HAS_ITEM` flags), then quantity and description (offset, length, -1 if none)
+# before and after the change
+RECORD = struct.Struct("<dQqQIBqQiqQi")
+HAD_ITEM = 1
+HAS_ITEM = 2
+# Range of quantities a record can hold (signed 64-bit)
+MIN_QUANTITY = -(2**63)
+MAX_QUANTITY = 2**63 - 1
+# Length of a missing description
+NO_TEXT = -1
+
+
+class ItemChange(NamedTuple):
+    """An item before and after a change"""
+
+    before: Optional[dict]  # `None` if it wasn't in the inventory
+    after: Optional[dict]  # `None` if it was removed
+
+
+class LedgerRecord(NamedTuple):
+    """A change to an inventory"""
+
+    index: int  # Position of the record in the ledger, starting at 0
+    time: float
+    user_id: int  # 0 if unknown
+    undoes: int  # Index of the record this one undid, -1 if it isn't an undo
+    item: str
+    before: Optional[dict]  # The item before the change, `None` if it wasn't in the inventory
+    after: Optional[dict]  # The item after the change, `None` if it was removed
+
+
+def get_ledger_paths(path: str) -> tuple[str, str, str]:
+    """Get the paths of an inventory file's ledger, strings file and snapshot directory
+
+    e.g. `data/guilds/1234/inventory.json` -> `data/guilds/1234/inventory.ledger`, `...inventory.strings` and `...inventory.snapshots`
+
+    Args:
+        path (`str`): Path to the inventory file
+
+    Returns:
+        `tuple[str, str, str]`: Paths to the ledger, strings file and snapshot directory
+    """
+    base = os.path.splitext(path)[0]
+    return f"{base}.ledger", f"{base}.strings", f"{base}.snapshots"
+
+
+def replay(inventory: dict, records: list[LedgerRecord]) -> dict:
+    """Apply records to an inventory, in place
+
+    Args:
+        inventory (`dict`): Inventory to apply the records to
+        records (`list[LedgerRecord]`): Records to apply, oldest first
+
+    Returns:
+        `dict`: The inventory
+    """
+    for record in records:
+        if record.after is None:
+            inventory.pop(record.item, None)
+        else:
+            inventory[record.item] = record.after
+    return inventory
+
+
+class InventoryLedger:
+    """Append-only history of an inventory, with periodic snapshots. Methods block on file I/O, run them in a thread"""
+
+    def __init__(self: "InventoryLedger", path: str) -> None:
+        """Init InventoryLedger, opening the ledger of an inventory file (if it has one)
+
+        Args:
+            path (`str`): Path to the inventory file
+        """
+        self.path = path
+        self.ledger_path, self.strings_path, self.snapshot_dir = get_ledger_paths(path)
+        try:
+            size = os.path.getsize(self.ledger_path)
+        except FileNotFoundError:
+            size = 0
+        if size % RECORD.size:
+            # The last record was cut short by a crash. Changes are only acknowledged once fully written
+            LOGGER.warning("Dropping an incomplete record at the end of '%s'", self.ledger_path)
+            with open(self.ledger_path, "r+b") as ledger:
+                ledger.truncate(size - size % RECORD.size)
+        self.count = size // RECORD.size
+        # Number of records each snapshot follows, in order
+        try:
+            self.snapshots = sorted(int(name.removesuffix(".json")) for name in os.listdir(self.snapshot_dir) if name.removesuffix(".json").isdigit())
+        except FileNotFoundError:
+            self.snapshots = []
+        self.last_time = self.read(self.count - 1, self.count)[0].time if self.count else 0.0
+
+    @property
+    def started(self: "InventoryLedger") -> bool:
+        """Whether the ledger has its first snapshot, i.e. changes can be recorded"""
+        return bool(self.snapshots)
+
+    def _write_text(self: "InventoryLedger", strings: BinaryIO, text: Optional[str]) -> tuple[int, int]:
+        """Append a string to the strings file
+
+        Args:
+            strings (`BinaryIO`): Strings file, opened for appending
+            text (`Optional[str]`): String to append
+
+        Returns:
+            `tuple[int, int]`: Offset and length of the string, length `NO_TEXT` if it's `None`
+        """
+        if text is None:
+            return 0, NO_TEXT
+        data = str(text).encode()
+        offset = strings.tell()
+        strings.write(data)
+        return offset, len(data)
+
+    def append(self: "InventoryLedger", item: str, change: ItemChange, user_id: Optional[int], undoes: int = -1) -> LedgerRecord:
+        """Durably append a change to the ledger
+
+        Args:
+            item (`str`): Name of the changed item
+            change (`ItemChange`): The item before and after the change
+            user_id (`Optional[int]`): ID of the user who made the change, `None` if unknown
+            undoes (`int`): Index of the record this change undoes, -1 if it isn't an undo. Defaults to `-1`.
+
+        Returns:
+            `LedgerRecord`: The appended record
+        """
+        before, after = change
+        # Times only move forward, so records can be searched by time even if the clock is adjusted
+        self.last_time = max(time.time(), self.last_time)
+        flags = (HAD_ITEM if before is not None else 0) | (HAS_ITEM if after is not None else 0)
+        with open(self.strings_path, "ab") as strings:
+            item_text = self._write_text(strings, item)
+            before_text = self._write_text(strings, None if before is None else before.get("description"))
+            # Descriptions rarely change, point at the same text rather than writing it again
+            if before is not None and after is not None and after.get("description") == before.get("description"):
+                after_text = before_text
+            else:
+                after_text = self._write_text(strings, None if after is None else after.get("description"))
+            strings.flush()
+            os.fsync(strings.fileno())
+        data = RECORD.pack(
+            self.last_time,
+            user_id or 0,
+            undoes,
+            *item_text,
+            flags,
+            0 if before is None else int(before.get("quantity", 0)),
+            *before_text,
+            0 if after is None else int(after.get("quantity", 0)),
+            *after_text,
+        )
+        with open(self.ledger_path, "ab") as ledger:
+            ledger.write(data)
+            ledger.flush()
+            os.fsync(ledger.fileno())
+        self.count += 1
+        return LedgerRecord(self.count - 1, self.last_time, user_id or 0, undoes, item, before, after)
+
+    def read(self: "InventoryLedger", start: int, stop: int) -> list[LedgerRecord]:
+        """Read a range of records
+
+        Args:
+            start (`int`): Index of the first record
+            stop (`int`): Index after the last record
+
+        Returns:
+            `list[LedgerRecord]`: The records, oldest first
+        """
+        start, stop = max(start, 0), min(stop, self.count)
+        if start >= stop:
+            return []
+        with open(self.ledger_path, "rb") as ledger:
+            ledger.seek(start * RECORD.size)
+            data = ledger.read((stop - start) * RECORD.size)
+
+        records = []
+        with open(self.strings_path, "rb") as strings:
+
+            def read_text(offset: int, length: int) -> Optional[str]:
+                """Read a string referenced by a record"""
+                if length == NO_TEXT:
+                    return None
+                strings.seek(offset)
+                return strings.read(length).decode()
+
+            for index, fields in enumerate(RECORD.iter_unpack(data), start):
+                when, user_id, undoes, item_offset, item_length, flags = fields[:6]
+                before_quantity, before_offset, before_length, after_quantity, after_offset, after_length = fields[6:]
+                before = {"description": read_text(before_offset, before_length), "quantity": before_quantity} if flags & HAD_ITEM else None
+                after = {"description": read_text(after_offset, after_length), "quantity": after_quantity} if flags & HAS_ITEM else None
+                records.append(LedgerRecord(index, when, user_id, undoes, read_text(item_offset, item_length), before, after))
+        return records
+
+    def _read_time(self: "InventoryLedger", ledger: BinaryIO, index: int) -> float:
+        """Read the time of a record
+
+        Args:
+            ledger (`BinaryIO`): Ledger, opened for reading
+            index (`int`): Index of the record
+
+        Returns:
+            `float`: Time of the record
+        """
+        ledger.seek(index * RECORD.size)
+        return struct.unpack("<d", ledger.read(8))[0]
+
+    def count_until(self: "InventoryLedger", when: float) -> int:
+        """Count the records made at or before a point in time
+
+        Args:
+            when (`float`): Point in time
+
+        Returns:
+            `int`: Number of records made at or before the time
+        """
+        low, high = 0, self.count
+        if not high:
+            return 0
+        with open(self.ledger_path, "rb") as ledger:
+            while low < high:
+                middle = (low + high) // 2
+                if self._read_time(ledger, middle) <= when:
+                    low = middle + 1
+                else:
+                    high = middle
+        return low
+
+    def last_change(self: "InventoryLedger") -> Optional[LedgerRecord]:
+        """Find the latest change which hasn't been undone
+
+        Returns:
+            `Optional[LedgerRecord]`: The change, `None` if every change has been undone (or there are none)
+        """
+        # Undos always undo the latest change left, so everything between a change and its undo has been undone too
+        index = self.count - 1
+        while index >= 0:
+            record = self.read(index, index + 1)[0]
+            if record.undoes < 0:
+                return record
+            index = record.undoes - 1
+        return None
+
+    def state(self: "InventoryLedger") -> dict:
+        """Rebuild the current inventory: the inventory file with the records since the latest snapshot replayed on top
+
+        Returns:
+            `dict`: The inventory, empty if the file doesn't exist
+        """
+        inventory = read_json(self.path) if os.path.exists(self.path) else {}
+        return replay(inventory, self.read(self.snapshots[-1] if self.snapshots else 0, self.count))
+
+    def state_at(self: "InventoryLedger", count: int) -> dict:
+        """Rebuild the inventory as it was after a number of records: the snapshot before it with the records since replayed on top
+
+        Args:
+            count (`int`): Number of records
+
+        Returns:
+            `dict`: The inventory
+        """
+        if (position := bisect_right(self.snapshots, count)) == 0:
+            return replay({}, self.read(0, count))
+        snapshot = self.snapshots[position - 1]
+        return replay(read_json(os.path.join(self.snapshot_dir, f"{snapshot}.json")), self.read(snapshot, count))
+
+    def needs_snapshot(self: "InventoryLedger") -> bool:
+        """Check whether enough records have been appended since the latest snapshot to take another
+
+        Returns:
+            `bool`: True if a snapshot is due
+        """
+        return not self.snapshots or self.count - self.snapshots[-1] >= SNAPSHOT_INTERVAL
+
+    def snapshot(self: "InventoryLedger", inventory: dict) -> None:
+        """Snapshot the inventory: rewrite the inventory file, and keep a copy for rebuilding past inventories
+
+        Args:
+            inventory (`dict`): The current inventory, with every record applied
+        """
+        # The inventory file first: if the copy is lost to a crash, the records since the previous snapshot are replayed again
+        write_json(self.path, inventory)
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        write_json(os.path.join(self.snapshot_dir, f"{self.count}.json"), inventory, compact=True)
+        if not self.snapshots or self.snapshots[-1] != self.count:
+            self.snapshots.append(self.count)
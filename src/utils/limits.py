@@ -0,0 +1,113 @@
+"""Command Limit Utils
+
+Per-user and per-guild cooldowns for commands, plus a gate bounding how much expensive work runs (or waits to run) at once.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable
+
+from discord.ext.commands import BucketType, CommandError, CommandOnCooldown, Context, CooldownMapping, before_invoke
+
+from constants.limits import GUILD_COOLDOWNS, MAX_EXPENSIVE_TASKS, MAX_EXPENSIVE_WAITERS, USER_COOLDOWNS
+from utils.metrics import MetricsRegistry
+from utils.tracing import span
+
+
+class ServerBusyError(CommandError):
+    """Raised when too many expensive tasks are already waiting to run"""
+
+    def __init__(self: "ServerBusyError") -> None:
+        """Init ServerBusyError"""
+        super().__init__("Too many expensive requests are waiting to run")
+
+
+def limited(command_name: str) -> Callable:
+    """Decorator applying the configured user and guild cooldowns to a command
+
+    Cooldowns are checked in a before-invoke hook rather than a check, so listing commands in `!help` doesn't use them up.
+
+    Args:
+        command_name (`str`): Name of the command, used to look up its cooldowns in `constants.limits`
+
+    Returns:
+        `Callable`: Decorator to apply to the command
+    """
+    mappings = []
+    if command_name in USER_COOLDOWNS:
+        mappings.append(CooldownMapping.from_cooldown(*USER_COOLDOWNS[command_name], BucketType.user))
+    if command_name in GUILD_COOLDOWNS:
+        mappings.append(CooldownMapping.from_cooldown(*GUILD_COOLDOWNS[command_name], BucketType.guild))
+
+    async def check_cooldowns(_cog: object, ctx: Context) -> None:
+        """Update the command's cooldowns, raising if any of them is exhausted
+
+        Args:
+            _cog (`object`): Cog the command belongs to
+            ctx (`Context`): Message context object from Discord
+
+        Raises:
+            `CommandOnCooldown`: The user or guild has used the command too often
+        """
+        for mapping in mappings:
+            bucket = mapping.get_bucket(ctx.message)
+            if retry_after := bucket.update_rate_limit():
+                ctx.bot.metrics.incr("limits.cooldown_rejected")
+                raise CommandOnCooldown(bucket, retry_after, mapping.type)
+
+    return before_invoke(check_cooldowns)
+
+
+class ExpensiveWorkGate:
+    """Bounded concurrency for expensive work, with a bounded wait queue.
+
+    Requests arriving when every slot is taken and the wait queue is full are rejected immediately.
+    """
+
+    def __init__(self: "ExpensiveWorkGate", metrics: MetricsRegistry, max_tasks: int = MAX_EXPENSIVE_TASKS, max_waiters: int = MAX_EXPENSIVE_WAITERS) -> None:
+        """Init ExpensiveWorkGate
+
+        Args:
+            metrics (`MetricsRegistry`): Registry to report queued and rejected requests to
+            max_tasks (`int`): Number of tasks allowed to run at once. Defaults to `MAX_EXPENSIVE_TASKS`.
+            max_waiters (`int`): Number of tasks allowed to wait for a slot. Defaults to `MAX_EXPENSIVE_WAITERS`.
+        """
+        self.metrics = metrics
+        self.max_tasks = max_tasks
+        self.max_waiters = max_waiters
+        self.semaphore = asyncio.Semaphore(max_tasks)
+        self.running = 0
+        self.waiting = 0
+        metrics.gauge("limits.running", lambda: self.running)
+        metrics.gauge("limits.waiting", lambda: self.waiting)
+
+    @asynccontextmanager
+    async def slot(self: "ExpensiveWorkGate") -> AsyncIterator[None]:
+        """Hold a slot for the duration of the context, waiting for one if necessary
+
+        Raises:
+            `ServerBusyError`: The wait queue is full
+
+        Yields:
+            `None`: Once a slot has been acquired
+        """
+        if self.semaphore.locked():
+            if self.waiting >= self.max_waiters:
+                self.metrics.incr("limits.rejected")
+                raise ServerBusyError()
+            self.metrics.incr("limits.queued")
+            self.waiting += 1
+            try:
+                with span("queue"):
+                    await self.semaphore.acquire()
+            finally:
+                self.waiting -= 1
+        else:
+            await self.semaphore.acquire()
+
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self.semaphore.release()
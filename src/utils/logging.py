@@ -1,19 +1,175 @@
-"""Logging Utils"""
+"""Logging Utils
 
+Logging is configured once per process. Records emitted on the event loop are pushed onto a queue by a `QueueHandler`,
+and a `QueueListener` thread takes care of formatting and writing them, so no log call blocks the loop on I/O.
+"""
+
+import atexit
+import copy
+import json
 import logging
+import os
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Optional
 
 LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
 DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
+# Configurable via env vars
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_STYLE = os.getenv("LOG_STYLE", "text").lower()  # 'text' | 'json'
+# Fraction of successful command completions to log, errors are always logged
+COMMAND_LOG_SAMPLE_RATE = float(os.getenv("COMMAND_LOG_SAMPLE_RATE", "1.0"))
+
+# Name given to our QueueHandler so we can find it again (e.g. after utils modules are reloaded)
+QUEUE_HANDLER_NAME = "volobot-queue"
+
+# Structured fields that may be attached to a record with `extra`
+COMMAND_FIELDS = ("command", "guild", "latency_ms", "outcome")
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as single-line JSON objects"""
+
+    def format(self: "JsonFormatter", record: logging.LogRecord) -> str:
+        """Format a record as JSON
+
+        Args:
+            record (`logging.LogRecord`): Record to format
+
+        Returns:
+            `str`: JSON representation of the record
+        """
+        entry = {
+            "time": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in COMMAND_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Drop a fraction of high-volume records.
+
+    Records opt in to sampling by passing `extra={"sample_rate": <0.0-1.0>}`; all other records pass through untouched.
+    """
+
+    def filter(self: "SamplingFilter", record: logging.LogRecord) -> bool:
+        """Decide whether a record should be logged
+
+        Args:
+            record (`logging.LogRecord`): Record to check
+
+        Returns:
+            `bool`: True if the record should be logged
+        """
+        sample_rate = getattr(record, "sample_rate", None)
+        return sample_rate is None or random.random() < sample_rate
+
+
+class LoopSafeQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread"""
+
+    def prepare(self: "LoopSafeQueueHandler", record: logging.LogRecord) -> logging.LogRecord:
+        """Merge the message arguments so they can't change while queued.
+
+        Unlike the base implementation, tracebacks are not formatted here; that is left to the listener's handlers.
+
+        Args:
+            record (`logging.LogRecord`): Record to enqueue
+
+        Returns:
+            `logging.LogRecord`: Copy of the record, ready to be enqueued
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _find_queue_handler() -> Optional[QueueHandler]:
+    """Find the QueueHandler installed by `configure_logging`
+
+    Returns:
+        `Optional[QueueHandler]`: Our handler if logging has been configured, otherwise `None`
+    """
+    for handler in logging.getLogger().handlers:
+        if handler.get_name() == QUEUE_HANDLER_NAME:
+            return handler
+    return None
+
+
+def configure_logging() -> None:
+    """Configure the root logger. Safe to call multiple times, only the first call has any effect."""
+    if _find_queue_handler() is not None:
+        return
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter() if LOG_STYLE == "json" else logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+
+    queue_handler = LoopSafeQueueHandler(queue.SimpleQueue())
+    queue_handler.set_name(QUEUE_HANDLER_NAME)
+    queue_handler.addFilter(SamplingFilter())
+
+    listener = QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+    # Keep a reference to the listener on the handler so it can be stopped later
+    queue_handler.listener = listener
+    listener.start()
+    atexit.register(stop_logging)
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(queue_handler)
+
+
+def stop_logging() -> None:
+    """Flush any queued records and stop the listener thread"""
+    if (handler := _find_queue_handler()) is not None:
+        logging.getLogger().removeHandler(handler)
+        handler.listener.stop()
+
 
 def get_logger(name: str) -> logging.Logger:
-    """Create a basic logger
+    """Get a logger, configuring logging on first use
 
     Args:
         name (`str`): Name of the logger. i.e. os.path.basename(__file__)
 
     Returns:
-        `logging.Logger`: A logger with specified name and basic configuration
+        `logging.Logger`: A logger with specified name
     """
-    logging.basicConfig(level=logging.INFO, format=LOG_FORMAT, datefmt=DATE_FORMAT)
+    configure_logging()
     return logging.getLogger(name)
+
+
+def command_log_fields(ctx: Any, outcome: str, sample: bool = False) -> dict[str, Any]:
+    """Build the `extra` dict for a structured command log record
+
+    Args:
+        ctx (`Context`): Message context object from Discord
+        outcome (`str`): Result of the command (e.g. 'success', 'error')
+        sample (`bool`): Whether the record should be subject to sampling. Defaults to `False`.
+
+    Returns:
+        `dict[str, Any]`: Fields to pass as `extra` to a logging call
+    """
+    # `started_at` is set by VoloBot.invoke, it will be missing if the command never started (e.g. CommandNotFound)
+    started_at = getattr(ctx, "started_at", None)
+    fields = {
+        "command": ctx.command.qualified_name if ctx.command else None,
+        "guild": ctx.guild.id if ctx.guild else None,
+        "latency_ms": None if started_at is None else round((time.perf_counter() - started_at) * 1000, 2),
+        "outcome": outcome,
+    }
+    if sample:
+        fields["sample_rate"] = COMMAND_LOG_SAMPLE_RATE
+    return fields
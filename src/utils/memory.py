@@ -0,0 +1,163 @@
+"""Memory Utils
+
+Resident memory reporting, a tracemalloc breakdown of memory by cache, and a governor that shrinks our own caches when
+the process goes over its soft memory limit.
+"""
+
+import asyncio
+import os
+import resource
+import sys
+import tracemalloc
+from typing import Callable, Optional
+
+from utils.logging import get_logger
+from utils.metrics import MetricsRegistry
+
+LOGGER = get_logger(os.path.basename(__file__))
+
+# Resident memory above which our caches are shrunk, in bytes. 0 disables the governor
+MEMORY_SOFT_LIMIT = int(os.getenv("MEMORY_SOFT_LIMIT_MB", "0")) * 1024 * 1024
+# Seconds between memory checks
+MEMORY_CHECK_INTERVAL = 30.0
+# Fraction of its current size each cache is shrunk to when over the soft limit
+SHRINK_FRACTION = 0.5
+# Number of frames tracemalloc records per allocation, enough to find which cache an allocation belongs to
+TRACEMALLOC_FRAMES = 16
+
+# Source files responsible for each cache. An allocation is attributed to the first category matching its traceback
+MEMORY_CATEGORIES = {
+    "discord.py message cache": ("discord/message.py",),
+    "discord.py member/user cache": ("discord/member.py", "discord/user.py", "discord/presences.py"),
+    "discord.py guild/channel cache": (
+        "discord/guild.py",
+        "discord/channel.py",
+        "discord/threads.py",
+        "discord/role.py",
+        "discord/emoji.py",
+        "discord/sticker.py",
+    ),
+    "VoloBot data caches": ("utils/datasets.py", "utils/json_utils.py", "utils/crit.py", "utils/fuzzy.py", "utils/spellbook.py"),
+    "discord.py gateway/http": ("discord/gateway.py", "discord/http.py", "discord/state.py", "aiohttp/"),
+}
+UNCATEGORIZED = "other"
+
+Shrinker = Callable[[float], int]
+SizeGetter = Callable[[], int]
+
+
+def get_rss() -> int:
+    """Get the resident memory of this process
+
+    Returns:
+        `int`: Resident memory in bytes
+    """
+    try:
+        with open("/proc/self/statm", encoding="utf8") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Not on Linux, fall back to peak resident memory (reported in bytes on macOS, KiB elsewhere)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def get_traced_memory_by_category() -> Optional[dict[str, int]]:
+    """Break down memory allocated since tracing started by the cache responsible for it
+
+    Returns:
+        `Optional[dict[str, int]]`: Bytes allocated per category, `None` if tracemalloc isn't tracing
+    """
+    if not tracemalloc.is_tracing():
+        return None
+
+    usage = dict.fromkeys([*MEMORY_CATEGORIES, UNCATEGORIZED], 0)
+    for stat in tracemalloc.take_snapshot().statistics("traceback"):
+        category = UNCATEGORIZED
+        # Frames are ordered from most recent call
+        for frame in stat.traceback:
+            category = next((name for name, files in MEMORY_CATEGORIES.items() if any(file in frame.filename for file in files)), None)
+            if category is not None:
+                break
+        usage[category or UNCATEGORIZED] += stat.size
+    return usage
+
+
+def start_tracing() -> bool:
+    """Start tracing allocations, if we aren't already
+
+    Returns:
+        `bool`: True if tracing was started, False if it was already running
+    """
+    if tracemalloc.is_tracing():
+        return False
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+    return True
+
+
+class MemoryGovernor:
+    """Shrink registered caches when resident memory goes over a soft limit"""
+
+    def __init__(self: "MemoryGovernor", metrics: MetricsRegistry, soft_limit: int = MEMORY_SOFT_LIMIT, interval: float = MEMORY_CHECK_INTERVAL) -> None:
+        """Init MemoryGovernor
+
+        Args:
+            metrics (`MetricsRegistry`): Registry to report memory use to
+            soft_limit (`int`): Resident memory above which caches are shrunk, in bytes. 0 disables shrinking. Defaults to `MEMORY_SOFT_LIMIT`.
+            interval (`float`): Seconds between memory checks. Defaults to `MEMORY_CHECK_INTERVAL`.
+        """
+        self.metrics = metrics
+        self.soft_limit = soft_limit
+        self.interval = interval
+        self.caches: dict[str, tuple[Shrinker, SizeGetter]] = {}
+        self.task: Optional[asyncio.Task] = None
+        metrics.gauge("memory.rss", get_rss)
+
+    def register(self: "MemoryGovernor", name: str, shrink: Shrinker, size: SizeGetter) -> None:
+        """Register a cache to be shrunk under memory pressure
+
+        Args:
+            name (`str`): Name of the cache
+            shrink (`Shrinker`): Function shrinking the cache to a fraction of its current size, returning bytes freed
+            size (`SizeGetter`): Function returning the (estimated) size of the cache in bytes
+        """
+        self.caches[name] = (shrink, size)
+        self.metrics.gauge(f"memory.cache.{name}", size)
+
+    def cache_sizes(self: "MemoryGovernor") -> dict[str, int]:
+        """Get the size of every registered cache
+
+        Returns:
+            `dict[str, int]`: Estimated bytes used by each cache
+        """
+        return {name: size() for name, (_, size) in self.caches.items()}
+
+    def start(self: "MemoryGovernor") -> None:
+        """Start checking memory periodically, if a soft limit is set"""
+        if self.soft_limit:
+            self.task = asyncio.create_task(self._run())
+
+    def stop(self: "MemoryGovernor") -> None:
+        """Stop checking memory"""
+        if self.task is not None:
+            self.task.cancel()
+
+    async def _run(self: "MemoryGovernor") -> None:
+        """Check memory until stopped"""
+        while True:
+            await asyncio.sleep(self.interval)
+            self.check()
+
+    def check(self: "MemoryGovernor") -> int:
+        """Shrink every registered cache if resident memory is over the soft limit
+
+        Returns:
+            `int`: Estimated bytes freed
+        """
+        rss = get_rss()
+        if not self.soft_limit or rss <= self.soft_limit:
+            return 0
+
+        freed = sum(shrink(SHRINK_FRACTION) for shrink, _ in self.caches.values())
+        self.metrics.incr("memory.shrinks")
+        LOGGER.warning("Resident memory %.1f MiB over soft limit %.1f MiB, shrunk caches by %.1f KiB", rss / 2**20, self.soft_limit / 2**20, freed / 1024)
+        return freed
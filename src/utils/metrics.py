@@ -0,0 +1,168 @@
+"""Metrics Utils
+
+In-process counters, gauges and histograms. A single `MetricsRegistry` is owned by the bot and shared by its services.
+"""
+
+import math
+from collections import deque
+from typing import Callable, Union
+
+# Number of recent samples each histogram keeps for percentile calculations
+HISTOGRAM_WINDOW = 1024
+
+
+class Histogram:
+    """Track a stream of values, keeping a window of recent samples for percentiles"""
+
+    def __init__(self: "Histogram", window: int = HISTOGRAM_WINDOW) -> None:
+        """Init Histogram
+
+        Args:
+            window (`int`): Number of recent samples to keep. Defaults to `HISTOGRAM_WINDOW`.
+        """
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self: "Histogram", value: float) -> None:
+        """Record a value
+
+        Args:
+            value (`float`): Value to record
+        """
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self: "Histogram", percent: float) -> float:
+        """Get a percentile of the recent samples (nearest-rank)
+
+        Args:
+            percent (`float`): Percentile to calculate, from 0 to 100
+
+        Returns:
+            `float`: Value at the given percentile, 0 if there are no samples
+        """
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+        return ordered[rank - 1]
+
+    def summary(self: "Histogram") -> dict[str, float]:
+        """Summarize the histogram
+
+        Returns:
+            `dict[str, float]`: Count, mean, p50, p99 and max of recorded values
+        """
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class MetricsRegistry:
+    """Collection of named metrics"""
+
+    def __init__(self: "MetricsRegistry") -> None:
+        """Init MetricsRegistry"""
+        self.counters: dict[str, int] = {}
+        self.gauges: dict[str, Callable[[], float]] = {}
+        self.histograms: dict[str, Histogram] = {}
+
+    def incr(self: "MetricsRegistry", name: str, amount: int = 1) -> None:
+        """Increment a counter
+
+        Args:
+            name (`str`): Name of the counter
+            amount (`int`): Amount to increment by. Defaults to `1`.
+        """
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self: "MetricsRegistry", name: str, callback: Callable[[], float]) -> None:
+        """Register a gauge. The callback is called whenever the registry is read
+
+        Args:
+            name (`str`): Name of the gauge
+            callback (`Callable[[], float]`): Function returning the current value of the gauge
+        """
+        self.gauges[name] = callback
+
+    def histogram(self: "MetricsRegistry", name: str) -> Histogram:
+        """Get (or create) a histogram
+
+        Args:
+            name (`str`): Name of the histogram
+
+        Returns:
+            `Histogram`: The named histogram
+        """
+        if name not in self.histograms:
+            self.histograms[name] = Histogram()
+        return self.histograms[name]
+
+    def observe(self: "MetricsRegistry", name: str, value: float) -> None:
+        """Record a value in a histogram
+
+        Args:
+            name (`str`): Name of the histogram
+            value (`float`): Value to record
+        """
+        self.histogram(name).observe(value)
+
+    def snapshot(self: "MetricsRegistry") -> dict[str, Union[float, dict[str, float]]]:
+        """Read every metric
+
+        Returns:
+            `dict[str, Union[float, dict[str, float]]]`: Metric names mapped to their current values
+        """
+        snapshot = dict(self.counters)
+        snapshot.update({name: callback() for name, callback in self.gauges.items()})
+        snapshot.update({name: histogram.summary() for name, histogram in self.histograms.items()})
+        return dict(sorted(snapshot.items()))
+
+    def format(self: "MetricsRegistry") -> str:
+        """Format every metric as plain text, one per line
+
+        Returns:
+            `str`: Formatted metrics
+        """
+        lines = []
+        for name, value in self.snapshot().items():
+            if isinstance(value, dict):
+                lines.append(f"{name}: " + " ".join(f"{key}={stat:.2f}" if isinstance(stat, float) else f"{key}={stat}" for key, stat in value.items()))
+            else:
+                lines.append(f"{name}: {value}")
+        return "\n".join(lines)
+
+
+def format_code_blocks(text: str, max_length: int) -> list[str]:
+    """Split text on line boundaries into as few code blocks as possible, each fitting in a message
+
+    Args:
+        text (`str`): Text to split, e.g. formatted metrics
+        max_length (`int`): Longest message, including the code block's backticks
+
+    Returns:
+        `list[str]`: Messages, one or more lines in each. Lines too long for a message are cut short
+    """
+    fence = "```"
+    room = max_length - 2 * len(fence) - 2
+    messages = []
+    chunk: list[str] = []
+    length = 0
+    for full_line in text.splitlines():
+        line = full_line if len(full_line) <= room else full_line[: room - 1] + "…"
+        if chunk and length + len(line) + 1 > room:
+            messages.append("\n".join(chunk))
+            chunk, length = [], 0
+        chunk.append(line)
+        length += len(line) + 1
+    if chunk:
+        messages.append("\n".join(chunk))
+    return [f"{fence}\n{message}\n{fence}" for message in messages]
@@ -0,0 +1,155 @@
+"""Profiling Utils
+
+A sampling profiler for the live bot. A helper thread periodically records the event loop thread's stack, so overhead
+is bounded by the sampling interval no matter how busy the bot is. Results are reported as top functions, plus collapsed
+stacks which can be fed straight into flamegraph tools (e.g. `flamegraph.pl` or speedscope).
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from typing import Optional
+
+# Seconds between stack samples
+SAMPLE_INTERVAL = 0.005
+# Number of entries to include in each section of a report
+TOP_N = 25
+# Number of frames tracemalloc records per allocation
+TRACEMALLOC_FRAMES = 1
+
+
+def get_frame_label(frame: object) -> str:
+    """Describe a stack frame as `function (file:line)`
+
+    Args:
+        frame (`FrameType`): Stack frame
+
+    Returns:
+        `str`: Label for the frame
+    """
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Sample the stack of a thread at a fixed interval"""
+
+    def __init__(self: "SamplingProfiler", thread_id: int, interval: float = SAMPLE_INTERVAL) -> None:
+        """Init SamplingProfiler
+
+        Args:
+            thread_id (`int`): ID of the thread to sample
+            interval (`float`): Seconds between samples. Defaults to `SAMPLE_INTERVAL`.
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self: "SamplingProfiler") -> None:
+        """Start sampling"""
+        self.thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self: "SamplingProfiler") -> None:
+        """Stop sampling, and wait for the sampling thread to finish"""
+        self.stopped.set()
+        self.thread.join()
+
+    def _sample(self: "SamplingProfiler") -> None:
+        """Sampling thread. Record the target thread's stack until stopped"""
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(get_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def collapsed_stacks(self: "SamplingProfiler") -> str:
+        """Format samples as collapsed stacks, one `frame;frame;frame count` line per unique stack
+
+        Returns:
+            `str`: Collapsed stacks
+        """
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def report(self: "SamplingProfiler", seconds: float, top_n: int = TOP_N) -> str:
+        """Summarize the functions that showed up most in samples
+
+        Args:
+            seconds (`float`): Length of the profiling window, for the header
+            top_n (`int`): Number of functions to list in each section. Defaults to `TOP_N`.
+
+        Returns:
+            `str`: Human readable report
+        """
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            # Count each function once per stack, even if it is recursive
+            for frame in set(frames):
+                total[frame] += count
+
+        lines = [f"{self.samples} samples over {seconds:.1f}s (every {self.interval * 1000:.0f} ms)"]
+        for title, counter in (("Top functions by own samples", own), ("Top functions by total samples", total)):
+            lines.extend(["", title, f"{'%':>6} {'samples':>8}  function"])
+            for frame, count in counter.most_common(top_n):
+                lines.append(f"{count / max(self.samples, 1) * 100:>6.1f} {count:>8}  {frame}")
+        return "\n".join(lines)
+
+
+def format_allocations(snapshot: tracemalloc.Snapshot, top_n: int = TOP_N) -> str:
+    """Summarize a tracemalloc snapshot by the lines that allocated the most memory
+
+    Args:
+        snapshot (`tracemalloc.Snapshot`): Allocation snapshot
+        top_n (`int`): Number of lines to list. Defaults to `TOP_N`.
+
+    Returns:
+        `str`: Human readable report
+    """
+    stats = snapshot.statistics("lineno")
+    lines = [f"{sum(stat.size for stat in stats) / 1024:.1f} KiB traced in {sum(stat.count for stat in stats)} blocks", "", "Top allocations by line"]
+    for stat in stats[:top_n]:
+        lines.append(f"{stat.size / 1024:>10.1f} KiB {stat.count:>8} blocks  {stat.traceback}")
+    return "\n".join(lines)
+
+
+async def profile_event_loop(seconds: float, allocations: bool = False) -> tuple[str, str]:
+    """Profile the running event loop's thread for a while
+
+    Args:
+        seconds (`float`): Length of the profiling window
+        allocations (`bool`): Whether to also take a tracemalloc allocation snapshot. Defaults to `False`.
+
+    Returns:
+        `tuple[str, str]`: Report of top functions (and allocations), collapsed stacks
+    """
+    profiler = SamplingProfiler(threading.get_ident())
+    # Only stop tracing allocations afterwards if we were the ones to start it
+    started_tracemalloc = allocations and not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    profiler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        await asyncio.to_thread(profiler.stop)
+        snapshot = tracemalloc.take_snapshot() if allocations else None
+        if started_tracemalloc:
+            tracemalloc.stop()
+
+    report = profiler.report(seconds)
+    if snapshot is not None:
+        report += "\n\n" + format_allocations(snapshot)
+    return report, profiler.collapsed_stacks()
@@ -0,0 +1,498 @@
+"""Reminder Scheduling Utils
+
+Reminders (e.g. "session at 7pm" in 3 days, or every week) are kept in a min-heap ordered by when they are due, and
+fired by a single timer task which sleeps until the earliest one is due. Scheduling and cancelling are O(log n), and
+the number of pending reminders doesn't affect how many tasks are running.
+
+Cancelled reminders are dropped from the index straight away, and skipped when they reach the top of the heap.
+
+Reminders are saved to disk (see `constants.paths.REMINDERS_PATH`) shortly after they change. Reminders which came due
+while the bot was down are fired as soon as they have been loaded, and recurring reminders then skip ahead to their next
+occurrence. A reminder fired just before a crash may be fired again after the restart, but is never lost.
+
+One-shot reminders stay pending until they have been delivered. If delivery fails (e.g. Discord is having an outage)
+they are retried with exponential backoff, unless they were cancelled while being delivered (e.g. because their channel
+is gone).
+
+Time is read through an injected clock, so scheduling can be driven with a fake clock (see `ReminderScheduler.fire_due`).
+"""
+
+import asyncio
+import heapq
+import math
+import os
+import re
+import time
+from dataclasses import asdict, dataclass, replace
+from typing import Awaitable, Callable, Iterable, NamedTuple, Optional
+
+from constants.paths import REMINDERS_PATH
+from utils.dispatch import MAX_MESSAGE_LENGTH
+from utils.json_utils import read_json_async, write_json_async
+from utils.logging import get_logger
+
+LOGGER = get_logger(os.path.basename(__file__))
+
+# Seconds in each unit of time reminders may be given in
+TIME_UNITS = {"w": 7 * 24 * 60 * 60, "d": 24 * 60 * 60, "h": 60 * 60, "m": 60, "s": 1}
+# Words for recurring reminders, and the interval they stand for
+RECURRENCE_WORDS = {"weekly": "every 1w", "daily": "every 1d", "hourly": "every 1h"}
+# Furthest ahead a reminder may be set, and the shortest interval a recurring reminder may have
+MAX_REMINDER_DELAY = 366 * 24 * 60 * 60
+MIN_REMINDER_INTERVAL = 60 * 60
+# Longest a reminder's message may be
+MAX_REMINDER_LENGTH = 500
+# Number of pending reminders each user may have
+MAX_REMINDERS_PER_USER = 25
+# Maximum number of reminders fired at once. Any more that are due are fired straight after
+MAX_FIRE_BATCH = 500
+# Longest the timer sleeps for, so it notices if the wall clock jumps (e.g. after the host was suspended)
+MAX_TIMER_SLEEP = 5 * 60
+# Seconds between writes of changed reminders to disk
+REMINDERS_SAVE_INTERVAL = 5.0
+# Reminders fired this many seconds after they were due mention when they were due
+LATE_THRESHOLD = 60
+# Seconds before retrying a one-shot reminder which failed to be delivered, doubling with each failure up to the maximum
+DELIVERY_RETRY_DELAY = 30
+MAX_DELIVERY_RETRY_DELAY = 60 * 60
+# One-shot reminders which failed to be delivered this many times are dropped
+MAX_DELIVERY_ATTEMPTS = 10
+
+# e.g. "3d", "2 hours", "30 mins"
+DURATION_PART = r"(\d+)?\s*(weeks?|w|days?|d|hours?|hrs?|h|minutes?|mins?|m|seconds?|secs?|s)(?![a-z])"
+DURATION_PART_PATTERN = re.compile(DURATION_PART)
+# e.g. "2h 30m", "1 day, 2 hours and 5 minutes"
+DURATION_PATTERN = re.compile(rf"(?:{DURATION_PART}\s*(?:,|and)?\s*)+")
+
+
+class InvalidReminderError(ValueError):
+    """Raised when a reminder can't be scheduled (e.g. its time can't be understood)"""
+
+
+@dataclass(slots=True)
+class Reminder:
+    """A pending reminder"""
+
+    id: int
+    due: float  # Wall clock time the reminder is due at
+    channel_id: int
+    guild_id: Optional[int]  # `None` outside of guilds (e.g. DMs)
+    user_id: int
+    message: str
+    interval: Optional[float] = None  # Seconds between occurrences of recurring reminders, `None` if it only fires once
+    attempts: int = 0  # Failed deliveries of a one-shot reminder so far
+
+
+class ReminderTarget(NamedTuple):
+    """Where a reminder is sent, and who it's for"""
+
+    channel_id: int
+    guild_id: Optional[int]  # `None` outside of guilds (e.g. DMs)
+    user_id: int
+
+
+Deliver = Callable[[int, list[Reminder]], Awaitable[None]]
+
+
+def parse_duration(text: str) -> float:
+    """Parse a duration, e.g. "3d", "2h 30m" or "1 week"
+
+    Args:
+        text (`str`): Duration to parse
+
+    Returns:
+        `float`: Duration in seconds
+
+    Raises:
+        `InvalidReminderError`: The text isn't a duration
+    """
+    text = text.strip().lower()
+    if not DURATION_PATTERN.fullmatch(text):
+        raise InvalidReminderError(f"I don't understand '{text}'. Try something like `in 3d`, `in 2h 30m` or `every week`")
+    # The number may be left out (e.g. "every week"), meaning one of the unit
+    return sum(int(amount or 1) * TIME_UNITS[unit[0]] for amount, unit in DURATION_PART_PATTERN.findall(text))
+
+
+def parse_reminder_time(text: str) -> tuple[float, Optional[float]]:
+    """Parse when a reminder is due, e.g. "in 3d", "every week" or "weekly"
+
+    Args:
+        text (`str`): When the reminder is due
+
+    Returns:
+        `tuple[float, Optional[float]]`: Seconds until the reminder is due, seconds between occurrences (`None` unless it recurs)
+
+    Raises:
+        `InvalidReminderError`: The time can't be understood, or is too far away (or too frequent)
+    """
+    text = RECURRENCE_WORDS.get(text.strip().lower(), text.strip().lower())
+    recurring = text.startswith("every ")
+    delay = parse_duration(text.removeprefix("every ").removeprefix("in "))
+    if delay <= 0:
+        raise InvalidReminderError("Reminders must be set for some time in the future")
+    if delay > MAX_REMINDER_DELAY:
+        raise InvalidReminderError(f"Reminders can be set at most {MAX_REMINDER_DELAY // TIME_UNITS['d']} days ahead")
+    if recurring and delay < MIN_REMINDER_INTERVAL:
+        raise InvalidReminderError(f"Recurring reminders can repeat at most every {MIN_REMINDER_INTERVAL // TIME_UNITS['h']} hour(s)")
+    return delay, delay if recurring else None
+
+
+def format_interval(seconds: float) -> str:
+    """Format the interval of a recurring reminder
+
+    Args:
+        seconds (`float`): Seconds between occurrences
+
+    Returns:
+        `str`: e.g. "1w 2d"
+    """
+    parts = []
+    for unit, unit_seconds in TIME_UNITS.items():
+        amount, seconds = divmod(seconds, unit_seconds)
+        if amount:
+            parts.append(f"{int(amount)}{unit}")
+    return " ".join(parts)
+
+
+def join_lines(lines: Iterable[str]) -> list[str]:
+    """Join lines into as few messages as possible, none longer than `MAX_MESSAGE_LENGTH`
+
+    Args:
+        lines (`Iterable[str]`): Lines to join, each at most `MAX_MESSAGE_LENGTH` characters long
+
+    Returns:
+        `list[str]`: Messages
+    """
+    messages = []
+    chunk: list[str] = []
+    length = 0
+    for line in lines:
+        if chunk and length + len(line) + 1 > MAX_MESSAGE_LENGTH:
+            messages.append("\n".join(chunk))
+            chunk, length = [], 0
+        chunk.append(line)
+        length += len(line) + 1
+    if chunk:
+        messages.append("\n".join(chunk))
+    return messages
+
+
+def format_reminder(reminder: Reminder) -> str:
+    """Format a pending reminder, for listing
+
+    Args:
+        reminder (`Reminder`): Reminder to format
+
+    Returns:
+        `str`: e.g. "#12 <t:1700000000:R>: session at 7pm (every 1w)"
+    """
+    recurrence = "" if reminder.interval is None else f" (every {format_interval(reminder.interval)})"
+    return f"`#{reminder.id}` <t:{int(reminder.due)}:R>: {reminder.message}{recurrence}"
+
+
+def format_reminder_list(reminders: list[Reminder]) -> list[str]:
+    """Format a user's pending reminders as few messages as possible
+
+    Args:
+        reminders (`list[Reminder]`): Reminders to list
+
+    Returns:
+        `list[str]`: Messages listing the reminders
+    """
+    return join_lines(["Your reminders:", *(format_reminder(reminder) for reminder in reminders)])
+
+
+def format_fired_reminders(reminders: list[Reminder], now: float) -> list[str]:
+    """Format reminders being fired in a channel as few messages as possible
+
+    Args:
+        reminders (`list[Reminder]`): Reminders being fired
+        now (`float`): Current wall clock time
+
+    Returns:
+        `list[str]`: Messages mentioning each reminder's user
+    """
+    lines = []
+    for reminder in reminders:
+        late = f" (due <t:{int(reminder.due)}:R>)" if now - reminder.due > LATE_THRESHOLD else ""
+        lines.append(f":alarm_clock: <@{reminder.user_id}> {reminder.message}{late}")
+    return join_lines(lines)
+
+
+class ReminderScheduler:
+    """Pending reminders, fired by a single timer task"""
+
+    def __init__(
+        self: "ReminderScheduler",
+        deliver: Deliver,
+        path: Optional[str] = REMINDERS_PATH,
+        clock: Callable[[], float] = time.time,
+        save_interval: float = REMINDERS_SAVE_INTERVAL,
+    ) -> None:
+        """Init ReminderScheduler
+
+        Args:
+            deliver (`Deliver`): Coroutine function sending the reminders due in a channel. If it raises, one-shot reminders are retried
+            path (`Optional[str]`): File reminders are stored in. `None` keeps them in memory only. Defaults to `REMINDERS_PATH`.
+            clock (`Callable[[], float]`): Function getting the current wall clock time. Defaults to `time.time`.
+            save_interval (`float`): Seconds between writes of changed reminders to disk. Defaults to `REMINDERS_SAVE_INTERVAL`.
+        """
+        self.deliver = deliver
+        self.path = path
+        self.clock = clock
+        self.save_interval = save_interval
+        # Pending reminders by ID
+        self.reminders: dict[int, Reminder] = {}
+        # (due, ID) of each pending reminder. Entries of cancelled reminders are skipped when they reach the top
+        self.heap: list[tuple[float, int]] = []
+        # IDs of each user's pending reminders
+        self.by_user: dict[int, set[int]] = {}
+        self.next_id = 1
+        self.dirty = False
+        # Set to wake the timer when a reminder is due sooner than the one it's waiting for
+        self.wakeup = asyncio.Event()
+        self.timer: Optional[asyncio.Task] = None
+        self.saver: Optional[asyncio.Task] = None
+
+    def __len__(self: "ReminderScheduler") -> int:
+        """Get the number of pending reminders
+
+        Returns:
+            `int`: Number of pending reminders
+        """
+        return len(self.reminders)
+
+    def add(self: "ReminderScheduler", message: str, when: str, target: ReminderTarget, limit: bool = True) -> Reminder:
+        """Schedule a reminder
+
+        Args:
+            message (`str`): What to remind the user of
+            when (`str`): When the reminder is due, e.g. "in 3d" or "every week" (see `parse_reminder_time`)
+            target (`ReminderTarget`): Channel to send the reminder to, and the user to remind
+            limit (`bool`): Whether to enforce `MAX_REMINDERS_PER_USER`. Defaults to `True`.
+
+        Returns:
+            `Reminder`: The scheduled reminder
+
+        Raises:
+            `InvalidReminderError`: The reminder can't be scheduled
+        """
+        message = message.strip()
+        if not message:
+            raise InvalidReminderError("What should I remind you of?")
+        if len(message) > MAX_REMINDER_LENGTH:
+            raise InvalidReminderError(f"Reminders can be at most {MAX_REMINDER_LENGTH} characters long")
+        if limit and len(self.by_user.get(target.user_id, ())) >= MAX_REMINDERS_PER_USER:
+            raise InvalidReminderError(f"You already have {MAX_REMINDERS_PER_USER} reminders, cancel one with `!unremind` first")
+        delay, interval = parse_reminder_time(when)
+
+        reminder = Reminder(self.next_id, self.clock() + delay, target.channel_id, target.guild_id, target.user_id, message, interval)
+        self.next_id += 1
+        self._schedule(reminder)
+        self.dirty = True
+        return reminder
+
+    def _schedule(self: "ReminderScheduler", reminder: Reminder) -> None:
+        """Add a reminder to the heap and indexes, waking the timer if it's now the next one due
+
+        Args:
+            reminder (`Reminder`): Reminder to schedule
+        """
+        self.reminders[reminder.id] = reminder
+        self.by_user.setdefault(reminder.user_id, set()).add(reminder.id)
+        heapq.heappush(self.heap, (reminder.due, reminder.id))
+        if self.heap[0][1] == reminder.id:
+            self.wakeup.set()
+
+    def cancel(self: "ReminderScheduler", reminder_id: int) -> Optional[Reminder]:
+        """Cancel a pending reminder
+
+        Args:
+            reminder_id (`int`): ID of the reminder
+
+        Returns:
+            `Optional[Reminder]`: The cancelled reminder, `None` if there is no such reminder
+        """
+        if (reminder := self.reminders.pop(reminder_id, None)) is None:
+            return None
+        self._unindex(reminder)
+        self.dirty = True
+        return reminder
+
+    def _unindex(self: "ReminderScheduler", reminder: Reminder) -> None:
+        """Remove a reminder which is no longer pending from the user index
+
+        Args:
+            reminder (`Reminder`): Reminder to remove
+        """
+        user_reminders = self.by_user[reminder.user_id]
+        user_reminders.discard(reminder.id)
+        if not user_reminders:
+            del self.by_user[reminder.user_id]
+
+    def get(self: "ReminderScheduler", reminder_id: int) -> Optional[Reminder]:
+        """Get a pending reminder
+
+        Args:
+            reminder_id (`int`): ID of the reminder
+
+        Returns:
+            `Optional[Reminder]`: The reminder, `None` if there is no such reminder
+        """
+        return self.reminders.get(reminder_id)
+
+    def list_user(self: "ReminderScheduler", user_id: int, guild_id: Optional[int]) -> list[Reminder]:
+        """Get a user's pending reminders in a guild
+
+        Args:
+            user_id (`int`): ID of the user
+            guild_id (`Optional[int]`): ID of the guild, `None` for reminders set outside of guilds
+
+        Returns:
+            `list[Reminder]`: The user's reminders, soonest first
+        """
+        reminders = (self.reminders[reminder_id] for reminder_id in self.by_user.get(user_id, ()))
+        return sorted((reminder for reminder in reminders if reminder.guild_id == guild_id), key=lambda reminder: reminder.due)
+
+    def next_due(self: "ReminderScheduler") -> Optional[float]:
+        """Get when the next pending reminder is due, dropping cancelled reminders from the top of the heap
+
+        Returns:
+            `Optional[float]`: Wall clock time the next reminder is due at, `None` if there are no reminders
+        """
+        while self.heap and self.heap[0][1] not in self.reminders:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self: "ReminderScheduler", now: float, limit: int = MAX_FIRE_BATCH) -> list[Reminder]:
+        """Take the reminders which are due off the heap. Recurring reminders are rescheduled for their next occurrence
+        (skipping occurrences missed while the bot was down). One-shot reminders stay pending until `finish_delivery` is
+        called with them
+
+        Args:
+            now (`float`): Current wall clock time
+            limit (`int`): Maximum number of reminders to take. Defaults to `MAX_FIRE_BATCH`.
+
+        Returns:
+            `list[Reminder]`: Reminders which are due, in the order they came due
+        """
+        due = []
+        while len(due) < limit and (next_due := self.next_due()) is not None and next_due <= now:
+            _, reminder_id = heapq.heappop(self.heap)
+            reminder = self.reminders[reminder_id]
+            # Recurring reminders are rescheduled below, so deliver a copy of this occurrence
+            due.append(replace(reminder))
+            if reminder.interval is not None:
+                reminder.due += reminder.interval * max(1, math.ceil((now - reminder.due) / reminder.interval))
+                heapq.heappush(self.heap, (reminder.due, reminder.id))
+        if due:
+            self.dirty = True
+        return due
+
+    async def fire_due(self: "ReminderScheduler", now: Optional[float] = None) -> int:
+        """Fire the reminders which are due, with one delivery per channel
+
+        Args:
+            now (`Optional[float]`): Current wall clock time. Defaults to the scheduler's clock.
+
+        Returns:
+            `int`: Number of reminders fired
+        """
+        now = self.clock() if now is None else now
+        due = self.pop_due(now)
+        by_channel: dict[int, list[Reminder]] = {}
+        for reminder in due:
+            by_channel.setdefault(reminder.channel_id, []).append(reminder)
+        results = await asyncio.gather(*(self.deliver(channel_id, reminders) for channel_id, reminders in by_channel.items()), return_exceptions=True)
+        for (channel_id, reminders), result in zip(by_channel.items(), results):
+            if failed := isinstance(result, BaseException):
+                LOGGER.warning("Failed to deliver %d reminder(s) to channel %d: %s", len(reminders), channel_id, result)
+            for reminder in reminders:
+                if reminder.interval is None:
+                    self.finish_delivery(reminder.id, failed, now)
+        return len(due)
+
+    def finish_delivery(self: "ReminderScheduler", reminder_id: int, failed: bool, now: float) -> None:
+        """Drop a one-shot reminder once it has been delivered, or schedule a retry (with backoff) if delivery failed.
+        Reminders cancelled while being delivered stay cancelled
+
+        Args:
+            reminder_id (`int`): ID of the reminder
+            failed (`bool`): Whether delivery failed
+            now (`float`): Current wall clock time
+        """
+        if (reminder := self.reminders.get(reminder_id)) is None:
+            return
+        self.dirty = True
+        if failed and reminder.attempts + 1 < MAX_DELIVERY_ATTEMPTS:
+            # The reminder keeps the time it was due at, so it still says how late it is once delivered
+            heapq.heappush(self.heap, (now + min(DELIVERY_RETRY_DELAY * 2**reminder.attempts, MAX_DELIVERY_RETRY_DELAY), reminder.id))
+            reminder.attempts += 1
+            return
+        if failed:
+            LOGGER.warning("Dropping reminder %d after %d failed deliveries", reminder.id, MAX_DELIVERY_ATTEMPTS)
+        del self.reminders[reminder_id]
+        self._unindex(reminder)
+
+    async def load(self: "ReminderScheduler") -> None:
+        """Load reminders saved by a previous run, if there are any. Reminders which came due in the meantime fire once the timer starts"""
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            saved = await read_json_async(self.path)
+            reminders = [Reminder(**reminder) for reminder in saved["reminders"]]
+            self.next_id = max(int(saved["next_id"]), self.next_id)
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            LOGGER.warning("Ignoring unreadable reminders in '%s': %s", self.path, error)
+            return
+        for reminder in reminders:
+            self._schedule(reminder)
+        if missed := sum(reminder.due <= self.clock() for reminder in reminders):
+            LOGGER.info("Loaded %d reminders, %d of which came due while offline", len(reminders), missed)
+
+    async def save(self: "ReminderScheduler") -> None:
+        """Write the reminders to disk, if they have changed"""
+        if self.path is None or not self.dirty:
+            return
+        self.dirty = False
+        content = {"next_id": self.next_id, "reminders": [asdict(reminder) for reminder in self.reminders.values()]}
+        await write_json_async(self.path, content, compact=True)
+
+    def start(self: "ReminderScheduler") -> None:
+        """Start the timer, and saving changed reminders periodically"""
+        self.timer = asyncio.create_task(self._run_timer())
+        self.saver = asyncio.create_task(self._run_saver())
+
+    def stop(self: "ReminderScheduler") -> None:
+        """Stop the timer and periodic saving. Call `save` afterwards to save the latest changes"""
+        for task in (self.timer, self.saver):
+            if task is not None:
+                task.cancel()
+
+    async def _run_timer(self: "ReminderScheduler") -> None:
+        """Fire reminders as they come due, until stopped"""
+        while True:
+            self.wakeup.clear()
+            if (next_due := self.next_due()) is not None and next_due <= self.clock():
+                try:
+                    await self.fire_due()
+                except Exception as error:
+                    LOGGER.exception("Failed to fire reminders", exc_info=error)
+                # Let other tasks run between batches
+                await asyncio.sleep(0)
+                continue
+            timeout = MAX_TIMER_SLEEP if next_due is None else min(next_due - self.clock(), MAX_TIMER_SLEEP)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run_saver(self: "ReminderScheduler") -> None:
+        """Save changed reminders until stopped"""
+        while True:
+            await asyncio.sleep(self.save_interval)
+            try:
+                await self.save()
+            except OSError as error:
+                self.dirty = True
+                LOGGER.warning("Failed to save reminders to '%s': %s", self.path, error)
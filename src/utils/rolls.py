@@ -0,0 +1,548 @@
+"""Roll History Utils
+
+Remembers recent rolls in each channel, for `!rolls` and `!rollstats`.
+
+Each channel keeps a ring buffer of its most recent rolls, and a ring buffer per player of their own recent rolls.
+Buffers store rolls column by column in typed `array`s rather than as objects, and have a fixed capacity, so memory per
+channel is bounded. Each player's aggregates (dice rolled, total, highest/lowest faces by die size) are updated as rolls
+enter and leave their buffer, so stats are always ready to read.
+"""
+
+import asyncio
+import base64
+import os
+import time
+from array import array
+from collections import OrderedDict
+from typing import Iterator, NamedTuple, Optional
+
+from discord import Embed
+
+from constants.paths import ROLLS_PATH
+from utils.json_utils import iter_json_object_async, write_json_async
+from utils.logging import get_logger
+
+LOGGER = get_logger(os.path.basename(__file__))
+
+# Rolls remembered per channel, for `!rolls`
+CHANNEL_HISTORY_SIZE = 200
+# Rolls remembered per player per channel, for `!rollstats`
+PLAYER_HISTORY_SIZE = 100
+# Players remembered per channel, the least recent roller is forgotten first
+MAX_PLAYERS_PER_CHANNEL = 16
+# Channels remembered, the least recently rolled in is forgotten first
+MAX_CHANNELS = 1024
+# Seconds between snapshots of the history to disk
+SNAPSHOT_INTERVAL = 5 * 60
+# Single d20s of at least this much continue a hot streak, anything less continues a cold streak
+HOT_ROLL = 11
+# Most rolls `!rolls` may list, to stay within Discord's message length limit
+MAX_LISTED_ROLLS = 25
+# Die size streaks are counted for
+D20 = 20
+
+# Columns of the ring buffers, and their array type codes. Rolls with values too large for their column aren't remembered
+CHANNEL_COLUMNS = {"time": "d", "user_id": "Q", "sides": "Q", "count": "Q", "total": "Q"}
+PLAYER_COLUMNS = {"sides": "Q", "count": "Q", "total": "Q", "highest": "Q", "lowest": "Q"}
+# Indexes into a player's aggregates for a die size
+DICE, TOTAL, HIGHEST, LOWEST = range(4)
+
+
+class Roll(NamedTuple):
+    """A roll in a channel's history"""
+
+    time: float
+    user_id: int
+    sides: int
+    count: int
+    total: int
+
+
+class PlayerRoll(NamedTuple):
+    """A roll in a player's history"""
+
+    sides: int
+    count: int
+    total: int
+    highest: int  # Number of dice showing their highest face
+    lowest: int  # Number of dice showing a 1
+
+
+class RingBuffer:
+    """Fixed capacity buffer of rows, stored column by column in typed arrays. Once full, new rows replace the oldest"""
+
+    def __init__(self: "RingBuffer", capacity: int, columns: dict[str, str]) -> None:
+        """Init RingBuffer
+
+        Args:
+            capacity (`int`): Maximum number of rows
+            columns (`dict[str, str]`): Column names, and the `array` type code of each
+        """
+        self.capacity = capacity
+        # Arrays grow up to the capacity as rows are added, then are reused
+        self.columns = {name: array(typecode) for name, typecode in columns.items()}
+        # Index of the oldest row
+        self.start = 0
+
+    def __len__(self: "RingBuffer") -> int:
+        """Get the number of rows
+
+        Returns:
+            `int`: Number of rows
+        """
+        return len(next(iter(self.columns.values())))
+
+    def push(self: "RingBuffer", row: tuple) -> Optional[tuple]:
+        """Add a row, replacing the oldest row if the buffer is full
+
+        Args:
+            row (`tuple`): Value of each column, in column order
+
+        Returns:
+            `Optional[tuple]`: Row that was replaced, if any
+
+        Raises:
+            `OverflowError`: A value doesn't fit its column's type. The buffer is left unchanged
+        """
+        # Convert every value before storing any, so a value that doesn't fit can't leave a row half written
+        values = [array(column.typecode, (value,))[0] for column, value in zip(self.columns.values(), row)]
+        if len(self) < self.capacity:
+            for column, value in zip(self.columns.values(), values):
+                column.append(value)
+            return None
+
+        replaced = tuple(column[self.start] for column in self.columns.values())
+        for column, value in zip(self.columns.values(), values):
+            column[self.start] = value
+        self.start = (self.start + 1) % self.capacity
+        return replaced
+
+    def latest(self: "RingBuffer", count: int) -> Iterator[tuple]:
+        """Iterate over the most recent rows, newest first
+
+        Args:
+            count (`int`): Maximum number of rows
+
+        Yields:
+            `tuple`: Value of each column, in column order
+        """
+        size = len(self)
+        for offset in range(1, min(count, size) + 1):
+            index = (self.start - offset) % size
+            yield tuple(column[index] for column in self.columns.values())
+
+    def nbytes(self: "RingBuffer") -> int:
+        """Get the memory used by the stored rows
+
+        Returns:
+            `int`: Bytes used by the column arrays
+        """
+        return sum(column.itemsize * len(column) for column in self.columns.values())
+
+    def to_dict(self: "RingBuffer") -> dict[str, str]:
+        """Serialize the rows, oldest first
+
+        Returns:
+            `dict[str, str]`: Base64 encoded bytes of each column
+        """
+        return {name: base64.b64encode((column[self.start :] + column[: self.start]).tobytes()).decode() for name, column in self.columns.items()}
+
+    def rows_from_dict(self: "RingBuffer", serialized: dict[str, str]) -> Iterator[tuple]:
+        """Iterate over rows serialized by `to_dict`, oldest first
+
+        Args:
+            serialized (`dict[str, str]`): Base64 encoded bytes of each column
+
+        Returns:
+            `Iterator[tuple]`: Value of each column of each row, in column order
+
+        Raises:
+            `ValueError`: The columns hold different numbers of rows, e.g. they were serialized with other type codes
+        """
+        columns = []
+        for name, column in self.columns.items():
+            values = array(column.typecode)
+            values.frombytes(base64.b64decode(serialized[name]))
+            columns.append(values)
+        if len({len(values) for values in columns}) > 1:
+            raise ValueError("Columns have different numbers of rows")
+        return zip(*columns)
+
+
+class PlayerRolls:
+    """A player's recent rolls in a channel, with running aggregates"""
+
+    def __init__(self: "PlayerRolls", capacity: int = PLAYER_HISTORY_SIZE) -> None:
+        """Init PlayerRolls
+
+        Args:
+            capacity (`int`): Rolls to remember. Defaults to `PLAYER_HISTORY_SIZE`.
+        """
+        self.rolls = RingBuffer(capacity, PLAYER_COLUMNS)
+        # Dice rolled, total, dice showing their highest face and dice showing a 1, by die size, over the remembered rolls
+        self.aggregates: dict[int, array] = {}
+        # Consecutive single d20s: positive while hot, negative while cold. Streak records cover all rolls ever made
+        self.streak = 0
+        self.best_streak = 0
+        self.worst_streak = 0
+
+    def record(self: "PlayerRolls", roll: PlayerRoll) -> None:
+        """Record a roll
+
+        Args:
+            roll (`PlayerRoll`): The roll
+
+        Raises:
+            `OverflowError`: A value of the roll is too large to remember. Nothing is recorded
+        """
+        self._push(roll)
+        if roll.sides == D20 and roll.count == 1:
+            if roll.total >= HOT_ROLL:
+                self.streak = self.streak + 1 if self.streak > 0 else 1
+                self.best_streak = max(self.best_streak, self.streak)
+            else:
+                self.streak = self.streak - 1 if self.streak < 0 else -1
+                self.worst_streak = min(self.worst_streak, self.streak)
+
+    def _push(self: "PlayerRolls", roll: PlayerRoll) -> None:
+        """Add a roll to the buffer and the aggregates, removing the roll it replaces from the aggregates
+
+        Args:
+            roll (`PlayerRoll`): The roll
+        """
+        replaced = self.rolls.push(roll)
+        self._add(roll, 1)
+        if replaced is not None:
+            self._add(PlayerRoll(*replaced), -1)
+
+    def _add(self: "PlayerRolls", roll: PlayerRoll, sign: int) -> None:
+        """Add a roll to (or remove it from) the aggregates
+
+        Args:
+            roll (`PlayerRoll`): The roll
+            sign (`int`): 1 to add the roll, -1 to remove it
+        """
+        aggregate = self.aggregates.setdefault(roll.sides, array("q", [0, 0, 0, 0]))
+        aggregate[DICE] += sign * roll.count
+        aggregate[TOTAL] += sign * roll.total
+        aggregate[HIGHEST] += sign * roll.highest
+        aggregate[LOWEST] += sign * roll.lowest
+        if not aggregate[DICE]:
+            del self.aggregates[roll.sides]
+
+    def stats(self: "PlayerRolls", sides: int) -> Optional[dict[str, float]]:
+        """Get stats of the remembered rolls of a die size
+
+        Args:
+            sides (`int`): Sides of the die
+
+        Returns:
+            `Optional[dict[str, float]]`: Dice rolled, average, and rates of highest and lowest faces. `None` if no such dice were rolled
+        """
+        if (aggregate := self.aggregates.get(sides)) is None:
+            return None
+        dice = aggregate[DICE]
+        return {"dice": dice, "average": aggregate[TOTAL] / dice, "highest_rate": aggregate[HIGHEST] / dice, "lowest_rate": aggregate[LOWEST] / dice}
+
+    def to_dict(self: "PlayerRolls") -> dict:
+        """Serialize the player's rolls
+
+        Returns:
+            `dict`: Serialized rolls and streaks
+        """
+        return {"rolls": self.rolls.to_dict(), "streak": self.streak, "best_streak": self.best_streak, "worst_streak": self.worst_streak}
+
+    def load(self: "PlayerRolls", serialized: dict) -> None:
+        """Restore rolls serialized by `to_dict`
+
+        Args:
+            serialized (`dict`): Serialized rolls and streaks
+        """
+        for row in self.rolls.rows_from_dict(serialized["rolls"]):
+            self._push(PlayerRoll(*row))
+        self.streak = serialized["streak"]
+        self.best_streak = serialized["best_streak"]
+        self.worst_streak = serialized["worst_streak"]
+
+
+class ChannelRolls:
+    """Recent rolls in a channel"""
+
+    def __init__(self: "ChannelRolls", capacity: int = CHANNEL_HISTORY_SIZE, max_players: int = MAX_PLAYERS_PER_CHANNEL) -> None:
+        """Init ChannelRolls
+
+        Args:
+            capacity (`int`): Rolls to remember. Defaults to `CHANNEL_HISTORY_SIZE`.
+            max_players (`int`): Players to remember. Defaults to `MAX_PLAYERS_PER_CHANNEL`.
+        """
+        self.rolls = RingBuffer(capacity, CHANNEL_COLUMNS)
+        self.max_players = max_players
+        # Ordered from least to most recent roller
+        self.players: OrderedDict[int, PlayerRolls] = OrderedDict()
+
+    def get_player(self: "ChannelRolls", user_id: int) -> PlayerRolls:
+        """Get a player's rolls, making room for them if they're new
+
+        Args:
+            user_id (`int`): ID of the player
+
+        Returns:
+            `PlayerRolls`: Player's rolls
+        """
+        if (player := self.players.get(user_id)) is None:
+            player = self.players[user_id] = PlayerRolls()
+            while len(self.players) > self.max_players:
+                self.players.popitem(last=False)
+        self.players.move_to_end(user_id)
+        return player
+
+    def nbytes(self: "ChannelRolls") -> int:
+        """Get the (approximate) memory used by the channel's rolls
+
+        Returns:
+            `int`: Bytes used by ring buffers
+        """
+        return self.rolls.nbytes() + sum(player.rolls.nbytes() for player in self.players.values())
+
+
+class RollHistory:
+    """Recent rolls in every channel, periodically snapshotted to disk"""
+
+    def __init__(self: "RollHistory", path: Optional[str] = ROLLS_PATH, max_channels: int = MAX_CHANNELS, interval: float = SNAPSHOT_INTERVAL) -> None:
+        """Init RollHistory
+
+        Args:
+            path (`Optional[str]`): File snapshots are stored in. `None` keeps history in memory only. Defaults to `ROLLS_PATH`.
+            max_channels (`int`): Channels to remember. Defaults to `MAX_CHANNELS`.
+            interval (`float`): Seconds between snapshots. Defaults to `SNAPSHOT_INTERVAL`.
+        """
+        self.path = path
+        self.max_channels = max_channels
+        self.interval = interval
+        # Ordered from least to most recently rolled in
+        self.channels: OrderedDict[int, ChannelRolls] = OrderedDict()
+        self.dirty = False
+        self.task: Optional[asyncio.Task] = None
+
+    def record(self: "RollHistory", channel_id: int, user_id: int, roll: PlayerRoll) -> None:
+        """Record a roll. Rolls too large to remember (e.g. a die with more sides than fit in 64 bits) are skipped
+
+        Args:
+            channel_id (`int`): ID of the channel rolled in
+            user_id (`int`): ID of the player who rolled
+            roll (`PlayerRoll`): The roll
+        """
+        channel = self._get_channel(channel_id)
+        try:
+            # The player's columns cover the channel's, so once the player's roll is stored the channel's fits too
+            channel.get_player(user_id).record(roll)
+        except OverflowError:
+            LOGGER.debug("Not remembering a roll too large to store: %s", roll)
+            return
+        channel.rolls.push((time.time(), user_id, roll.sides, roll.count, roll.total))
+        self.dirty = True
+
+    def _get_channel(self: "RollHistory", channel_id: int) -> ChannelRolls:
+        """Get a channel's rolls, making room for it if it's new
+
+        Args:
+            channel_id (`int`): ID of the channel
+
+        Returns:
+            `ChannelRolls`: Channel's rolls
+        """
+        if (channel := self.channels.get(channel_id)) is None:
+            channel = self.channels[channel_id] = ChannelRolls()
+            while len(self.channels) > self.max_channels:
+                self.channels.popitem(last=False)
+        self.channels.move_to_end(channel_id)
+        return channel
+
+    def latest(self: "RollHistory", channel_id: int, count: int) -> list[Roll]:
+        """Get the most recent rolls in a channel
+
+        Args:
+            channel_id (`int`): ID of the channel
+            count (`int`): Maximum number of rolls
+
+        Returns:
+            `list[Roll]`: Rolls, newest first
+        """
+        if (channel := self.channels.get(channel_id)) is None:
+            return []
+        return [Roll(*row) for row in channel.rolls.latest(count)]
+
+    def players(self: "RollHistory", channel_id: int) -> dict[int, PlayerRolls]:
+        """Get the rolls of each player remembered in a channel
+
+        Args:
+            channel_id (`int`): ID of the channel
+
+        Returns:
+            `dict[int, PlayerRolls]`: Rolls by player ID, most recent roller first
+        """
+        if (channel := self.channels.get(channel_id)) is None:
+            return {}
+        return dict(reversed(channel.players.items()))
+
+    def shrink(self: "RollHistory", fraction: float) -> int:
+        """Forget the least recently rolled in channels until at most a fraction of the memory used remains
+
+        Args:
+            fraction (`float`): Fraction of the current size to shrink to
+
+        Returns:
+            `int`: Estimated bytes freed
+        """
+        size = self.nbytes()
+        target = size * fraction
+        freed = 0
+        while self.channels and size - freed > target:
+            _, channel = self.channels.popitem(last=False)
+            freed += channel.nbytes()
+        return freed
+
+    def nbytes(self: "RollHistory") -> int:
+        """Get the (approximate) memory used by remembered rolls
+
+        Returns:
+            `int`: Bytes used by ring buffers
+        """
+        return sum(channel.nbytes() for channel in self.channels.values())
+
+    def to_dict(self: "RollHistory") -> dict:
+        """Serialize every channel's rolls
+
+        Returns:
+            `dict`: Serialized rolls
+        """
+        return {
+            str(channel_id): {
+                "rolls": channel.rolls.to_dict(),
+                "players": {str(user_id): player.to_dict() for user_id, player in channel.players.items()},
+            }
+            for channel_id, channel in self.channels.items()
+        }
+
+    async def load(self: "RollHistory") -> None:
+        """Load the last snapshot, if there is one"""
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            # Snapshots can get large, so load them a channel at a time
+            async for channel_id, serialized in iter_json_object_async(self.path):
+                channel = self._get_channel(int(channel_id))
+                for row in channel.rolls.rows_from_dict(serialized["rolls"]):
+                    channel.rolls.push(row)
+                for user_id, player in serialized["players"].items():
+                    channel.get_player(int(user_id)).load(player)
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            LOGGER.warning("Ignoring unreadable roll history in '%s': %s", self.path, error)
+            self.channels.clear()
+
+    async def save(self: "RollHistory") -> None:
+        """Snapshot every channel's rolls to disk, if there have been new rolls"""
+        if self.path is None or not self.dirty:
+            return
+        self.dirty = False
+        await write_json_async(self.path, self.to_dict(), compact=True)
+
+    def start(self: "RollHistory") -> None:
+        """Start snapshotting periodically"""
+        self.task = asyncio.create_task(self._run())
+
+    def stop(self: "RollHistory") -> None:
+        """Stop snapshotting periodically. Call `save` afterwards to save the latest rolls"""
+        if self.task is not None:
+            self.task.cancel()
+
+    async def _run(self: "RollHistory") -> None:
+        """Snapshot until stopped"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.save()
+            except OSError as error:
+                LOGGER.warning("Failed to save roll history to '%s': %s", self.path, error)
+
+
+def describe_streak(streak: int) -> str:
+    """Describe a d20 streak
+
+    Args:
+        streak (`int`): Consecutive d20s, positive if hot, negative if cold
+
+    Returns:
+        `str`: e.g. '3 hot'
+    """
+    if streak > 0:
+        return f"{streak} hot"
+    if streak < 0:
+        return f"{-streak} cold"
+    return "none"
+
+
+def describe_stats(sides: int, stats: dict[str, float]) -> str:
+    """Describe stats of a die size
+
+    Args:
+        sides (`int`): Sides of the die
+        stats (`dict[str, float]`): Stats, as returned by `PlayerRolls.stats`
+
+    Returns:
+        `str`: e.g. '42 dice | avg 10.8 | nat 20 5.0% | nat 1 4.8%'
+    """
+    return f"{stats['dice']} dice | avg {stats['average']:.1f} | nat {sides} {stats['highest_rate']:.1%} | nat 1 {stats['lowest_rate']:.1%}"
+
+
+def format_latest_rolls(rolls: list[Roll]) -> str:
+    """Format recent rolls as a message
+
+    Args:
+        rolls (`list[Roll]`): Rolls, newest first
+
+    Returns:
+        `str`: One line per roll
+    """
+    if not rolls:
+        return "No rolls yet in this channel."
+    lines = [f"<@{roll.user_id}> rolled {roll.count}d{roll.sides}: **{roll.total}** <t:{int(roll.time)}:R>" for roll in rolls]
+    return "\n".join([f"Last {len(rolls)} rolls:", *lines])
+
+
+def get_player_stats_embed(name: str, player: PlayerRolls) -> Embed:
+    """Create an embed of a player's roll stats
+
+    Args:
+        name (`str`): Name of the player
+        player (`PlayerRolls`): Player's rolls
+
+    Returns:
+        `Embed`: Discord embed with stats for each die size
+    """
+    embed = Embed(title=f"Roll stats for {name}", description=f"Last {len(player.rolls)} rolls in this channel")
+    for sides in sorted(player.aggregates):
+        embed.add_field(name=f"d{sides}", value=describe_stats(sides, player.stats(sides)), inline=False)
+    embed.add_field(
+        name="d20 streaks",
+        value=f"Current: {describe_streak(player.streak)} | Best: {describe_streak(player.best_streak)} | Worst: {describe_streak(player.worst_streak)}",
+        inline=False,
+    )
+    return embed
+
+
+def get_channel_stats_embed(players: dict[int, PlayerRolls]) -> Embed:
+    """Create an embed of d20 stats for every player in a channel
+
+    Args:
+        players (`dict[int, PlayerRolls]`): Rolls by player ID
+
+    Returns:
+        `Embed`: Discord embed with a line per player
+    """
+    lines = []
+    for user_id, player in players.items():
+        stats = player.stats(20)
+        summary = describe_stats(20, stats) if stats else "no d20s"
+        lines.append(f"<@{user_id}>: {summary} | streak {describe_streak(player.streak)}")
+    return Embed(title="d20 stats", description="\n".join(lines) if lines else "No rolls yet in this channel.")
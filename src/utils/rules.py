@@ -1,19 +1,20 @@
 """Rule Lookup Utils"""
 
-from typing import Optional
+from typing import Mapping, Optional
 
 from discord import Embed
 
 from constants.paths import RULES_PATH
+from utils.datasets import get_layer_paths, load_merged_dataset, load_rendered
 from utils.embed import dict_to_embed
-from utils.json_utils import read_json_async
+from utils.fuzzy import get_suggestions, load_name_indexes
 
 
-def get_known_rules(rulebook: dict) -> Embed:
+def get_known_rules(rulebook: Mapping) -> Embed:
     """Get list of known rules
 
     Args:
-        rulebook (`dict`): Dict containing rules
+        rulebook (`Mapping`): Mapping containing rules
 
     Returns:
         `Embed`: Discord embed representing known rules
@@ -24,23 +25,37 @@ def get_known_rules(rulebook: dict) -> Embed:
     return dict_to_embed(title, content)
 
 
-async def get_rule(rule: str = None) -> Optional[Embed]:
+async def get_rule(rule: str = None, guild_id: Optional[int] = None) -> Optional[Embed]:
     """Return entry of the specified rule
     If no rule provided, return list of known rules
 
     Args:
         rule (`str`): The rule item to list. Defaults to `None`.
+        guild_id (`Optional[int]`): ID of the guild, whose house rules take precedence. Defaults to `None`.
 
     Returns:
         `Optional[Embed]`: Discord embed representing rule content
     """
-    rulebook = await read_json_async(RULES_PATH)
-
     # If no item specified, return list of known rules
     if not rule:
-        return get_known_rules(rulebook)
+        return get_known_rules(await load_merged_dataset(RULES_PATH, guild_id))
 
-    # If an entry exists for this rule, create an embed
+    # If an entry exists for this rule, create an embed. House rules take precedence, and embeds are rendered once per version of each file
     rule = rule.title()
-    if entry := rulebook.get(rule):
-        return dict_to_embed(rule, entry)
+    for path in get_layer_paths(RULES_PATH, guild_id):
+        if embed := await load_rendered(path, rule, lambda rulebook: dict_to_embed(rule, rulebook[rule]) if rulebook.get(rule) else None):
+            return embed
+    return None
+
+
+async def suggest_rules(rule: str, guild_id: Optional[int] = None) -> list[str]:
+    """Get the known rules closest to a rule that couldn't be found
+
+    Args:
+        rule (`str`): Name of the rule that couldn't be found
+        guild_id (`Optional[int]`): ID of the guild, whose house rules are suggested too. Defaults to `None`.
+
+    Returns:
+        `list[str]`: Closest rule names, closest first
+    """
+    return get_suggestions(rule, await load_name_indexes(RULES_PATH, guild_id))
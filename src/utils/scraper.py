@@ -0,0 +1,270 @@
+"""Declarative Scraping Utils
+
+What to extract from a kind of page (e.g. a D&D Beyond spell page) is declared as a `PageSpec`: a title and a list of
+fields, each found by a simple selector ('tag.class', or '.class' for any tag). Specs are compiled once into a table of
+the fields each CSS class may hold, so a page is extracted in a single pass over its elements rather than one search of
+the whole page per field.
+
+Extraction only needs the page's HTML, so specs can be checked against saved copies of pages.
+"""
+
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterator, Optional, Union
+
+from bs4 import BeautifulSoup, NavigableString, Tag
+
+HTML_PARSER = "html.parser"
+
+# Ways of turning an element into text
+FIRST_LINE = "first_line"  # The first piece of text, e.g. '1st' of '1st (Evocation)'
+TEXT = "text"  # All text, on one line
+PARAGRAPHS = "paragraphs"  # All text, with a blank line between blocks
+# Elements starting a new block of text. Text in any other element (e.g. <em>) stays on the line it's in
+BLOCK_TAGS = {"p", "div", "li", "ul", "ol", "h1", "h2", "h3", "h4", "h5", "h6", "table", "tr", "blockquote", "section", "br"}
+
+# Embed fields and descriptions are limited to 1024 and 4096 characters
+MAX_FIELD_LENGTH = 1024
+MAX_DESCRIPTION_LENGTH = 4096
+# Fields named this become the embed's description (see `utils.embed.dict_to_embed`)
+DESCRIPTION = "Description"
+
+
+@dataclass(frozen=True)
+class Field:
+    """A single value on a page, e.g. a spell's casting time"""
+
+    name: str  # Name of the field, e.g. 'Casting Time'
+    selector: str  # Element holding the field, e.g. 'div.ddb-statblock-item-casting-time'. The first match is used
+    value: Optional[str] = None  # Element within it holding the value, e.g. '.ddb-statblock-item-value'. Defaults to the element itself
+    extract: str = FIRST_LINE
+
+
+@dataclass(frozen=True)
+class LabeledFields:
+    """Repeated label/value elements, each becoming a field named by its label, e.g. a monster's 'Armor Class', 'Hit Points', ..."""
+
+    selector: str  # Element holding each label and value, e.g. 'div.mon-stat-block__attribute'
+    label: str  # Element within it holding the label
+    value: str  # Element within it holding the value
+    extract: str = TEXT
+    default_label: Optional[str] = None  # Label of elements which don't have one. Those are skipped if `None`
+    combine: Optional[str] = None  # Name of a single field to list every label and value in (e.g. 'Ability Scores'), rather than a field each
+
+
+@dataclass(frozen=True)
+class PageSpec:
+    """What to extract from a kind of page"""
+
+    kind: str  # e.g. 'spell'
+    title: str  # Element holding the page's title. Pages without one aren't of this kind
+    fields: tuple[Union[Field, LabeledFields], ...]
+
+
+@dataclass(frozen=True)
+class Selector:
+    """A compiled 'tag.class' selector"""
+
+    tag: Optional[str]  # `None` matches any tag
+    css_class: str
+
+    def matches(self: "Selector", element: Tag) -> bool:
+        """Check if an element matches the selector
+
+        Args:
+            element (`Tag`): Element to check
+
+        Returns:
+            `bool`: True if the element matches
+        """
+        return (self.tag is None or element.name == self.tag) and self.css_class in element.get("class", ())
+
+    def find_in(self: "Selector", element: Tag) -> Optional[Tag]:
+        """Find the first element matching the selector within an element
+
+        Args:
+            element (`Tag`): Element to search
+
+        Returns:
+            `Optional[Tag]`: Matching element, `None` if there isn't one
+        """
+        return element.find(self.tag or True, class_=self.css_class)
+
+
+@lru_cache(maxsize=None)
+def compile_selector(selector: str) -> Selector:
+    """Compile a 'tag.class' or '.class' selector
+
+    Args:
+        selector (`str`): Selector to compile
+
+    Returns:
+        `Selector`: Compiled selector
+
+    Raises:
+        `ValueError`: The selector isn't of a supported form
+    """
+    tag, separator, css_class = selector.partition(".")
+    if not separator or not css_class or "." in css_class or " " in selector:
+        raise ValueError(f"Unsupported selector '{selector}', expected 'tag.class' or '.class'")
+    return Selector(tag or None, css_class)
+
+
+@lru_cache(maxsize=None)
+def compile_spec(spec: PageSpec) -> dict[str, list[tuple[Selector, int]]]:
+    """Compile a page spec into a table of the selectors (and index of the field, -1 for the title) each CSS class may match
+
+    Args:
+        spec (`PageSpec`): Spec to compile
+
+    Returns:
+        `dict[str, list[tuple[Selector, int]]]`: Selectors and field indexes by CSS class
+    """
+    table: dict[str, list[tuple[Selector, int]]] = {}
+    for index, selector in [(-1, spec.title), *enumerate(field.selector for field in spec.fields)]:
+        compiled = compile_selector(selector)
+        table.setdefault(compiled.css_class, []).append((compiled, index))
+    return table
+
+
+def get_blocks(element: Tag, blocks: list[str], line: list[str]) -> None:
+    """Collect the blocks of text of an element, e.g. its paragraphs
+
+    Args:
+        element (`Tag`): Element to collect the text of
+        blocks (`list[str]`): Blocks collected so far, appended to
+        line (`list[str]`): Pieces of text of the current block, emptied into `blocks` when a block ends
+    """
+    for child in element.children:
+        if isinstance(child, Tag):
+            block = child.name in BLOCK_TAGS
+            if block:
+                end_block(blocks, line)
+            get_blocks(child, blocks, line)
+            if block:
+                end_block(blocks, line)
+        # Skip comments, doctypes, etc.
+        elif type(child) is NavigableString:
+            line.append(child)
+
+
+def end_block(blocks: list[str], line: list[str]) -> None:
+    """End the current block of text, if it has any text
+
+    Args:
+        blocks (`list[str]`): Blocks collected so far, appended to
+        line (`list[str]`): Pieces of text of the current block, emptied
+    """
+    if text := " ".join("".join(line).split()):
+        blocks.append(text)
+    line.clear()
+
+
+def get_text(element: Tag, extract: str) -> str:
+    """Get the text of an element
+
+    Args:
+        element (`Tag`): Element to get the text of
+        extract (`str`): How to turn the element into text: `FIRST_LINE`, `TEXT` or `PARAGRAPHS`
+
+    Returns:
+        `str`: Text of the element
+    """
+    if extract == FIRST_LINE:
+        return next(iter(element.stripped_strings), "")
+    if extract == PARAGRAPHS:
+        blocks: list[str] = []
+        line: list[str] = []
+        get_blocks(element, blocks, line)
+        end_block(blocks, line)
+        return "\n\n".join(blocks)
+    return element.get_text(" ", True)
+
+
+def truncate(name: str, value: str) -> str:
+    """Shorten a field's value to fit in an embed
+
+    Args:
+        name (`str`): Name of the field
+        value (`str`): Value of the field
+
+    Returns:
+        `str`: Value, shortened (ending with '…') if it's too long
+    """
+    max_length = MAX_DESCRIPTION_LENGTH if name == DESCRIPTION else MAX_FIELD_LENGTH
+    return value if len(value) <= max_length else value[: max_length - 1] + "…"
+
+
+def find_matches(parsed: BeautifulSoup, spec: PageSpec) -> Iterator[tuple[Tag, int]]:
+    """Find the elements matching a spec's title or fields, in a single pass over the page's elements
+
+    Args:
+        parsed (`BeautifulSoup`): Parsed HTML of the page
+        spec (`PageSpec`): What to extract
+
+    Yields:
+        `tuple[Tag, int]`: Matching element, and the index of the field it matches (-1 for the title), in page order
+    """
+    table = compile_spec(spec)
+    for element in parsed.find_all(True):
+        for css_class in element.get("class", ()):
+            for selector, index in table.get(css_class, ()):
+                if selector.matches(element):
+                    yield element, index
+
+
+def extract_entry(field: Union[Field, LabeledFields], element: Tag) -> Optional[tuple[str, str]]:
+    """Extract the name and value of a field from an element matching its selector
+
+    Args:
+        field (`Union[Field, LabeledFields]`): Field to extract
+        element (`Tag`): Element matching the field's selector
+
+    Returns:
+        `Optional[tuple[str, str]]`: Name and value of the field, `None` if the element doesn't hold one
+    """
+    if isinstance(field, Field):
+        value = element if field.value is None else compile_selector(field.value).find_in(element)
+        return None if value is None else (field.name, get_text(value, field.extract))
+    if (value := compile_selector(field.value).find_in(element)) is None:
+        return None
+    label = compile_selector(field.label).find_in(element)
+    if (name := get_text(label, TEXT) if label is not None else field.default_label) is None:
+        return None
+    return name, get_text(value, field.extract)
+
+
+def extract_page(page: Union[bytes, str, BeautifulSoup], spec: PageSpec) -> Optional[tuple[str, dict[str, str]]]:
+    """Extract a page's title and fields, in a single pass over its elements
+
+    Args:
+        page (`Union[bytes, str, BeautifulSoup]`): Raw or parsed HTML of the page
+        spec (`PageSpec`): What to extract
+
+    Returns:
+        `Optional[tuple[str, dict[str, str]]]`: Title, fields in the order of the spec (fields not on the page are left out).
+            `None` if the page has no title, i.e. isn't of the spec's kind
+    """
+    parsed = page if isinstance(page, BeautifulSoup) else BeautifulSoup(page, HTML_PARSER)
+
+    title = None
+    # Values of each field, by field index. Labeled fields may have several
+    values: dict[int, list[tuple[str, str]]] = {}
+    for element, index in find_matches(parsed, spec):
+        if index == -1:
+            title = get_text(element, TEXT) if title is None else title
+        # Only the first match of a field is used
+        elif not (isinstance(spec.fields[index], Field) and index in values) and (entry := extract_entry(spec.fields[index], element)) is not None:
+            values.setdefault(index, []).append(entry)
+    if title is None:
+        return None
+
+    fields = {}
+    for index, field in enumerate(spec.fields):
+        entries = values.get(index, [])
+        if isinstance(field, LabeledFields) and field.combine is not None and entries:
+            entries = [(field.combine, " | ".join(f"{name} {value}" for name, value in entries))]
+        for name, value in entries:
+            if value:
+                fields[name] = truncate(name, value)
+    return title, fields
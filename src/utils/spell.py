@@ -1,140 +1,253 @@
 """Spell Scraping Utils"""
 
-from typing import Union
-from urllib.error import HTTPError
+import asyncio
+import os
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import NamedTuple, Optional, Union
 
-from bs4 import BeautifulSoup
 from discord import Embed
 
 from constants.paths import SPELLS_PATH
-from utils.ddb import SPELL_URL, get_ddb_page, get_ddb_statblock_value
+from utils.datasets import get_layer_paths, load_name_map, load_rendered
+from utils.ddb import get_ddb_entry, is_ddb_entry_cached
 from utils.embed import dict_to_embed
-from utils.json_utils import read_json_async
-
-# Dict containing categories of spell information.
-# Keys are the pretty title to be used in the Embed,
-# values are the name of the HTML object to scrape
-SPELL_ATTRIBUTES = {
-    "Level": "level",
-    "Casting Time": "casting-time",
-    "Range": "range-area",
-    "Components": "components",
-    "Duration": "duration",
-    "School": "school",
-    "Attack/Save": "attack-save",
-    "Damage Type": "damage-effect",
-}
+from utils.executor import ExecutorService
+from utils.fuzzy import format_suggestions, get_suggestions, load_name_indexes
+from utils.limits import ExpensiveWorkGate
+from utils.logging import get_logger
+from utils.spellbook import read_spellbook_async
+
+LOGGER = get_logger(os.path.basename(__file__))
+
 LOCAL_SOURCES = ["all", "local"]
 ONLINE_SOURCES = ["all", "web"]
 VALID_SOURCES = ["all", "local", "web"]
 MISSING_SPELL_TEXT = "**Error:** Cannot find spell '{spell_name}'"
 
+# Most spells that can be looked up with a single command
+MAX_SPELLS_PER_LOOKUP = 5
+# Seconds a multi-spell lookup waits for D&D Beyond. Lookups still running after that finish in the background (so the
+# spells are cached for next time, still holding their batch's slot of the expensive work gate) and are reported as slow
+SPELL_BATCH_WEB_DEADLINE = 8.0
+# Web lookup batches left running after their deadline, referenced here so they aren't garbage collected
+BACKGROUND_LOOKUPS: set[asyncio.Task] = set()
+
+
+class SpellLookup(NamedTuple):
+    """Result of looking up one of several spells"""
+
+    name: str  # Name the spell was looked up by
+    response: Union[str, Embed]  # The spell as a Discord embed, or an error message
+    from_web: bool  # Whether the response came from D&D Beyond
+
 
-def get_spell_name(parsed_html: BeautifulSoup) -> str:
-    """Extract teh spell name from the page title
+@dataclass(frozen=True)
+class WebLookupSettings:
+    """How spell lookups check D&D Beyond"""
+
+    executor: Optional[ExecutorService] = None  # Executor service to parse web pages in, `None` for a thread
+    gate: Optional[ExpensiveWorkGate] = None  # Gate to hold a slot of while checking D&D Beyond, `None` for no limit
+    deadline: float = SPELL_BATCH_WEB_DEADLINE  # Seconds multi-spell lookups wait for D&D Beyond
+
+
+async def get_spell_from_web(spell_name: str, executor: Optional[ExecutorService] = None) -> Optional[Embed]:
+    """Get spell info from D&D Beyond (https://www.dndbeyond.com/spells/{spell-name}), through the D&D Beyond cache
 
     Args:
-        parsed_html (`BeautifulSoup`): Spell page parsed HTML
+        spell_name (`str`): Name of the spell to lookup
+        executor (`Optional[ExecutorService]`): Executor service to parse the page in. Defaults to `None` (a thread).
 
     Returns:
-        `str`: Spell name
+        `Optional[Embed]`: Discord embed containing spell info, `None` if D&D Beyond doesn't have the spell
     """
-    # Get the name of the spell from the page title
-    return parsed_html.find("h1", class_="page-title").text
+    return await get_ddb_entry("spell", spell_name, executor)
 
 
-def get_spell_description(parsed_html: BeautifulSoup) -> str:
-    """Extract the spell description from the page content
+def is_web_spell_cached(spell_name: str) -> bool:
+    """Check if a spell's D&D Beyond lookup is cached
 
     Args:
-        parsed_html (`BeautifulSoup`): Spell page parsed HTML
+        spell_name (`str`): Name of the spell
 
     Returns:
-        `str`: Spell description
+        `bool`: True if a fresh result (including "not found") is cached
     """
-    # Get the spell description from the page content
-    return parsed_html.find("div", class_="more-info-content").get_text("\n\n", True)
+    return is_ddb_entry_cached("spell", spell_name)
 
 
-def get_spell_from_ddb(spell_name: str) -> Embed:
-    """Scrape spell info from DnD Beyond (https://www.dndbeyond.com/spells/{spell-name})
+async def get_spell_from_file(spell_name: str, guild_id: Optional[int] = None) -> Optional[Embed]:
+    """Get spell info from local JSON file
 
     Args:
         spell_name (`str`): Name of the spell to lookup
+        guild_id (`Optional[int]`): ID of the guild, whose homebrew spells take precedence. Defaults to `None`.
 
     Returns:
-        `Embed`: Discord embed containing spell info
+        `Optional[Embed]`: Discord embed containing spell info, `None` if the spell isn't known
     """
-    spell_name = spell_name.replace(" ", "-")
-    url = SPELL_URL.format(spell_name=spell_name)
-    parsed_html = get_ddb_page(url)
+    # Search the guild's homebrew spells, then the global spell file. Names match case-insensitively,
+    # and embeds are rendered once per version of each spell
+    for path in get_layer_paths(SPELLS_PATH, guild_id):
+        names = await load_name_map(path, read_spellbook_async)
+        if names is None or (name := names.get(spell_name.lower())) is None:
+            continue
+        return await load_rendered(path, name, lambda known_spells: dict_to_embed(name, known_spells[name]), read_spellbook_async)
+    return None
 
-    # Extract basic spell information
-    spell_name = get_spell_name(parsed_html)
-    spell_description = get_spell_description(parsed_html)
 
-    # Create a dict to store spell information. Will be turned into an Embed later
-    spell_dict = {"description": spell_description}
+async def get_missing_spell_text(spell_name: str, guild_id: Optional[int] = None) -> str:
+    """Get the error message for a spell that couldn't be found, suggesting the closest known spells
 
-    # Scrape each spell attribute and add to the dictionary
-    for label, item in SPELL_ATTRIBUTES.items():
-        spell_dict[label] = get_ddb_statblock_value(item, parsed_html)
+    Args:
+        spell_name (`str`): Name of the spell that couldn't be found
+        guild_id (`Optional[int]`): ID of the guild, whose homebrew spells are suggested too. Defaults to `None`.
 
-    # Add ddb page url to the dictonary
-    spell_dict["Source"] = url
+    Returns:
+        `str`: Error message
+    """
+    suggestions = get_suggestions(spell_name, await load_name_indexes(SPELLS_PATH, guild_id, read_spellbook_async))
+    return MISSING_SPELL_TEXT.format(spell_name=spell_name) + format_suggestions(suggestions)
 
-    return dict_to_embed(spell_name, spell_dict)
 
+def parse_spell_query(query: str) -> tuple[list[str], str]:
+    """Split a spell lookup into the names of the spells and the source to check, e.g. 'fireball, misty step web'
 
-async def get_spell_from_file(spell_name: str) -> Embed:
-    """Get spell info from local JSON file
+    Args:
+        query (`str`): Comma separated spell names, optionally followed by a source ('web' | 'local' | 'all')
+
+    Returns:
+        `tuple[list[str], str]`: Spell names (without duplicates), source
+    """
+    words = query.split()
+    source = "all"
+    # A single word is always a spell name (e.g. 'web')
+    if len(words) > 1 and words[-1].strip("\"'").lower() in VALID_SOURCES:
+        source = words.pop().strip("\"'").lower()
+    names = (name.strip().strip("\"'").strip() for name in " ".join(words).split(","))
+    return list(dict.fromkeys(name for name in names if name)), source
+
+
+def forget_background_lookup(task: asyncio.Task) -> None:
+    """Done callback of web lookup batches left running after their deadline
 
     Args:
-        spell_name (`str`): Name of the spell to lookup
+        task (`asyncio.Task`): The finished batch
+    """
+    BACKGROUND_LOOKUPS.discard(task)
+    if not task.cancelled() and (error := task.exception()) is not None:
+        LOGGER.warning("Background spell lookup failed: %s", error)
+
+
+async def get_spells_from_web(spell_names: list[str], lookups: dict[str, asyncio.Task], settings: WebLookupSettings) -> None:
+    """Look up spells on D&D Beyond concurrently, holding a slot of the gate until every lookup has finished, so lookups
+    outliving their command still count against the gate
+
+    Args:
+        spell_names (`list[str]`): Names of the spells to lookup
+        lookups (`dict[str, asyncio.Task]`): Filled with the lookup of each spell once a slot has been acquired
+        settings (`WebLookupSettings`): How to check D&D Beyond
+    """
+    # The whole batch counts as one piece of expensive work
+    async with settings.gate.slot() if settings.gate is not None else nullcontext():
+        lookups.update({spell_name: asyncio.create_task(get_spell_from_web(spell_name, settings.executor)) for spell_name in spell_names})
+        await asyncio.wait(lookups.values())
+
+
+def get_web_lookup_result(spell_name: str, lookup: Optional[asyncio.Task]) -> Optional[SpellLookup]:
+    """Get the result of a spell's lookup on D&D Beyond, once its batch's deadline has passed
+
+    Args:
+        spell_name (`str`): Name of the spell
+        lookup (`Optional[asyncio.Task]`): The lookup, `None` if its batch is still waiting for a slot of the gate
 
     Returns:
-        `Embed`: Discord embed containing spell info
+        `Optional[SpellLookup]`: The spell, or an error message if the lookup failed or is still running. `None` if D&D Beyond doesn't have the spell
     """
-    # Search local spell file for information
-    known_spells = await read_json_async(SPELLS_PATH)
+    if lookup is None or not lookup.done():
+        return SpellLookup(spell_name, f"**Error:** D&D Beyond is slow to answer for '{spell_name}', try again in a moment", True)
+    if (error := lookup.exception()) is not None:
+        LOGGER.warning("Failed to look up spell '%s' on D&D Beyond: %s", spell_name, error)
+        return SpellLookup(spell_name, f"**Error:** Failed to look up '{spell_name}' on D&D Beyond", True)
+    if embed := lookup.result():
+        return SpellLookup(spell_name, embed, True)
+    return None
+
+
+async def get_spells(
+    spell_names: list[str], source: str = "all", guild_id: Optional[int] = None, settings: Optional[WebLookupSettings] = None
+) -> list[SpellLookup]:
+    """Look up several spells concurrently. Local files are checked first, then D&D Beyond for the spells which weren't
+    found, so the lookup takes about as long as the slowest spell (and at most about the deadline of `settings`)
+
+    Args:
+        spell_names (`list[str]`): Names of the spells to lookup
+        source (`str`): Source to check. Defaults to 'all'
+        guild_id (`Optional[int]`): ID of the guild, whose homebrew spells take precedence. Defaults to `None`.
+        settings (`Optional[WebLookupSettings]`): How to check D&D Beyond. Defaults to `None` (the default settings).
 
-    for name, description in known_spells.items():
-        if spell_name.lower() == name.lower():
-            embed = dict_to_embed(name, description)
-            return embed
+    Returns:
+        `list[SpellLookup]`: Result of each spell, in the order they were given
 
+    Raises:
+        `ServerBusyError`: Too much expensive work is waiting for the gate
+    """
+    results: dict[str, SpellLookup] = {}
 
-async def get_spell(spell_name: str, source: str = "all") -> Union[str, Embed]:
-    """Get a spell from a local file or online
+    if source in LOCAL_SOURCES:
+        embeds = await asyncio.gather(*(get_spell_from_file(spell_name, guild_id) for spell_name in spell_names))
+        results = {spell_name: SpellLookup(spell_name, embed, False) for spell_name, embed in zip(spell_names, embeds) if embed}
+
+    if source in ONLINE_SOURCES and (missing := [spell_name for spell_name in spell_names if spell_name not in results]):
+        settings = settings or WebLookupSettings()
+        lookups: dict[str, asyncio.Task] = {}
+        batch = asyncio.create_task(get_spells_from_web(missing, lookups, settings))
+        await asyncio.wait([batch], timeout=settings.deadline)
+        if not batch.done():
+            BACKGROUND_LOOKUPS.add(batch)
+            batch.add_done_callback(forget_background_lookup)
+        elif (error := batch.exception()) is not None:
+            raise error
+        for spell_name in missing:
+            if result := get_web_lookup_result(spell_name, lookups.get(spell_name)):
+                results[spell_name] = result
+
+    for spell_name in spell_names:
+        if spell_name not in results:
+            results[spell_name] = SpellLookup(spell_name, await get_missing_spell_text(spell_name, guild_id), False)
+    return [results[spell_name] for spell_name in spell_names]
+
+
+async def get_spell(spell_name: str, source: str = "all", guild_id: Optional[int] = None, settings: Optional[WebLookupSettings] = None) -> SpellLookup:
+    """Get a spell from a local file or online. Local files are checked first, so the guild's homebrew and edited spells
+    take precedence over D&D Beyond
 
     Args:
         spell_name (`str`): Name of the spell to lookup
         source (`str`): Source to check. Defaults to 'all'
+        guild_id (`Optional[int]`): ID of the guild, whose homebrew spells take precedence. Defaults to `None`.
+        settings (`Optional[WebLookupSettings]`): How to check D&D Beyond. Defaults to `None` (the default settings).
 
     Returns:
-        `Union[str, Embed]`: Spell as a Discord embed, or an error message
+        `SpellLookup`: Spell as a Discord embed (or an error message), and whether it came from D&D Beyond
+
+    Raises:
+        `ServerBusyError`: Too much expensive work is waiting for the gate
     """
     # Validate source
     source = source.lower()
     if source not in VALID_SOURCES:
-        return f"**Error:** Invalid Source '{source}'\nMust be one of: `{' | '.join(VALID_SOURCES)}`"
+        return SpellLookup(spell_name, f"**Error:** Invalid Source '{source}'\nMust be one of: `{' | '.join(VALID_SOURCES)}`", False)
 
-    # Check for the spell online (via ddb)
+    # Check for the spell locally
+    if source in LOCAL_SOURCES and (response := await get_spell_from_file(spell_name, guild_id)):
+        return SpellLookup(spell_name, response, False)
+
+    # Check for the spell online (via ddb). Scraping D&D Beyond is expensive, only a few lookups may hit the web at once
     if source in ONLINE_SOURCES:
-        try:
-            response = get_spell_from_ddb(spell_name)
-        except HTTPError:
-            if source == "web":
-                response = MISSING_SPELL_TEXT.format(spell_name=spell_name)
-
-        # If we have a non-null response, we can return
-        # If not, source must be 'all' so we will check local file
+        settings = settings or WebLookupSettings()
+        async with settings.gate.slot() if settings.gate is not None else nullcontext():
+            response = await get_spell_from_web(spell_name, settings.executor)
         if response:
-            return response
-
-    # Check for the spell locally
-    if source in LOCAL_SOURCES:
-        response = await get_spell_from_file(spell_name)
-        if not response:
-            response = MISSING_SPELL_TEXT.format(spell_name=spell_name)
-        return response
+            return SpellLookup(spell_name, response, True)
+    return SpellLookup(spell_name, await get_missing_spell_text(spell_name, guild_id), False)
@@ -0,0 +1,398 @@
+"""Homebrew Spell Authoring Utils
+
+Spells added with `!addspell` (and changed with `!editspell` / `!delspell`) are written to the guild's own spell file, or
+to the global spell file outside of guilds.
+
+Each change is appended to a journal next to the spell file (e.g. `spells.journal`) rather than rewriting the whole file,
+and applied in place to the cached spells and their indexes (see `utils.datasets.apply_dataset_change`), so a change
+costs about the size of the spell. Once the journal has grown as big as the spell file it is folded into the file
+(rewritten atomically) and removed, so rewrites are amortized over many changes. Spell files are always loaded with
+their journal replayed on top.
+
+A journal starts with the modification time of the spell file it was started against. If the spell file has changed
+since (e.g. it was edited by hand), the journal is stale: it's ignored when loading, and replaced by the next change, so
+changes made with commands never override hand edits made after them.
+"""
+
+import asyncio
+import os
+import re
+from typing import Optional, Union
+from weakref import WeakValueDictionary
+
+from discord import Embed
+
+from constants.paths import SPELLS_PATH
+from utils.datasets import apply_dataset_change, get_guild_path, get_layer_paths, get_mtime, load_dataset, load_name_map, mark_dataset_written, store_dataset
+from utils.embed import dict_to_embed
+from utils.json_utils import decode_json, encode_json, read_json, write_json, write_json_async
+from utils.logging import get_logger
+
+LOGGER = get_logger(os.path.basename(__file__))
+
+# Members with this role may add, change and delete their guild's spells (as can the bot's owner, anywhere)
+DM_ROLE = os.getenv("DM_ROLE", "DM")
+# Fields of a spell, in the order they are stored in spell files. Every field is required
+SPELL_FIELDS = ["Casting Time", "Components", "Description", "Duration", "Level", "Range", "School"]
+SPELL_SCHOOLS = ["Abjuration", "Conjuration", "Divination", "Enchantment", "Evocation", "Illusion", "Necromancy", "Transmutation"]
+SPELL_COMPONENTS = ["V", "S", "M"]
+MAX_SPELL_LEVEL = 9
+# Longest a spell name, and any field, may be. Embed titles and field values are limited to 256 and 1024 characters
+MAX_NAME_LENGTH = 256
+MAX_FIELD_LENGTH = 1024
+# Embed descriptions are limited to 4096 characters
+MAX_DESCRIPTION_LENGTH = 4096
+
+# Journals are folded into their spell file once they are at least this big, or as big as the spell file
+MIN_JOURNAL_COMPACT_SIZE = 64 * 1024
+
+# A "Field: value" line of a spell written in a command
+FIELD_LINE_PATTERN = re.compile(rf"^\s*({'|'.join(re.escape(field) for field in SPELL_FIELDS)})\s*:\s*(.*)$", re.IGNORECASE)
+
+# Serialize changes to each spell file. Locks are dropped once nobody holds them
+SPELLBOOK_LOCKS: WeakValueDictionary[str, asyncio.Lock] = WeakValueDictionary()
+
+
+class InvalidSpellError(ValueError):
+    """Raised when a spell written in a command doesn't match the spell file schema"""
+
+
+def get_spellbook_lock(path: str) -> asyncio.Lock:
+    """Get the lock guarding a spell file
+
+    Args:
+        path (`str`): Path to the spell file
+
+    Returns:
+        `asyncio.Lock`: Lock for the spell file
+    """
+    if (lock := SPELLBOOK_LOCKS.get(path)) is None:
+        lock = SPELLBOOK_LOCKS[path] = asyncio.Lock()
+    return lock
+
+
+def get_journal_path(path: str) -> str:
+    """Get the path of a spell file's journal
+
+    e.g. `data/guilds/1234/spells.json` -> `data/guilds/1234/spells.journal`
+
+    Args:
+        path (`str`): Path to the spell file
+
+    Returns:
+        `str`: Path to the journal
+    """
+    return f"{os.path.splitext(path)[0]}.journal"
+
+
+def read_journal_base(journal_path: str) -> Optional[int]:
+    """Read the modification time of the spell file a journal was started against
+
+    Args:
+        journal_path (`str`): Path to the journal
+
+    Returns:
+        `Optional[int]`: Modification time (ns) of the spell file, `None` if there's no journal or it has no readable header
+    """
+    try:
+        with open(journal_path, "rb") as journal:
+            header = decode_json(journal.readline())
+    except (FileNotFoundError, ValueError):
+        return None
+    return header.get("base") if isinstance(header, dict) else None
+
+
+def read_spellbook(path: str) -> dict:
+    """Read a spell file, replaying its journal on top unless the journal is stale
+
+    Args:
+        path (`str`): Path to the spell file
+
+    Returns:
+        `dict`: Spells by name
+    """
+    # Before reading, so a change made while reading makes the journal look stale rather than be replayed onto the wrong file
+    mtime = get_mtime(path)
+    spells = read_json(path)
+    journal_path = get_journal_path(path)
+    try:
+        journal = open(journal_path, "rb")
+    except FileNotFoundError:
+        return spells
+    with journal:
+        try:
+            base = decode_json(journal.readline()).get("base")
+        except (ValueError, AttributeError):
+            base = None
+        if base != mtime:
+            LOGGER.warning("Ignoring stale journal '%s', '%s' has changed since it was started", journal_path, path)
+            return spells
+        for line_number, line in enumerate(journal, 2):
+            try:
+                change = decode_json(line)
+                name, spell = change["name"], change["spell"]
+            except (ValueError, KeyError, TypeError):
+                # e.g. the last line was cut short by a crash. Changes are only acknowledged once fully written
+                LOGGER.warning("Skipping unreadable change on line %d of '%s'", line_number, journal_path)
+                continue
+            if spell is None:
+                spells.pop(name, None)
+            else:
+                spells[name] = spell
+    return spells
+
+
+async def read_spellbook_async(path: str) -> dict:
+    """Read a spell file, replaying its journal on top, off the event loop
+
+    Args:
+        path (`str`): Path to the spell file
+
+    Returns:
+        `dict`: Spells by name
+    """
+    return await asyncio.to_thread(read_spellbook, path)
+
+
+def append_to_journal(path: str, name: str, spell: Optional[dict]) -> int:
+    """Durably append a change to a spell file's journal
+
+    Args:
+        path (`str`): Path to the spell file
+        name (`str`): Name of the changed spell
+        spell (`Optional[dict]`): New content of the spell, `None` if it was deleted
+
+    Returns:
+        `int`: Size of the journal, in bytes
+    """
+    journal_path = get_journal_path(path)
+    base = get_mtime(path)
+    # A stale journal is replaced rather than appended to, see the module docstring
+    stale = read_journal_base(journal_path) != base
+    with open(journal_path, "wb" if stale else "ab") as journal:
+        if stale:
+            journal.write(encode_json({"base": base}, compact=True) + b"\n")
+        journal.write(encode_json({"name": name, "spell": spell}, compact=True) + b"\n")
+        journal.flush()
+        os.fsync(journal.fileno())
+        return journal.tell()
+
+
+def compact_spellbook(path: str, spells: dict) -> None:
+    """Fold a spell file's journal into the file
+
+    Args:
+        path (`str`): Path to the spell file
+        spells (`dict`): Spells by name, with the journal applied
+    """
+    write_json(path, spells)
+    # Replaying the journal again would be harmless, so a crash before this leaves the spells as they were
+    try:
+        os.unlink(get_journal_path(path))
+    except FileNotFoundError:
+        pass
+
+
+async def load_spellbook(path: str) -> Optional[dict]:
+    """Load a spell file, with its journal replayed, through the shared cache
+
+    Args:
+        path (`str`): Path to the spell file
+
+    Returns:
+        `Optional[dict]`: Spells by name, `None` if the file doesn't exist
+    """
+    return await load_dataset(path, read_spellbook_async)
+
+
+async def find_spell_name(spell_name: str, path: str) -> Optional[str]:
+    """Find the name a spell has in a spell file, ignoring case
+
+    Args:
+        spell_name (`str`): Name of the spell
+        path (`str`): Path to the spell file
+
+    Returns:
+        `Optional[str]`: Name of the spell in the file, `None` if the file doesn't have it
+    """
+    names = await load_name_map(path, read_spellbook_async)
+    return None if names is None else names.get(spell_name.lower())
+
+
+async def save_spell_change(path: str, name: str, spell: Optional[dict]) -> None:
+    """Write a change to a spell file, and apply it to the cached spells. The caller must hold the file's lock
+
+    Args:
+        path (`str`): Path to the spell file
+        name (`str`): Name of the spell
+        spell (`Optional[dict]`): New content of the spell, `None` to delete it
+    """
+    spells = await load_spellbook(path)
+    # A guild's first homebrew spell creates its spell file. There's nothing to journal against yet
+    if spells is None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        spells = {} if spell is None else {name: spell}
+        await write_json_async(path, spells)
+        store_dataset(path, spells, read_spellbook_async)
+        return
+
+    journal_size = await asyncio.to_thread(append_to_journal, path, name, spell)
+    apply_dataset_change(path, name, spell)
+
+    if journal_size >= max(MIN_JOURNAL_COMPACT_SIZE, os.path.getsize(path)):
+        # Loads the file again (with the journal) if it was evicted from the cache in the meantime
+        spells = await load_spellbook(path)
+        await asyncio.to_thread(compact_spellbook, path, spells)
+        mark_dataset_written(path)
+        LOGGER.info("Compacted spell journal of '%s'", path)
+
+
+def parse_spell_text(text: str) -> tuple[str, dict[str, str]]:
+    """Parse a spell written in a command: its name on the first line, followed by "Field: value" lines.
+    Lines which don't start with a field continue the previous field (e.g. a multi-paragraph description)
+
+    Args:
+        text (`str`): Text of the command, after the command name
+
+    Returns:
+        `tuple[str, dict[str, str]]`: Name of the spell, fields given (by their proper name)
+
+    Raises:
+        `InvalidSpellError`: The text has no name, or has text which doesn't belong to any field
+    """
+    name, *lines = text.strip().split("\n")
+    name = name.strip()
+    if not name:
+        raise InvalidSpellError("The spell needs a name")
+    field_names = {field.lower(): field for field in SPELL_FIELDS}
+    fields: dict[str, str] = {}
+    field = None
+    for line in lines:
+        if match := FIELD_LINE_PATTERN.match(line):
+            field = field_names[match.group(1).lower()]
+            fields[field] = match.group(2).strip()
+        elif field is not None:
+            fields[field] = f"{fields[field]}\n{line.strip()}".strip()
+        elif line.strip():
+            raise InvalidSpellError(f"Expected a field (one of: `{' | '.join(SPELL_FIELDS)}`), found '{line.strip()}'")
+    return name, fields
+
+
+def validate_spell(name: str, fields: dict[str, Union[str, int]]) -> dict:
+    """Check a spell matches the spell file schema, converting its fields to the types stored
+
+    Args:
+        name (`str`): Name of the spell
+        fields (`dict[str, Union[str, int]]`): Every field of the spell
+
+    Returns:
+        `dict`: Spell, as stored in spell files
+
+    Raises:
+        `InvalidSpellError`: The spell doesn't match the schema
+    """
+    if len(name) > MAX_NAME_LENGTH:
+        raise InvalidSpellError(f"Spell names can be at most {MAX_NAME_LENGTH} characters long")
+    if missing := [field for field in SPELL_FIELDS if fields.get(field) in (None, "")]:
+        raise InvalidSpellError(f"Missing field{'s' if len(missing) > 1 else ''}: {', '.join(missing)}")
+
+    spell = {field: fields[field] for field in SPELL_FIELDS}
+    for field, value in spell.items():
+        max_length = MAX_DESCRIPTION_LENGTH if field == "Description" else MAX_FIELD_LENGTH
+        if isinstance(value, str) and len(value) > max_length:
+            raise InvalidSpellError(f"{field} can be at most {max_length} characters long")
+
+    try:
+        spell["Level"] = int(str(spell["Level"]).lower().removesuffix("cantrip").strip() or 0)
+    except ValueError:
+        raise InvalidSpellError(f"Level must be a number from 0 (cantrip) to {MAX_SPELL_LEVEL}") from None
+    if not 0 <= spell["Level"] <= MAX_SPELL_LEVEL:
+        raise InvalidSpellError(f"Level must be a number from 0 (cantrip) to {MAX_SPELL_LEVEL}")
+
+    schools = {school.lower(): school for school in SPELL_SCHOOLS}
+    if (school := schools.get(spell["School"].lower())) is None:
+        raise InvalidSpellError(f"School must be one of: `{' | '.join(SPELL_SCHOOLS)}`")
+    spell["School"] = school
+
+    # e.g. "V, S, M (a pinch of sulfur)"
+    components = [component.strip().upper() for component in spell["Components"].split("(")[0].split(",")]
+    if not all(component in SPELL_COMPONENTS for component in components if component) or not any(components):
+        raise InvalidSpellError(f"Components must be a list of `{', '.join(SPELL_COMPONENTS)}`, with materials in brackets e.g. 'V, S, M (a feather)'")
+    return spell
+
+
+async def add_spell(text: str, guild_id: Optional[int] = None) -> Union[str, Embed]:
+    """Add a homebrew spell
+
+    Args:
+        text (`str`): The spell, as written in the command (see `parse_spell_text`)
+        guild_id (`Optional[int]`): ID of the guild the spell belongs to. Defaults to `None` (the global spell file).
+
+    Returns:
+        `Union[str, Embed]`: The new spell as a Discord embed, or an error message
+    """
+    try:
+        name, fields = parse_spell_text(text)
+        spell = validate_spell(name, fields)
+    except InvalidSpellError as error:
+        return f"**Error:** {error}"
+
+    path = get_guild_path(SPELLS_PATH, guild_id)
+    async with get_spellbook_lock(path):
+        for layer_path in get_layer_paths(SPELLS_PATH, guild_id):
+            if existing := await find_spell_name(name, layer_path):
+                return f"**Error:** Spell '{existing}' already exists, use `!editspell` to change it"
+        await save_spell_change(path, name, spell)
+    return dict_to_embed(name, spell)
+
+
+async def edit_spell(text: str, guild_id: Optional[int] = None) -> Union[str, Embed]:
+    """Change fields of a spell. Changing a global spell in a guild gives the guild its own version of it
+
+    Args:
+        text (`str`): The spell name and changed fields, as written in the command (see `parse_spell_text`)
+        guild_id (`Optional[int]`): ID of the guild the spell belongs to. Defaults to `None` (the global spell file).
+
+    Returns:
+        `Union[str, Embed]`: The changed spell as a Discord embed, or an error message
+    """
+    try:
+        name, fields = parse_spell_text(text)
+        if not fields:
+            raise InvalidSpellError(f"Give the fields to change, e.g. `!editspell {name}` followed by a line `Range: 60 feet`")
+    except InvalidSpellError as error:
+        return f"**Error:** {error}"
+
+    path = get_guild_path(SPELLS_PATH, guild_id)
+    async with get_spellbook_lock(path):
+        # The guild's own version takes precedence over the global one
+        for layer_path in get_layer_paths(SPELLS_PATH, guild_id):
+            if existing := await find_spell_name(name, layer_path):
+                spell = (await load_spellbook(layer_path))[existing]
+                break
+        else:
+            return f"**Error:** Cannot find spell '{name}'"
+        try:
+            spell = validate_spell(existing, {**spell, **fields})
+        except InvalidSpellError as error:
+            return f"**Error:** {error}"
+        await save_spell_change(path, existing, spell)
+    return dict_to_embed(existing, spell)
+
+
+async def delete_spell(spell_name: str, guild_id: Optional[int] = None) -> str:
+    """Delete a homebrew spell. In a guild, only the guild's own spells can be deleted
+
+    Args:
+        spell_name (`str`): Name of the spell
+        guild_id (`Optional[int]`): ID of the guild the spell belongs to. Defaults to `None` (the global spell file).
+
+    Returns:
+        `str`: Confirmation or error message
+    """
+    path = get_guild_path(SPELLS_PATH, guild_id)
+    async with get_spellbook_lock(path):
+        if not (existing := await find_spell_name(spell_name, path)):
+            return f"**Error:** Cannot find homebrew spell '{spell_name}'"
+        await save_spell_change(path, existing, None)
+    return f"Deleted spell '{existing}'."
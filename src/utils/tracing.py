@@ -0,0 +1,374 @@
+"""Tracing Utils
+
+Each command runs under a root span, started by `VoloBot.invoke`. Code in `utils/` and `commands/` wraps its stages
+(loading data, fetching and parsing pages, rendering embeds, sending messages) in child spans with `span(name)`. The
+current span is kept in a context variable, so spans nest across awaits and into tasks started while they're open.
+
+Outside of a traced command (or when tracing is off), `span` only reads the context variable and returns a shared no-op
+context manager.
+
+Finished traces are kept in a ring buffer of recent traces, of which `!trace` shows the slowest, and can be exported to
+a JSON Lines file for offline analysis (see `TRACE_EXPORT`).
+"""
+
+import asyncio
+import heapq
+import os
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Optional, Union
+
+from constants.paths import TRACES_PATH
+from utils.json_utils import encode_json
+from utils.logging import get_logger
+from utils.metrics import MetricsRegistry
+
+LOGGER = get_logger(os.path.basename(__file__))
+
+# Configurable via env vars
+# Fraction of commands to trace, 0 turns tracing off
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+# Traces to export to `TRACES_PATH`: 'off' | 'slow' (slower than `TRACE_SLOW_MS`) | 'all'
+TRACE_EXPORT = os.getenv("TRACE_EXPORT", "off").lower()
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "500"))
+
+# Number of recent traces kept in memory
+TRACE_BUFFER_SIZE = 256
+# Seconds between writes of exported traces
+TRACE_EXPORT_INTERVAL = 10
+# Traces waiting to be exported, further traces are dropped until the next write
+MAX_PENDING_EXPORTS = 1024
+# The export file is rotated (to '<path>.1') once it grows past this, in bytes
+MAX_EXPORT_FILE_SIZE = 16 * 1024 * 1024
+# Longest detail kept on a span, e.g. the message that invoked a command
+MAX_DETAIL_LENGTH = 100
+
+
+class Span:
+    """A timed stage of a command, and the stages within it"""
+
+    __slots__ = ("name", "detail", "start", "end", "children")
+
+    def __init__(self: "Span", name: str, detail: Optional[str] = None) -> None:
+        """Init Span, starting it
+
+        Args:
+            name (`str`): Name of the stage, e.g. 'fetch'
+            detail (`Optional[str]`): What the stage worked on, e.g. a URL. Defaults to `None`.
+        """
+        self.name = name
+        if detail is not None:
+            # Keep each span on a single line, e.g. for multi-line `!batch` messages
+            detail = " ".join(detail.split())
+        self.detail = detail if detail is None or len(detail) <= MAX_DETAIL_LENGTH else detail[: MAX_DETAIL_LENGTH - 1] + "…"
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.children: list[Span] = []
+
+    @property
+    def duration_ms(self: "Span") -> float:
+        """Duration of the span in milliseconds, up to now if it hasn't ended"""
+        return ((self.end or time.perf_counter()) - self.start) * 1000
+
+    def to_dict(self: "Span", origin: float) -> dict[str, Any]:
+        """Convert the span (and its children) to plain data
+
+        Args:
+            origin (`float`): `perf_counter` time the trace started at, offsets are relative to it
+
+        Returns:
+            `dict[str, Any]`: Name, detail, offset and duration in milliseconds, children
+        """
+        return {
+            "name": self.name,
+            "detail": self.detail,
+            "offset_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round(self.duration_ms, 3),
+            "children": [child.to_dict(origin) for child in self.children],
+        }
+
+
+# Innermost open span of the running task, `None` outside of traced commands
+CURRENT_SPAN: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class SpanContext:
+    """Context manager making a span the current span while it's open"""
+
+    __slots__ = ("span", "token")
+
+    def __init__(self: "SpanContext", span: Span) -> None:
+        """Init SpanContext
+
+        Args:
+            span (`Span`): Span to open
+        """
+        self.span = span
+        self.token = None
+
+    def __enter__(self: "SpanContext") -> Span:
+        """Make the span the current span
+
+        Returns:
+            `Span`: The span
+        """
+        self.token = CURRENT_SPAN.set(self.span)
+        return self.span
+
+    def __exit__(self: "SpanContext", *exc_info: Any) -> None:
+        """End the span, restoring the previous current span"""
+        self.span.end = time.perf_counter()
+        CURRENT_SPAN.reset(self.token)
+
+
+class NullSpanContext:
+    """Context manager doing nothing, used when there's no trace to add a span to"""
+
+    __slots__ = ()
+
+    def __enter__(self: "NullSpanContext") -> None:
+        """Do nothing"""
+        return None
+
+    def __exit__(self: "NullSpanContext", *exc_info: Any) -> None:
+        """Do nothing"""
+        return None
+
+
+NULL_SPAN = NullSpanContext()
+
+
+def span(name: str, detail: Optional[str] = None) -> Union[SpanContext, NullSpanContext]:
+    """Time a stage of the current command, as a child of the current span. Use with `with`
+
+    Args:
+        name (`str`): Name of the stage, e.g. 'fetch'
+        detail (`Optional[str]`): What the stage works on, e.g. a URL. Defaults to `None`.
+
+    Returns:
+        `Union[SpanContext, NullSpanContext]`: Context manager opening the span, a no-op if the command isn't traced
+    """
+    if (parent := CURRENT_SPAN.get()) is None:
+        return NULL_SPAN
+    child = Span(name, detail)
+    parent.children.append(child)
+    return SpanContext(child)
+
+
+@dataclass(slots=True)
+class Trace:
+    """A finished command, and the stages it went through"""
+
+    root: Span
+    timestamp: float  # Wall clock time the command started at
+
+    @property
+    def duration_ms(self: "Trace") -> float:
+        """Duration of the command in milliseconds"""
+        return self.root.duration_ms
+
+    def to_dict(self: "Trace") -> dict[str, Any]:
+        """Convert the trace to plain data, e.g. for exporting
+
+        Returns:
+            `dict[str, Any]`: Start time and root span
+        """
+        return {"time": datetime.fromtimestamp(self.timestamp, timezone.utc).isoformat(), **self.root.to_dict(self.root.start)}
+
+
+class TraceContext(SpanContext):
+    """Context manager opening the root span of a command, recording the trace when it ends"""
+
+    __slots__ = ("tracer", "timestamp")
+
+    def __init__(self: "TraceContext", tracer: "Tracer", span: Span) -> None:
+        """Init TraceContext
+
+        Args:
+            tracer (`Tracer`): Tracer to record the trace with
+            span (`Span`): Root span
+        """
+        super().__init__(span)
+        self.tracer = tracer
+        self.timestamp = time.time()
+
+    def __exit__(self: "TraceContext", *exc_info: Any) -> None:
+        """End the root span and record the trace"""
+        super().__exit__(*exc_info)
+        self.tracer.record(Trace(self.span, self.timestamp))
+
+
+def format_span(span: Span, origin: float, depth: int = 0) -> list[str]:
+    """Format a span and its children as indented lines
+
+    Args:
+        span (`Span`): Span to format
+        origin (`float`): `perf_counter` time the trace started at, offsets are relative to it
+        depth (`int`): Nesting depth of the span. Defaults to `0`.
+
+    Returns:
+        `list[str]`: One line per span, e.g. '  +2.1ms fetch 702.4ms https://...'
+    """
+    detail = f"  {span.detail}" if span.detail else ""
+    lines = [f"{'  ' * depth}+{(span.start - origin) * 1000:.1f}ms {span.name} {span.duration_ms:.1f}ms{detail}"]
+    for child in span.children:
+        lines.extend(format_span(child, origin, depth + 1))
+    return lines
+
+
+def format_trace(trace: Trace) -> str:
+    """Format a trace for `!trace`
+
+    Args:
+        trace (`Trace`): Trace to format
+
+    Returns:
+        `str`: Header line with the command and total duration, then one line per stage
+    """
+    started = datetime.fromtimestamp(trace.timestamp, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    detail = f"  {trace.root.detail}" if trace.root.detail else ""
+    stages = [line for child in trace.root.children for line in format_span(child, trace.root.start, 1)]
+    return "\n".join([f"{trace.root.name} {trace.duration_ms:.1f}ms at {started} UTC{detail}", *stages])
+
+
+def format_traces(traces: list[Trace], max_length: int) -> list[str]:
+    """Format traces as few code blocks as possible, each fitting in a message
+
+    Args:
+        traces (`list[Trace]`): Traces to format
+        max_length (`int`): Longest message, including the code block's backticks
+
+    Returns:
+        `list[str]`: Messages, one or more traces in each. Traces too long for a message are cut short
+    """
+    fence = "```"
+    room = max_length - 2 * len(fence) - 2
+    messages = []
+    blocks: list[str] = []
+    length = 0
+    for trace in traces:
+        block = format_trace(trace)
+        if len(block) > room:
+            block = block[: room - 1] + "…"
+        if blocks and length + len(block) + 2 > room:
+            messages.append("\n\n".join(blocks))
+            blocks, length = [], 0
+        blocks.append(block)
+        length += len(block) + 2
+    if blocks:
+        messages.append("\n\n".join(blocks))
+    return [f"{fence}\n{message}\n{fence}" for message in messages]
+
+
+@dataclass(frozen=True)
+class TracingSettings:
+    """Which commands to trace, and what to do with their traces"""
+
+    sample_rate: float = TRACE_SAMPLE_RATE  # Fraction of commands to trace
+    export: str = TRACE_EXPORT  # Traces to export: 'off' | 'slow' | 'all'
+    slow_ms: float = TRACE_SLOW_MS  # Traces at least this slow are exported when `export` is 'slow'
+    path: str = TRACES_PATH  # File traces are exported to
+    buffer_size: int = TRACE_BUFFER_SIZE  # Number of recent traces kept in memory
+
+
+class Tracer:
+    """Starts the root span of traced commands, and keeps (and optionally exports) finished traces"""
+
+    def __init__(self: "Tracer", metrics: MetricsRegistry, settings: Optional[TracingSettings] = None) -> None:
+        """Init Tracer
+
+        Args:
+            metrics (`MetricsRegistry`): Registry to report traced and exported commands to
+            settings (`Optional[TracingSettings]`): Which commands to trace, and what to do with their traces. Defaults to `None` (the default settings).
+        """
+        self.metrics = metrics
+        self.settings = settings or TracingSettings()
+        self.recent: deque[Trace] = deque(maxlen=self.settings.buffer_size)
+        # Traces waiting to be exported, as JSON lines
+        self.pending: list[bytes] = []
+        self.task: Optional[asyncio.Task] = None
+
+    def trace(self: "Tracer", name: str, detail: Optional[str] = None) -> Union[SpanContext, NullSpanContext]:
+        """Trace a command. Use with `with`. Commands run by other commands (e.g. `!batch`) become a span of their trace
+
+        Args:
+            name (`str`): Name of the command
+            detail (`Optional[str]`): What the command was invoked with, e.g. the message. Defaults to `None`.
+
+        Returns:
+            `Union[SpanContext, NullSpanContext]`: Context manager opening the root span, a no-op if the command isn't sampled
+        """
+        if CURRENT_SPAN.get() is not None:
+            return span(name, detail)
+        if self.settings.sample_rate <= 0 or (self.settings.sample_rate < 1 and random.random() >= self.settings.sample_rate):
+            return NULL_SPAN
+        return TraceContext(self, Span(name, detail))
+
+    def record(self: "Tracer", trace: Trace) -> None:
+        """Keep a finished trace, queueing it for export if it should be
+
+        Args:
+            trace (`Trace`): The finished trace
+        """
+        self.recent.append(trace)
+        self.metrics.incr("tracing.traces")
+        if self.settings.export == "all" or (self.settings.export == "slow" and trace.duration_ms >= self.settings.slow_ms):
+            if len(self.pending) >= MAX_PENDING_EXPORTS:
+                self.metrics.incr("tracing.dropped")
+                return
+            self.pending.append(encode_json(trace.to_dict(), compact=True) + b"\n")
+
+    def slowest(self: "Tracer", count: int, name: Optional[str] = None) -> list[Trace]:
+        """Get the slowest recent traces
+
+        Args:
+            count (`int`): Number of traces to get
+            name (`Optional[str]`): Only get traces of this command. Defaults to `None` (every command).
+
+        Returns:
+            `list[Trace]`: Slowest traces, slowest first
+        """
+        traces = self.recent if name is None else (trace for trace in self.recent if trace.root.name == name)
+        return heapq.nlargest(count, traces, key=lambda trace: trace.duration_ms)
+
+    def _write(self: "Tracer", lines: list[bytes]) -> None:
+        """Append exported traces to the export file, rotating it if it's too big. Blocking, runs in a thread
+
+        Args:
+            lines (`list[bytes]`): Traces as JSON lines
+        """
+        if os.path.exists(self.settings.path) and os.path.getsize(self.settings.path) >= MAX_EXPORT_FILE_SIZE:
+            os.replace(self.settings.path, f"{self.settings.path}.1")
+        with open(self.settings.path, "ab") as export_file:
+            export_file.writelines(lines)
+
+    async def flush(self: "Tracer") -> None:
+        """Write traces waiting to be exported"""
+        if not self.pending:
+            return
+        lines, self.pending = self.pending, []
+        await asyncio.to_thread(self._write, lines)
+        self.metrics.incr("tracing.exported", len(lines))
+
+    def start(self: "Tracer") -> None:
+        """Start exporting traces periodically, if exporting is on"""
+        if self.settings.export in ("slow", "all"):
+            self.task = asyncio.create_task(self._run())
+
+    def stop(self: "Tracer") -> None:
+        """Stop exporting traces periodically. Call `flush` afterwards to write the latest traces"""
+        if self.task is not None:
+            self.task.cancel()
+
+    async def _run(self: "Tracer") -> None:
+        """Export traces until stopped"""
+        while True:
+            await asyncio.sleep(TRACE_EXPORT_INTERVAL)
+            try:
+                await self.flush()
+            except OSError as error:
+                LOGGER.warning("Failed to export traces to '%s': %s", self.settings.path, error)
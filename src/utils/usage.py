@@ -0,0 +1,138 @@
+"""Command Usage Utils
+
+Counts how often each command argument (e.g. each spell name) is used, so the most popular responses can be kept warm.
+Counts decay exponentially, so the ranking follows what's popular now rather than what was popular months ago.
+
+Decay uses "forward decay": rather than periodically multiplying every count down, each use is weighted by
+`2 ** (age of the landmark / half life)`, so recording a use is O(1) and newer uses simply count for more. Weights are
+rescaled to the current time (moving the landmark) whenever the counts are flushed, keeping them small.
+"""
+
+import asyncio
+import heapq
+import os
+import time
+from typing import Optional
+
+from constants.paths import USAGE_PATH
+from utils.json_utils import read_json_async, write_json_async
+from utils.logging import get_logger
+
+LOGGER = get_logger(os.path.basename(__file__))
+
+# Seconds after which a use counts half as much
+USAGE_HALF_LIFE = 3 * 24 * 60 * 60
+# Seconds between writes of the counts to disk
+USAGE_FLUSH_INTERVAL = 5 * 60
+# Number of arguments tracked per command, the least used are forgotten on flush
+MAX_TRACKED_ARGUMENTS = 256
+# Arguments whose decayed count drops below this are forgotten on flush
+MIN_COUNT = 0.01
+
+
+class UsageRecorder:
+    """Decaying counters of command argument usage, periodically flushed to disk"""
+
+    def __init__(
+        self: "UsageRecorder",
+        path: Optional[str] = USAGE_PATH,
+        half_life: float = USAGE_HALF_LIFE,
+        flush_interval: float = USAGE_FLUSH_INTERVAL,
+        max_arguments: int = MAX_TRACKED_ARGUMENTS,
+    ) -> None:
+        """Init UsageRecorder
+
+        Args:
+            path (`Optional[str]`): File the counts are stored in. `None` keeps them in memory only. Defaults to `USAGE_PATH`.
+            half_life (`float`): Seconds after which a use counts half as much. Defaults to `USAGE_HALF_LIFE`.
+            flush_interval (`float`): Seconds between writes to disk. Defaults to `USAGE_FLUSH_INTERVAL`.
+            max_arguments (`int`): Number of arguments tracked per command. Defaults to `MAX_TRACKED_ARGUMENTS`.
+        """
+        self.path = path
+        self.half_life = half_life
+        self.flush_interval = flush_interval
+        self.max_arguments = max_arguments
+        # Wall clock time (so it survives restarts) at which a use has a weight of 1
+        self.landmark = time.time()
+        # Weighted counts of each argument, by command
+        self.counts: dict[str, dict[str, float]] = {}
+        self.dirty = False
+        self.task: Optional[asyncio.Task] = None
+
+    def _weight(self: "UsageRecorder") -> float:
+        """Get the weight of a use made now
+
+        Returns:
+            `float`: Weight relative to the landmark
+        """
+        return 2 ** ((time.time() - self.landmark) / self.half_life)
+
+    def record(self: "UsageRecorder", command: str, argument: str) -> None:
+        """Record a use of a command argument
+
+        Args:
+            command (`str`): Name of the command (e.g. 'spell')
+            argument (`str`): Argument it was used with (e.g. 'fireball'). Case is ignored
+        """
+        counts = self.counts.setdefault(command, {})
+        argument = argument.lower()
+        counts[argument] = counts.get(argument, 0.0) + self._weight()
+        self.dirty = True
+
+    def top(self: "UsageRecorder", command: str, k: int) -> list[str]:
+        """Get a command's most used arguments
+
+        Args:
+            command (`str`): Name of the command
+            k (`int`): Number of arguments to get
+
+        Returns:
+            `list[str]`: Most used arguments, most used first
+        """
+        counts = self.counts.get(command, {})
+        return heapq.nlargest(k, counts, key=counts.__getitem__)
+
+    def compact(self: "UsageRecorder") -> None:
+        """Rescale counts to the current time, forgetting rarely used arguments"""
+        weight = self._weight()
+        self.landmark = time.time()
+        for command, counts in self.counts.items():
+            kept = heapq.nlargest(self.max_arguments, counts.items(), key=lambda item: item[1])
+            self.counts[command] = {argument: count / weight for argument, count in kept if count / weight >= MIN_COUNT}
+
+    async def load(self: "UsageRecorder") -> None:
+        """Load counts saved by a previous run, if there are any"""
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            saved = await read_json_async(self.path)
+            self.landmark = float(saved["landmark"])
+            self.counts = {command: {argument: float(count) for argument, count in counts.items()} for command, counts in saved["counts"].items()}
+        except (OSError, ValueError, KeyError, AttributeError) as error:
+            LOGGER.warning("Ignoring unreadable usage stats in '%s': %s", self.path, error)
+
+    async def flush(self: "UsageRecorder") -> None:
+        """Write the counts to disk, if they have changed"""
+        if self.path is None or not self.dirty:
+            return
+        self.compact()
+        self.dirty = False
+        await write_json_async(self.path, {"landmark": self.landmark, "counts": self.counts}, compact=True)
+
+    def start(self: "UsageRecorder") -> None:
+        """Start flushing counts periodically"""
+        self.task = asyncio.create_task(self._run())
+
+    def stop(self: "UsageRecorder") -> None:
+        """Stop flushing counts periodically. Call `flush` afterwards to save the latest counts"""
+        if self.task is not None:
+            self.task.cancel()
+
+    async def _run(self: "UsageRecorder") -> None:
+        """Flush counts until stopped"""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except OSError as error:
+                LOGGER.warning("Failed to save usage stats to '%s': %s", self.path, error)
@@ -0,0 +1,132 @@
+"""Cache Warming Utils
+
+Renders the most used spells and rules (see `utils.usage`) into the response caches, loads the crit tables, and
+prefetches the most used spells from D&D Beyond. Runs at startup, so the first lookups after a deploy aren't cold, then
+on a schedule, so popular responses are back in the caches soon after they have been evicted or reloaded.
+"""
+
+import asyncio
+import os
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional
+
+from constants.paths import CRIT_TABLE_PATH, FUMBLE_TABLE_PATH
+from utils.crit import read_crit_csv_async
+from utils.datasets import load_dataset
+from utils.executor import ExecutorService
+from utils.logging import get_logger
+from utils.metrics import MetricsRegistry
+from utils.rules import get_rule
+from utils.spell import get_spell_from_file, get_spell_from_web, is_web_spell_cached
+from utils.usage import UsageRecorder
+
+LOGGER = get_logger(os.path.basename(__file__))
+
+# Seconds between warming runs
+WARM_INTERVAL = 15 * 60
+# Number of the most used spells and rules to warm
+WARM_TOP_K = 50
+# Maximum number of spells fetched from D&D Beyond per run, and seconds between fetches
+WARM_WEB_BUDGET = 10
+WARM_WEB_INTERVAL = 2.0
+
+
+@dataclass(frozen=True)
+class WarmingSettings:
+    """How often, and how much, to warm"""
+
+    interval: float = WARM_INTERVAL  # Seconds between runs
+    top_k: int = WARM_TOP_K  # Number of the most used spells and rules to warm
+    web_budget: int = WARM_WEB_BUDGET  # Maximum number of spells fetched from D&D Beyond per run
+    web_interval: float = WARM_WEB_INTERVAL  # Seconds between fetches from D&D Beyond
+
+
+class CacheWarmer:
+    """Periodically warm the response caches with the most used responses"""
+
+    def __init__(
+        self: "CacheWarmer",
+        usage: UsageRecorder,
+        metrics: MetricsRegistry,
+        executor: Optional[ExecutorService] = None,
+        settings: Optional[WarmingSettings] = None,
+    ) -> None:
+        """Init CacheWarmer
+
+        Args:
+            usage (`UsageRecorder`): Usage stats to pick responses from
+            metrics (`MetricsRegistry`): Registry to report warming to
+            executor (`Optional[ExecutorService]`): Executor service to parse web pages in. Defaults to `None` (a thread).
+            settings (`Optional[WarmingSettings]`): How often and how much to warm. Defaults to `None` (the default settings).
+        """
+        self.usage = usage
+        self.metrics = metrics
+        self.executor = executor
+        self.settings = settings or WarmingSettings()
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self: "CacheWarmer") -> None:
+        """Start warming, immediately and then periodically"""
+        self.task = asyncio.create_task(self._run())
+
+    def stop(self: "CacheWarmer") -> None:
+        """Stop warming"""
+        if self.task is not None:
+            self.task.cancel()
+
+    async def _run(self: "CacheWarmer") -> None:
+        """Warm caches until stopped"""
+        while True:
+            try:
+                await self.warm()
+            except Exception as error:
+                LOGGER.exception("Cache warming failed", exc_info=error)
+            await asyncio.sleep(self.settings.interval)
+
+    async def warm(self: "CacheWarmer") -> Counter:
+        """Warm the caches once
+
+        Returns:
+            `Counter`: Number of responses warmed by kind
+        """
+        warmed = Counter()
+        for spell in self.usage.top("spell", self.settings.top_k):
+            if await get_spell_from_file(spell):
+                warmed["spell"] += 1
+        for rule in self.usage.top("rule", self.settings.top_k):
+            if await get_rule(rule):
+                warmed["rule"] += 1
+        # Crit/fumble results are plain lookups once a table is loaded
+        for path in (CRIT_TABLE_PATH, FUMBLE_TABLE_PATH):
+            await load_dataset(path, read_crit_csv_async)
+            warmed["table"] += 1
+        warmed["web"] = await self.prefetch_web_spells()
+
+        for kind, count in warmed.items():
+            self.metrics.incr(f"warming.{kind}", count)
+        LOGGER.info("Warmed caches: %s", ", ".join(f"{count} {kind}" for kind, count in warmed.items()))
+        return warmed
+
+    async def prefetch_web_spells(self: "CacheWarmer") -> int:
+        """Fetch the most used web spells that aren't cached, within the web budget
+
+        Returns:
+            `int`: Number of spells fetched
+        """
+        fetched = 0
+        for spell in self.usage.top("spell.web", self.settings.top_k):
+            if fetched >= self.settings.web_budget:
+                break
+            if is_web_spell_cached(spell):
+                continue
+            # Space fetches out, so warming never bursts requests at D&D Beyond
+            if fetched:
+                await asyncio.sleep(self.settings.web_interval)
+            try:
+                await get_spell_from_web(spell, self.executor)
+            except OSError as error:
+                LOGGER.warning("Stopped prefetching spells, failed to fetch '%s': %s", spell, error)
+                break
+            fetched += 1
+        return fetched
@@ -0,0 +1,125 @@
+"""Event Loop Watchdog Utils
+
+Continuously measures event-loop lag. A helper thread notices when the loop has stopped responding for longer than a
+threshold, and logs the stack of the code blocking it along with the command that was running.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from utils.logging import get_logger
+from utils.metrics import MetricsRegistry
+
+LOGGER = get_logger(os.path.basename(__file__))
+
+# Seconds between lag measurements
+LAG_SAMPLE_INTERVAL = 0.1
+# Seconds the loop may be blocked before its stack is captured
+LAG_THRESHOLD = float(os.getenv("WATCHDOG_THRESHOLD", "0.25"))
+# Maximum number of frames to include in a captured stack
+STACK_LIMIT = 25
+
+
+class LoopWatchdog:
+    """Event-loop lag monitor"""
+
+    def __init__(self: "LoopWatchdog", metrics: MetricsRegistry, threshold: float = LAG_THRESHOLD, interval: float = LAG_SAMPLE_INTERVAL) -> None:
+        """Init LoopWatchdog
+
+        Args:
+            metrics (`MetricsRegistry`): Registry to report lag to
+            threshold (`float`): Seconds the loop may be blocked before its stack is captured. Defaults to `LAG_THRESHOLD`.
+            interval (`float`): Seconds between lag measurements. Defaults to `LAG_SAMPLE_INTERVAL`.
+        """
+        self.metrics = metrics
+        self.lag = metrics.histogram("loop.lag_ms")
+        self.threshold = threshold
+        self.interval = interval
+        # Commands currently running, by the task running them
+        self.in_flight: dict[asyncio.Task, str] = {}
+        self.heartbeat = time.monotonic()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread_id: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+        self.thread: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+
+    def start(self: "LoopWatchdog") -> None:
+        """Start watching the running event loop. Must be called from the loop's thread"""
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.task = asyncio.create_task(self._measure())
+        self.thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self.thread.start()
+
+    def stop(self: "LoopWatchdog") -> None:
+        """Stop watching the event loop"""
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+
+    def command_started(self: "LoopWatchdog", command: str) -> None:
+        """Record that the current task is running a command
+
+        Args:
+            command (`str`): Name of the command
+        """
+        if (task := asyncio.current_task()) is not None:
+            self.in_flight[task] = command
+
+    def command_finished(self: "LoopWatchdog") -> None:
+        """Record that the current task has finished running its command"""
+        self.in_flight.pop(asyncio.current_task(), None)
+
+    async def _measure(self: "LoopWatchdog") -> None:
+        """Measure how late the loop wakes us up, and keep the heartbeat fresh for the watchdog thread"""
+        while True:
+            started = self.heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.heartbeat = time.monotonic()
+            self.lag.observe(max(self.heartbeat - started - self.interval, 0) * 1000)
+
+    def _watch(self: "LoopWatchdog") -> None:
+        """Watchdog thread. Report the loop's stack when the heartbeat goes stale, once per stall"""
+        reported_heartbeat = None
+        while not self.stopped.wait(self.interval):
+            heartbeat = self.heartbeat
+            blocked_for = time.monotonic() - heartbeat - self.interval
+            if blocked_for > self.threshold and heartbeat != reported_heartbeat:
+                reported_heartbeat = heartbeat
+                self._report(blocked_for)
+
+    def _report(self: "LoopWatchdog", blocked_for: float) -> None:
+        """Log the stack of the loop's thread, and the command the blocking task is running
+
+        Args:
+            blocked_for (`float`): Seconds the loop has been blocked for
+        """
+        self.metrics.incr("loop.stalls")
+        frame = sys._current_frames().get(self.loop_thread_id)
+        stack = "".join(traceback.format_stack(frame, limit=STACK_LIMIT)) if frame is not None else "<unavailable>"
+        # Reading these from another thread is safe enough, the loop thread is stuck and can't be changing them
+        task = asyncio.current_task(self.loop)
+        command = self.in_flight.get(task) if task is not None else None
+        LOGGER.warning(
+            "Event loop blocked for %.0f ms in task %s (command: %s). Commands in flight: %s\n%s",
+            blocked_for * 1000,
+            task.get_name() if task is not None else None,
+            command,
+            sorted(set(self.in_flight.values())),
+            stack,
+        )
+
+    def lag_percentiles(self: "LoopWatchdog") -> dict[str, float]:
+        """Get percentiles of recent event-loop lag
+
+        Returns:
+            `dict[str, float]`: p50, p99 and max lag in milliseconds
+        """
+        return {"p50": self.lag.percentile(50), "p99": self.lag.percentile(99), "max": self.lag.max}
@@ -0,0 +1,270 @@
+"""Data File Watcher Utils
+
+Watches the data files in `constants.paths` (and guilds' copies of them) for changes, so DMs can hand-edit homebrew into
+`spells.json`, `rules.json` or the crit tables and have it go live without a `!reload`. Subscribers are told the path of
+every changed file.
+
+Uses inotify on Linux, falling back to polling modification times elsewhere.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+from typing import Any, Awaitable, Callable, Optional
+
+from constants.paths import DATA_FILE_PATHS, GUILDS_DIR
+from utils.logging import get_logger
+
+LOGGER = get_logger(os.path.basename(__file__))
+
+# Seconds to wait for a burst of changes to a file to settle before publishing it (editors often write several times)
+DEBOUNCE_SECONDS = 0.1
+# Seconds between scans when polling
+POLL_INTERVAL = 0.5
+
+# inotify event flags, see `man 7 inotify`
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+INOTIFY_READ_SIZE = 64 * 1024
+
+Subscriber = Callable[[str], Awaitable[Any]]
+
+
+class DataWatcher:
+    """Publish changes to data files"""
+
+    def __init__(self: "DataWatcher", paths: list[str] = DATA_FILE_PATHS, guilds_dir: str = GUILDS_DIR) -> None:
+        """Init DataWatcher
+
+        Args:
+            paths (`list[str]`): Data files to watch. Defaults to `DATA_FILE_PATHS`.
+            guilds_dir (`str`): Directory containing guilds' data directories. Defaults to `GUILDS_DIR`.
+        """
+        self.file_names = {os.path.basename(path) for path in paths}
+        self.directories = sorted({os.path.dirname(path) for path in paths})
+        self.guilds_dir = guilds_dir
+        self.subscribers: list[Subscriber] = []
+        # Changes waiting for their debounce period to end
+        self.pending: dict[str, asyncio.TimerHandle] = {}
+        self.tasks: set[asyncio.Task] = set()
+        self.backend: Optional[str] = None
+        # inotify state
+        self.libc: Optional[ctypes.CDLL] = None
+        self.inotify_fd: Optional[int] = None
+        self.watch_descriptors: dict[int, str] = {}
+        # Polling state
+        self.poll_task: Optional[asyncio.Task] = None
+        self.mtimes: dict[str, tuple[int, int]] = {}
+
+    def subscribe(self: "DataWatcher", subscriber: Subscriber) -> None:
+        """Register a coroutine function to be called with the path of every changed data file
+
+        Args:
+            subscriber (`Subscriber`): Coroutine function to call
+        """
+        self.subscribers.append(subscriber)
+
+    def start(self: "DataWatcher") -> None:
+        """Start watching. Must be called from the event loop"""
+        try:
+            self._start_inotify()
+            self.backend = "inotify"
+        except (OSError, AttributeError) as error:
+            LOGGER.info("inotify unavailable (%s), polling data files for changes instead", error)
+            self.poll_task = asyncio.create_task(self._poll())
+            self.backend = "polling"
+
+    def stop(self: "DataWatcher") -> None:
+        """Stop watching"""
+        if self.inotify_fd is not None:
+            asyncio.get_running_loop().remove_reader(self.inotify_fd)
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+        if self.poll_task is not None:
+            self.poll_task.cancel()
+        for handle in self.pending.values():
+            handle.cancel()
+        self.pending.clear()
+
+    def _watched_directories(self: "DataWatcher") -> list[str]:
+        """Get every directory which may contain watched files
+
+        Returns:
+            `list[str]`: Global data directories, the guilds directory and each guild's data directory
+        """
+        directories = [*self.directories, self.guilds_dir]
+        if os.path.isdir(self.guilds_dir):
+            directories.extend(f"{self.guilds_dir}/{entry.name}" for entry in os.scandir(self.guilds_dir) if entry.is_dir())
+        return directories
+
+    def _schedule(self: "DataWatcher", path: str) -> None:
+        """Publish a change once the file has been left alone for the debounce period
+
+        Args:
+            path (`str`): Path to the changed file
+        """
+        if (handle := self.pending.pop(path, None)) is not None:
+            handle.cancel()
+        self.pending[path] = asyncio.get_running_loop().call_later(DEBOUNCE_SECONDS, self._publish, path)
+
+    def _publish(self: "DataWatcher", path: str) -> None:
+        """Tell every subscriber about a changed file
+
+        Args:
+            path (`str`): Path to the changed file
+        """
+        self.pending.pop(path, None)
+        for subscriber in self.subscribers:
+            task = asyncio.create_task(self._notify(subscriber, path))
+            # Hold a reference to the task until it's done, so it isn't garbage collected
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _notify(self: "DataWatcher", subscriber: Subscriber, path: str) -> None:
+        """Call a subscriber, logging any errors
+
+        Args:
+            subscriber (`Subscriber`): Coroutine function to call
+            path (`str`): Path to the changed file
+        """
+        try:
+            await subscriber(path)
+        except Exception as error:
+            LOGGER.exception("Data file subscriber failed for '%s'", path, exc_info=error)
+
+    def _publish_directory(self: "DataWatcher", directory: str) -> None:
+        """Publish every watched file in a directory, e.g. when events may have been missed
+
+        Args:
+            directory (`str`): Directory to publish files from
+        """
+        for name in self.file_names:
+            self._schedule(f"{directory}/{name}")
+
+    ###########
+    # inotify #
+    ###########
+
+    def _start_inotify(self: "DataWatcher") -> None:
+        """Watch for changes with inotify
+
+        Raises:
+            `OSError`: inotify isn't available
+        """
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.inotify_fd = fd
+        for directory in self._watched_directories():
+            self._add_watch(directory)
+        asyncio.get_running_loop().add_reader(fd, self._read_inotify_events)
+
+    def _add_watch(self: "DataWatcher", directory: str) -> None:
+        """Add an inotify watch on a directory
+
+        Args:
+            directory (`str`): Directory to watch
+        """
+        if not os.path.isdir(directory):
+            return
+        wd = self.libc.inotify_add_watch(self.inotify_fd, os.fsencode(directory), INOTIFY_MASK)
+        if wd < 0:
+            LOGGER.warning("Failed to watch '%s': %s", directory, os.strerror(ctypes.get_errno()))
+            return
+        self.watch_descriptors[wd] = directory
+
+    def _is_guild_tree(self: "DataWatcher", directory: str) -> bool:
+        """Check if a directory is the guilds directory or a guild's data directory
+
+        Args:
+            directory (`str`): Directory to check
+
+        Returns:
+            `bool`: True if files in the directory may need watching
+        """
+        return directory == self.guilds_dir or os.path.dirname(directory) == self.guilds_dir
+
+    def _watch_new_directory(self: "DataWatcher", directory: str) -> None:
+        """Start watching a newly created directory, including any guild directories created inside it before the watch was added
+
+        Args:
+            directory (`str`): Directory to watch
+        """
+        self._add_watch(directory)
+        self._publish_directory(directory)
+        if directory == self.guilds_dir:
+            for entry in os.scandir(directory):
+                if entry.is_dir():
+                    self._watch_new_directory(f"{directory}/{entry.name}")
+
+    def _read_inotify_events(self: "DataWatcher") -> None:
+        """Handle pending inotify events. Called by the event loop when the inotify file descriptor is readable"""
+        try:
+            buffer = os.read(self.inotify_fd, INOTIFY_READ_SIZE)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(buffer, offset)
+            name = buffer[offset + INOTIFY_EVENT.size : offset + INOTIFY_EVENT.size + length].rstrip(b"\0").decode()
+            offset += INOTIFY_EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped, assume everything changed
+                for directory in self.watch_descriptors.values():
+                    self._publish_directory(directory)
+            elif mask & IN_IGNORED:
+                self.watch_descriptors.pop(wd, None)
+            elif (directory := self.watch_descriptors.get(wd)) is not None:
+                path = f"{directory}/{name}"
+                if mask & IN_ISDIR:
+                    # Start watching new guild directories, and pick up anything written before the watch was added
+                    if mask & (IN_CREATE | IN_MOVED_TO) and self._is_guild_tree(path):
+                        self._watch_new_directory(path)
+                elif name in self.file_names:
+                    self._schedule(path)
+
+    ###########
+    # Polling #
+    ###########
+
+    def _scan(self: "DataWatcher") -> dict[str, tuple[int, int]]:
+        """Get the modification time and size of every watched file
+
+        Returns:
+            `dict[str, tuple[int, int]]`: Modification time (ns) and size of each existing file
+        """
+        mtimes = {}
+        for directory in self._watched_directories():
+            for name in self.file_names:
+                path = f"{directory}/{name}"
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                mtimes[path] = (stat.st_mtime_ns, stat.st_size)
+        return mtimes
+
+    async def _poll(self: "DataWatcher") -> None:
+        """Scan watched files for changes until stopped"""
+        self.mtimes = self._scan()
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            mtimes = self._scan()
+            for path in mtimes.keys() | self.mtimes.keys():
+                if mtimes.get(path) != self.mtimes.get(path):
+                    self._schedule(path)
+            self.mtimes = mtimes
@@ -4,11 +4,26 @@ GitHub: https://github.com/cbates8/Volo-Bot
 """
 
 import os
+import time
 
-from discord import Intents
-from discord.ext.commands import Bot
+from discord import Intents, MemberCacheFlags, Message
+from discord.ext.commands import Bot, Context
 
+from utils.context import VoloContext
+from utils.datasets import get_datasets_size, refresh_dataset, shrink_datasets
+from utils.ddb import get_ddb_entries_size, shrink_ddb_entries
+from utils.dispatch import Dispatcher
+from utils.executor import ExecutorService
+from utils.limits import ExpensiveWorkGate
 from utils.logging import get_logger
+from utils.memory import MemoryGovernor
+from utils.metrics import MetricsRegistry
+from utils.rolls import RollHistory
+from utils.tracing import Tracer
+from utils.usage import UsageRecorder
+from utils.warming import CacheWarmer
+from utils.watchdog import LoopWatchdog
+from utils.watcher import DataWatcher
 
 LOGGER = get_logger(os.path.basename(__file__))
 
@@ -22,9 +37,24 @@ TOKEN = os.getenv("DISCORD_TOKEN")
 # Define command prefix
 COMMAND_PREFIX = "!"
 
-# Define intents for the bot
-INTENTS = Intents.default()
-INTENTS.message_content = True
+# Memory profile, 'low' (default) or 'default'
+# No VoloBot command needs members or message history, so the 'low' profile only subscribes to the events we use
+# and turns off discord.py's member cache, message cache and guild chunking. 'default' keeps discord.py's defaults.
+MEMORY_PROFILE = os.getenv("MEMORY_PROFILE", "low").lower()
+
+if MEMORY_PROFILE == "default":
+    # Define intents for the bot
+    INTENTS = Intents.default()
+    INTENTS.message_content = True
+    CLIENT_OPTIONS = {"intents": INTENTS}
+else:
+    INTENTS = Intents(guilds=True, guild_messages=True, dm_messages=True, message_content=True)
+    CLIENT_OPTIONS = {
+        "intents": INTENTS,
+        "member_cache_flags": MemberCacheFlags.none(),
+        "max_messages": None,
+        "chunk_guilds_at_startup": False,
+    }
 
 # Add a description to the !help menu
 DESCRIPTION = """A Dungeons and Dragons bot based on Volothamp Geddarm.
@@ -32,7 +62,19 @@ DESCRIPTION = """A Dungeons and Dragons bot based on Volothamp Geddarm.
 Capable of rolling dice, checking critical hit tables, and more!"""
 
 # Cogs the bot should start with
-INITIAL_EXTENSIONS = ["commands.event", "commands.crit", "commands.dev", "commands.inventory", "commands.misc", "commands.spell", "commands.rule"]
+INITIAL_EXTENSIONS = [
+    "commands.event",
+    "commands.batch",
+    "commands.compendium",
+    "commands.crit",
+    "commands.dev",
+    "commands.initiative",
+    "commands.inventory",
+    "commands.misc",
+    "commands.spell",
+    "commands.rule",
+    "commands.reminders",
+]
 
 
 class VoloBot(Bot):
@@ -46,19 +88,101 @@ class VoloBot(Bot):
         """
         super().__init__(**kwargs)  # Pass kwargs to Bot constructor
         self.initial_extensions = extensions
+        self.metrics = MetricsRegistry()
+        # All outbound messages are sent through the dispatcher, which takes care of rate limiting
+        self.dispatcher = Dispatcher(self.metrics)
+        # Bounds how much expensive work (web scrapes, huge rolls, ...) runs at once
+        self.gate = ExpensiveWorkGate(self.metrics)
+        # Runs CPU-heavy work (HTML parsing, huge rolls) in worker processes
+        self.executor = ExecutorService(self.metrics)
+        # Times the stages of each command (see `!trace`)
+        self.tracer = Tracer(self.metrics)
+        # Reports event-loop lag, and what was blocking the loop when it stalls
+        self.watchdog = LoopWatchdog(self.metrics)
+        # Shrinks our own caches when the process goes over its soft memory limit
+        self.memory = MemoryGovernor(self.metrics)
+        self.memory.register("datasets", shrink_datasets, get_datasets_size)
+        self.memory.register("ddb_pages", shrink_ddb_entries, get_ddb_entries_size)
+        # Reloads cached data files when they are edited on disk
+        self.watcher = DataWatcher()
+        self.watcher.subscribe(refresh_dataset)
+        # Tracks which spells and rules are popular, so they can be kept warm in the response caches
+        self.usage = UsageRecorder()
+        self.warmer = CacheWarmer(self.usage, self.metrics, self.executor)
+        # Recent rolls in each channel, for roll stats
+        self.rolls = RollHistory()
+        self.memory.register("rolls", self.rolls.shrink, self.rolls.nbytes)
 
     async def setup_hook(self: "VoloBot") -> None:
         """A coroutine to be called to setup the bot.
 
-        In our case, that means loading our initial extensions (cogs).
+        In our case, that means starting our own services (e.g. the event-loop watchdog and data file watcher),
+        loading our initial extensions (cogs) and warming the response caches.
 
         Will be executed after the bot is logged in but before it has connected to the Websocket.
         This is only called once, in login, and will be called before any events are dispatched,
         making it a better solution than doing such setup in the `~discord.on_ready` event.
 
         """
+        self.watchdog.start()
+        self.tracer.start()
+        self.executor.start()
+        self.memory.start()
+        self.watcher.start()
+        await self.usage.load()
+        self.usage.start()
+        await self.rolls.load()
+        self.rolls.start()
         for extension in self.initial_extensions:
-            await bot.load_extension(extension)
+            await self.load_extension(extension)
+        self.warmer.start()
+
+    async def close(self: "VoloBot") -> None:
+        """Close the connection to Discord, stopping our own services first"""
+        self.watchdog.stop()
+        self.memory.stop()
+        self.watcher.stop()
+        self.warmer.stop()
+        self.usage.stop()
+        await self.usage.flush()
+        self.rolls.stop()
+        await self.rolls.save()
+        self.tracer.stop()
+        await self.tracer.flush()
+        await self.executor.close()
+        await self.dispatcher.close()
+        await super().close()
+
+    async def get_context(self: "VoloBot", origin: Message, *, cls: type[Context] = VoloContext) -> Context:
+        """Get the invocation context from a message, using `VoloContext` by default
+
+        Args:
+            origin (`Message`): The message to get the invocation context from
+            cls (`type[Context]`): The factory class that will be used to create the context. Defaults to `VoloContext`.
+
+        Returns:
+            `Context`: The invocation context
+        """
+        return await super().get_context(origin, cls=cls)
+
+    async def invoke(self: "VoloBot", ctx: Context) -> None:
+        """Invoke the command given under the invocation context, recording when it started.
+
+        The start time is used to report command latency in logs,
+        the watchdog is told which command is running in case it blocks the event loop,
+        and the command runs under the root span of its trace.
+
+        Args:
+            ctx (`Context`): The invocation context to invoke
+        """
+        ctx.started_at = time.perf_counter()
+        name = ctx.command.qualified_name if ctx.command else str(ctx.invoked_with)
+        self.watchdog.command_started(name)
+        try:
+            with self.tracer.trace(name, ctx.message.content):
+                await super().invoke(ctx)
+        finally:
+            self.watchdog.command_finished()
 
 
 ###############
@@ -67,5 +191,5 @@ class VoloBot(Bot):
 
 
 if __name__ == "__main__":
-    bot = VoloBot(extensions=INITIAL_EXTENSIONS, command_prefix=COMMAND_PREFIX, description=DESCRIPTION, intents=INTENTS)
+    bot = VoloBot(extensions=INITIAL_EXTENSIONS, command_prefix=COMMAND_PREFIX, description=DESCRIPTION, **CLIENT_OPTIONS)
     bot.run(TOKEN, log_handler=None)